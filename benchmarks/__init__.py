@@ -0,0 +1,33 @@
+# StdLib
+import json
+import random
+from typing import Iterator, List
+
+STATES = ['True', 'True', 'True', 'True', 'Warn', 'Alert', 'False']
+
+def synthetic_frames(count: int, namespaces: int=1000, tenants: int=50, seed: int=0) -> Iterator[str]:
+    """Yields count raw /ws/ns frames for a synthetic fleet, mostly healthy."""
+    rng = random.Random(seed)
+    envs = ['dev', 'stage', 'prod']
+    for _ in range(count):
+        i = rng.randrange(namespaces)
+        healthy = rng.choice(STATES)
+        frame = {
+            'kind': 'Namespace',
+            'name': f'ns-{i}',
+            'namespace': '',
+            'action': 'refresh',
+            'healthy': healthy,
+            'tenant': {'name': f'tenant-{i % tenants}', 'env': envs[i % len(envs)]},
+            'errors': [f'Deployment ns-{i}/app has 0/1 ready replicas'] if healthy == 'False' else [],
+            'warnings': ['Pod restarted 5 times'] if healthy == 'Warn' else [],
+            'alerts': ['Certificate expires in 7 days'] if healthy == 'Alert' else [],
+        }
+        yield json.dumps(frame)
+
+def load_frames(capture: str=None, count: int=100000) -> List[str]:
+    """Frames from a capture file when one is given, synthetic ones otherwise."""
+    if capture:
+        from bmspy import read_capture
+        return [frame for (ts, frame) in read_capture(capture)]
+    return list(synthetic_frames(count))
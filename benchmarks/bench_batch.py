@@ -0,0 +1,39 @@
+"""Compares frame-at-a-time processing with micro-batches of several sizes.
+
+    python -m benchmarks.bench_batch [--count N] [--capture CAPTURE_FILE]
+
+Frames go through BMSConsumer.process_msg (size 1) or process_batch and the
+Router into a null Slack sink, as if every frame had already been buffered."""
+# StdLib
+import argparse
+import asyncio
+import time
+
+# Internal deps
+from bmspy import BMSConsumer, Router, SinkSlackBot
+from benchmarks import load_frames
+
+async def pipeline(frames, batch_size: int) -> tuple:
+    slackbot = SinkSlackBot()
+    router = Router(slackbot, [{'channel': 'all', 'namespaces': ['/.*/']}, {'channel': 'tenants', 'tenants': ['tenant-1*']}])
+    bms = BMSConsumer('ws://bench', slackbot, router, batch_size=batch_size)
+    started = time.perf_counter()
+    if batch_size == 1:
+        for frame in frames:
+            await bms.process_msg(frame)
+    else:
+        for i in range(0, len(frames), batch_size):
+            await bms.process_batch(frames[i:i + batch_size])
+    return (time.perf_counter() - started, slackbot.sent)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=100000, help='number of synthetic frames')
+    parser.add_argument('--capture', help='replay a capture file instead of synthetic frames')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 16, 64, 256, 1024], help='batch sizes to compare')
+    args = parser.parse_args()
+
+    frames = load_frames(args.capture, args.count)
+    for size in args.sizes:
+        (elapsed, sent) = asyncio.run(pipeline(frames, size))
+        print(f'batch {size:5} {len(frames) / elapsed:12.0f} frames/s  {sent:7} notifications')
@@ -0,0 +1,57 @@
+"""Measures the CPU/bandwidth trade-off of permessage-deflate settings.
+
+    python -m benchmarks.bench_compression [--count N] [--capture CAPTURE_FILE]
+
+Frames are compressed the way permessage-deflate does it (raw deflate,
+Z_SYNC_FLUSH per message, trailing 0x0000ffff stripped), with and without
+context takeover, for a range of window bits and memLevels. Decompression
+time is what bmspy pays per frame; compression time is what bms-api pays."""
+# StdLib
+import argparse
+import time
+import zlib
+
+# Internal deps
+from benchmarks import load_frames
+
+def run(frames, window_bits: int, mem_level: int, level: int, takeover: bool):
+    payload = 0
+    wire = 0
+    compress_time = 0.0
+    decompress_time = 0.0
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -window_bits, mem_level)
+    decompressor = zlib.decompressobj(-window_bits)
+    for frame in frames:
+        data = frame.encode('utf-8')
+        payload += len(data)
+        if not takeover:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -window_bits, mem_level)
+            decompressor = zlib.decompressobj(-window_bits)
+
+        started = time.perf_counter()
+        compressed = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        compressed = compressed[:-4]
+        compress_time += time.perf_counter() - started
+
+        started = time.perf_counter()
+        decompressor.decompress(compressed + b'\x00\x00\xff\xff')
+        decompress_time += time.perf_counter() - started
+        wire += len(compressed)
+    return (payload, wire, compress_time, decompress_time)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=20000, help='number of synthetic frames')
+    parser.add_argument('--capture', help='use a capture file instead of synthetic frames')
+    parser.add_argument('--level', type=int, default=6, help='zlib compression level of the sender')
+    args = parser.parse_args()
+
+    frames = load_frames(args.capture, args.count)
+    payload = sum(len(frame.encode('utf-8')) for frame in frames)
+    print(f'{len(frames)} frames, {payload / 1e6:.2f} MB of payload')
+    print(f'{"takeover":>8} {"wbits":>5} {"mem":>3} {"ratio":>6} {"wire MB":>8} {"comp us/f":>9} {"decomp us/f":>11}')
+    for takeover in [True, False]:
+        for window_bits in [9, 11, 13, 15]:
+            for mem_level in [1, 4, 8, 9]:
+                (payload, wire, compress_time, decompress_time) = run(frames, window_bits, mem_level, args.level, takeover)
+                print(f'{str(takeover):>8} {window_bits:>5} {mem_level:>3} {payload / wire:>6.2f} {wire / 1e6:>8.2f} {1e6 * compress_time / len(frames):>9.2f} {1e6 * decompress_time / len(frames):>11.2f}')
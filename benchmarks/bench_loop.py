@@ -0,0 +1,50 @@
+"""Compares event loop implementations on the consume -> route pipeline.
+
+    python -m benchmarks.bench_loop [--count N] [--capture CAPTURE_FILE]
+
+Every frame goes through BMSConsumer.process_msg and the Router into a null
+Slack sink, the same path as `bmspy.py replay --speed 0`."""
+# StdLib
+import argparse
+import asyncio
+import time
+
+# Internal deps
+from bmspy import BMSConsumer, Router, SinkSlackBot
+from benchmarks import load_frames
+
+async def pipeline(frames) -> float:
+    slackbot = SinkSlackBot()
+    router = Router(slackbot, [{'channel': 'all', 'namespaces': ['/.*/']}, {'channel': 'tenants', 'tenants': ['tenant-1*']}])
+    bms = BMSConsumer('ws://bench', slackbot, router)
+    started = time.perf_counter()
+    for frame in frames:
+        await bms.process_msg(frame)
+    return time.perf_counter() - started
+
+def loops():
+    yield ('asyncio', asyncio.new_event_loop)
+    try:
+        import uvloop
+        yield ('uvloop', uvloop.new_event_loop)
+    except ImportError:
+        print('uvloop is not installed, skipping it')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=100000, help='number of synthetic frames')
+    parser.add_argument('--capture', help='replay a capture file instead of synthetic frames')
+    parser.add_argument('--rounds', type=int, default=3, help='best of this many rounds is reported')
+    args = parser.parse_args()
+
+    frames = load_frames(args.capture, args.count)
+    for (name, new_loop) in loops():
+        best = None
+        for _ in range(args.rounds):
+            loop = new_loop()
+            try:
+                elapsed = loop.run_until_complete(pipeline(frames))
+            finally:
+                loop.close()
+            best = elapsed if best == None else min(best, elapsed)
+        print(f'{name:8} {len(frames) / best:12.0f} frames/s ({best:.3f}s for {len(frames)} frames)')
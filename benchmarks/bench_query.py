@@ -0,0 +1,58 @@
+"""Times ColumnStore queries against a plain loop over the cache.
+
+    python -m benchmarks.bench_query [--count N]
+
+The store is filled with synthetic namespaces, then each query is run both
+column-wise and as the equivalent Python loop over HealthUpdates."""
+# StdLib
+import argparse
+import random
+import time
+
+# Internal deps
+from bmspy import ColumnStore, HealthUpdate
+
+QUERIES = [
+    ('tenant=tenant-3 env=prod state=unhealthy errors>3', lambda h: h.tenant == 'tenant-3' and h.env == 'prod' and h.healthy_str == 'Unhealthy' and len(h.errors) > 3),
+    ('state!=healthy', lambda h: h.healthy_str != 'Healthy'),
+    ('warnings>=1 by tenant', lambda h: len(h.warnings) >= 1),
+]
+
+def synthetic(count: int):
+    rng = random.Random(0)
+    for i in range(count):
+        yield HealthUpdate({
+            'kind': 'Namespace',
+            'name': f'ns-{i}',
+            'namespace': '',
+            'action': 'refresh',
+            'healthy': rng.choice(['True', 'True', 'True', 'False', 'Warning']),
+            'errors': ['error'] * rng.randint(0, 6),
+            'warnings': ['warning'] * rng.randint(0, 2),
+            'alerts': [],
+            'tenant': {'name': f'tenant-{i % 50}', 'env': rng.choice(['prod', 'stage', 'dev'])},
+        })
+
+def best_of(rounds: int, func) -> float:
+    times = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=100000, help='number of synthetic namespaces')
+    parser.add_argument('--rounds', type=int, default=5, help='best of this many rounds is reported')
+    args = parser.parse_args()
+
+    store = ColumnStore()
+    hupdates = list(synthetic(args.count))
+    for hupdate in hupdates:
+        store.update(hupdate)
+
+    for (query, predicate) in QUERIES:
+        columnar = best_of(args.rounds, lambda: store.query(query, limit=0))
+        loop = best_of(args.rounds, lambda: [h for h in hupdates if predicate(h)])
+        print(f'{query:55} columns {columnar * 1000:8.2f} ms   loop {loop * 1000:8.2f} ms   ({store.query(query, limit=0).count} rows)')
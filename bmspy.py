@@ -7,26 +7,169 @@ import dotenv
 import logging
 import os
 import sys
-from urllib.parse import urljoin, urlparse
+import tempfile
 import yaml
 
 # Internal deps
-from bmspy import BMSConsumer, Router, SlackBot
+from bmspy import Admission, BMSConsumer, Correlator, DecodePool, DeliveryQueue, HealthAPI, LoopMonitor, Profiler, Recorder, Replayer, Router, Silences, SinkSlackBot, SlackBot, Supervisor
+from bmspy.templates import compile_templates
+from bmspy.utils import ws_url
+from bmspy.wire import connect_options
 
 # External deps
 from pythonjsonlogger import jsonlogger
+from slack_sdk.errors import SlackApiError
 
 dotenv.load_dotenv()
 
+def build_router(slackbot: SlackBot, args: argparse.Namespace, config_values: dict) -> Router:
+    router = Router(slackbot, silences=Silences(slackbot), templates=compile_templates(config_values.get('templates', None)))
+    router.silences.add_dicts(config_values.get('silences', None) or [])
+    slackbot.silences = router.silences
+    if args.correlate_window > 0:
+        router.correlator = Correlator(slackbot, window=args.correlate_window, min_size=args.correlate_min)
+    if 'routes' in config_values.keys():
+        router.add_routes(config_values['routes'])
+    else:
+        logging.info('no routes defined in config_file')
+    if args.alert_channel:
+        # Add a default alert channel
+        router.add_route({'channel': args.alert_channel, 'namespaces': ['/.*/']})
+    return router
+
+def record(args: argparse.Namespace) -> None:
+    url = ws_url(args.source[0])
+    recorder = Recorder(url, args.output)
+    logging.info(f'Recording {url} to {args.output}...')
+    try:
+        asyncio.run(recorder.start())
+    except KeyboardInterrupt:
+        logging.info('Received keyboard interrupt signal. Closing capture...')
+    print(f'Recorded {recorder.frames} frames to {args.output}.')
+
+def replay(args: argparse.Namespace, config_values: dict) -> None:
+    slackbot = SinkSlackBot(keep=args.sink == 'mock')
+    router = build_router(slackbot, args, config_values)
+    bms = BMSConsumer('ws://replay', slackbot, router)
+    replayer = Replayer(args.capture, bms, speed=args.speed)
+    asyncio.run(replayer.run())
+
+    print(f'Replayed {replayer.frames} frames in {replayer.elapsed:.2f}s ({replayer.throughput:.1f} frames/s).')
+    print(f'{slackbot.sent} notifications would have been sent, and {slackbot.updated} updated.')
+    for message in slackbot.messages:
+        print(f"{message['channel']}: {message['text']}")
+
+async def run(args: argparse.Namespace, config_values: dict) -> None:
+    supervisor = Supervisor(drain_timeout=args.drain_timeout)
+
+    # SlackBot
+    logging.info('Initiating slack bot...')
+    slackbot = SlackBot(os.environ.get('SLACK_BOT_TOKEN'), args.source)
+    slackbot.admins = set(args.admin)
+    slackbot.admission = Admission(user_rate=args.user_rate / 60, channel_rate=args.channel_rate / 60,
+                                   max_fetches=args.max_fetches, reserved=1 if args.max_fetches > 1 else 0)
+    slackbot.profiler = Profiler(args.profile_dir)
+    slackbot.profiler.install_signal(args.profile_seconds)
+    supervisor.add('slackbot', slackbot.start)
+    logging.info('Slack bot initialized.')
+
+    # Routing
+    router = build_router(slackbot, args, config_values)
+    if args.delivery_concurrency > 0:
+        router.delivery = DeliveryQueue(slackbot.send_message, concurrency=args.delivery_concurrency, aging=args.delivery_aging)
+    try:
+        # Fail now rather than on every alert to a channel bmspy cannot post in
+        await slackbot.resolve_channels([route.channel for route in router.routes])
+    except ValueError as e:
+        logging.error(f'misconfigured routes: {e}')
+        sys.exit(1)
+    except SlackApiError as e:
+        if e.response.get('error', None) == 'missing_scope':
+            needed = e.response.get('needed', None) or 'channels:read,groups:read'
+            logging.error(f'the Slack token lacks the {needed} scope needed to list channels, add it to the Slack app and reinstall it')
+        else:
+            logging.error(f'could not list Slack channels: {e.response.get("error", e)}')
+        sys.exit(1)
+    supervisor.add_drain(router.drain)
+    supervisor.add('silences', router.silences.run)
+
+    # BMS websocket consumer
+    logging.info('Initiating BMS websocket consumer...')
+    workload_urls = [ws_url(args.source[0], f'/ws/{kind}') for kind in args.workloads]
+    options = connect_options(args.ws_compression == 'deflate', window_bits=args.ws_window_bits, mem_level=args.ws_mem_level)
+    decode_pool = None
+    if args.decode_workers > 0:
+        decode_pool = DecodePool(args.decode_workers)
+        decode_pool.start()
+        supervisor.add_drain(decode_pool.close)
+    bms = BMSConsumer(ws_url(args.source[0]), slackbot, router, workload_urls=workload_urls, connect_options=options,
+                      cache_max_size=args.cache_max_size, cache_ttl=args.cache_ttl, batch_size=args.batch_size, batch_wait=args.batch_wait,
+                      decode_pool=decode_pool)
+    slackbot.consumer = bms
+    supervisor.add('consumer', bms.start)
+    logging.info('BMS websocket consumer initialized.')
+
+    # Read-only HTTP API over the consumer cache
+    if args.api_port:
+        api = HealthAPI(bms, port=args.api_port)
+        await api.start()
+
+    # Diagnostics
+    if args.loop_lag_threshold > 0:
+        supervisor.add('loop-monitor', LoopMonitor(threshold=args.loop_lag_threshold).run)
+
+    # Away we go...
+    await supervisor.run()
+    logging.info('Shutdown complete. Sayounara señoras y señores.')
+
+def use_loop(name: str) -> None:
+    if name == 'uvloop':
+        try:
+            import uvloop
+        except ImportError:
+            logging.error('uvloop is not installed, install it or use --loop=asyncio')
+            sys.exit(1)
+        uvloop.install()
+
 # Do work.
 if __name__ == '__main__':
-    # TODO: Setup argparse for these
     parser = argparse.ArgumentParser()
+    parser.add_argument('--admin', action='append', default=[u for u in os.environ.get('BMSPY_ADMINS', '').split(',') if u], metavar='USER_ID', help='Slack user id allowed to run admin commands (repeatable)')
     parser.add_argument('-a', '--alert-channel', default=os.environ.get('BMSPY_ALERT_CHANNEL', None), metavar='CHANNEL', help='Slack channel to send health updates to')
+    parser.add_argument('--api-port', type=int, default=os.environ.get('BMSPY_API_PORT', None), metavar='PORT', help='serve the health cache over HTTP on this port')
+    parser.add_argument('--batch-size', type=int, default=1, metavar='N', help='process up to N buffered frames per batch, keeping the latest per namespace (1: off)')
+    parser.add_argument('--batch-wait', type=float, default=0, metavar='SECONDS', help='hold a batch open this long for more frames')
+    parser.add_argument('--cache-max-size', type=int, default=0, metavar='N', help='most namespaces to keep cached, least recently updated are evicted (0: no limit)')
+    parser.add_argument('--cache-ttl', type=float, default=0, metavar='SECONDS', help='evict namespaces not updated for this long (0: never)')
+    parser.add_argument('--channel-rate', type=float, default=20, metavar='PER_MINUTE', help='commands a channel may run per minute before getting cached answers')
     parser.add_argument('-c', '--config', default='settings.yaml', metavar='CONFIG_FILE', help='config file to use')
+    parser.add_argument('--correlate-min', type=int, default=3, metavar='N', help='namespaces going unhealthy together that make an incident')
+    parser.add_argument('--correlate-window', type=float, default=60.0, metavar='SECONDS', help='group unhealthy namespaces sharing tenant/env or errors within this window into one incident message (0: off)')
+    parser.add_argument('--decode-workers', type=int, default=0, metavar='N', help='decode frames in N worker processes, best with --batch-size (0: in process)')
+    parser.add_argument('--delivery-aging', type=float, default=10.0, metavar='SECONDS', help='how long a message waits before it overtakes the next more urgent class')
+    parser.add_argument('--delivery-concurrency', type=int, default=0, metavar='N', help='send at most N Slack messages at once, most urgent first (0: all at once, in arrival order)')
+    parser.add_argument('--drain-timeout', type=float, default=10.0, metavar='SECONDS', help='time allowed on shutdown to send pending Slack messages')
     parser.add_argument('--log-format', choices=['json', 'text'], default='text', help='format for log messages')
     parser.add_argument('-l', '--log-level', choices=['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG'], default='WARNING', help='level to show log messages')
+    parser.add_argument('--loop-lag-threshold', type=float, default=0.25, metavar='SECONDS', help='log the stack of callbacks blocking the event loop this long (0: off)')
+    parser.add_argument('--loop', choices=['asyncio', 'uvloop'], default=os.environ.get('BMSPY_LOOP', 'asyncio'), help='event loop implementation')
+    parser.add_argument('--max-fetches', type=int, default=4, metavar='N', help='concurrent bms-api fetches for Slack commands, one is kept for button clicks')
+    parser.add_argument('--profile-dir', default=os.environ.get('BMSPY_PROFILE_DIR', tempfile.gettempdir()), metavar='DIR', help='where SIGUSR1 and the profile command write reports')
+    parser.add_argument('--profile-seconds', type=float, default=30.0, metavar='SECONDS', help='how long SIGUSR1 profiles for')
     parser.add_argument('-s', '--source', nargs='+', help='bms url(s) to monitor/query')
+    parser.add_argument('--user-rate', type=float, default=5, metavar='PER_MINUTE', help='commands a user may run per minute before getting cached answers')
+    parser.add_argument('--ws-compression', choices=['deflate', 'none'], default='deflate', help='negotiate permessage-deflate with bms-api')
+    parser.add_argument('--ws-window-bits', type=int, choices=range(9, 16), default=None, metavar='9-15', help='max window bits bms-api may compress with (default: server choice)')
+    parser.add_argument('--ws-mem-level', type=int, choices=range(1, 10), default=8, metavar='1-9', help='zlib memLevel for outbound compression')
+    parser.add_argument('-w', '--workloads', nargs='+', default=[], metavar='KIND', help='also subscribe to workload streams, eg. deployments for /ws/deployments')
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND', help='run the bot when omitted')
+    record_parser = subparsers.add_parser('record', help='capture raw BMS websocket frames to a file')
+    record_parser.add_argument('-s', '--source', nargs='+', default=argparse.SUPPRESS, help='bms url to record from')
+    record_parser.add_argument('-o', '--output', default='bms-capture.jsonl.gz', metavar='CAPTURE_FILE', help='capture file to append to')
+    replay_parser = subparsers.add_parser('replay', help='feed a capture through the consumer and router')
+    replay_parser.add_argument('capture', metavar='CAPTURE_FILE', help='capture file to replay')
+    replay_parser.add_argument('--speed', type=float, default=1.0, help='multiple of the recorded pace, 0 for as fast as possible')
+    replay_parser.add_argument('--sink', choices=['null', 'mock'], default='null', help='null only counts notifications, mock also lists them')
     args = parser.parse_args()
 
     # Setup logging
@@ -39,51 +182,24 @@ if __name__ == '__main__':
         logging.basicConfig(level=args.log_level)
 
     # Load config file
+    config_values = {}
     if os.path.exists(args.config):
         try:
             with open(args.config, 'r') as config_file:
-                config_values = yaml.safe_load(config_file)
+                config_values = yaml.safe_load(config_file) or {}
         except Exception:
             logging.error('failed to parse config_file as yaml')
             raise
     else:
         logging.warning(f'config file not found. running with sane defaults.')
 
-    loop = asyncio.get_event_loop()
-    try:
-        # SlackBot
-        logging.info('Initiating slack bot...')
-        slackbot = SlackBot(os.environ.get('SLACK_BOT_TOKEN'), args.source)
-        loop.create_task(slackbot.start())
-        logging.info('Slack bot initialized.')
-
-        # Routing
-        router = Router(slackbot)
-        if 'routes' in config_values.keys():
-            router.add_routes(config_values['routes'])
-        else:
-            logging.info('no routes defined in config_file')
-
-        # BMS websocket consumer
-        if args.alert_channel:
-            # Add a default alert channel
-            router.add_route({'channel': args.alert_channel, 'namespaces': '/.*/'})
-        logging.info('Initiating BMS websocket consumer...')
-        parse_result = urlparse(args.source[0])
-        if parse_result.scheme == 'https':
-            parse_result = parse_result._replace(scheme='wss')
-        else:
-            parse_result = parse_result._replace(scheme='ws')
-        url = urljoin(parse_result.geturl(), '/ws/ns')
-        bms = BMSConsumer(url, slackbot, router)
-        loop.create_task(bms.start())
-        logging.info('BMS websocket consumer initialized.')
-
-        # Away we go...
-        loop.run_forever()
-    except KeyboardInterrupt:
-        logging.info('Received keyboard interrupt signal. Closing down event loop and exiting...')
-    finally:
-        logging.info('Shutting down event loop and exiting...')
-        loop.close()
-        logging.info('Shutdown complete. Sayounara señoras y señores.')
+    if args.command != 'replay' and not args.source:
+        parser.error('--source is required')
+
+    use_loop(args.loop)
+    if args.command == 'record':
+        record(args)
+    elif args.command == 'replay':
+        replay(args, config_values)
+    else:
+        asyncio.run(run(args, config_values))
@@ -1,6 +1,24 @@
+from .admission import *
+from .api import *
+from .breaker import *
 from .builder import *
+from .cache import *
+from .channels import *
+from .columns import *
 from .consumer import *
+from .delivery import *
+from .fetch import *
 from .health_update import *
+from .history import *
+from .incidents import *
+from .pipeline import *
+from .profiler import *
+from .recorder import *
+from .rollup import *
 from .router import *
+from .silences import *
 from .slack_bot import *
-from .utils import *
\ No newline at end of file
+from .supervisor import *
+from .templates import *
+from .utils import *
+from .wire import *
\ No newline at end of file
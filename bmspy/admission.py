@@ -0,0 +1,135 @@
+# StdLib
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+import time
+from typing import AsyncIterator, Deque, Dict, Optional, Tuple
+
+class Busy(Exception):
+    """Raised instead of queueing when upstream fetches are saturated."""
+
+class TokenBucket:
+    """Allows burst requests at once, refilled at rate per second."""
+    __slots__ = ['rate', 'burst', 'tokens', 'updated']
+
+    def __init__(self, rate: float, burst: float, now: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now: float) -> float:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+class Admission:
+    """Admission control for Slack commands.
+
+    Every command takes a token from the bucket of its user and of its
+    channel, so one person or one busy incident channel cannot monopolise
+    the bot. Upstream bms-api fetches share max_fetches slots: up to
+    max_waiting more wait for one and anything beyond raises Busy at once.
+    Priority fetches (interactive button clicks) skip the queue and may use
+    reserved slots that ordinary commands cannot."""
+    MAX_BUCKETS = 10000
+
+    def __init__(self, user_rate: float=5/60, user_burst: float=3, channel_rate: float=20/60, channel_burst: float=10,
+                 max_fetches: int=4, max_waiting: int=8, reserved: int=1) -> None:
+        if max_fetches < 1:
+            raise ValueError('max_fetches must be at least 1')
+        if reserved >= max_fetches:
+            raise ValueError('reserved must be less than max_fetches')
+
+        self._user = (user_rate, user_burst)
+        self._channel = (channel_rate, channel_burst)
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._max_fetches = max_fetches
+        self._max_waiting = max_waiting
+        self._reserved = reserved
+        self._active = 0
+        self._waiting: Deque[asyncio.Future] = deque()
+        self._priority_waiting: Deque[asyncio.Future] = deque()
+
+        self.admitted = 0
+        self.rate_limited = 0
+        self.busy = 0
+
+    def allow(self, user: Optional[str], channel: Optional[str], now: Optional[float]=None) -> bool:
+        """Takes a token for user and channel, or returns False if either is exhausted."""
+        now = time.monotonic() if now == None else now
+        buckets = []
+        if user:
+            buckets.append(self._bucket(('user', user), self._user, now))
+        if channel:
+            buckets.append(self._bucket(('channel', channel), self._channel, now))
+        if any(bucket.refill(now) < 1 for bucket in buckets):
+            self.rate_limited += 1
+            return False
+        for bucket in buckets:
+            bucket.tokens -= 1
+        self.admitted += 1
+        return True
+
+    def _bucket(self, key: Tuple[str, str], limits: Tuple[float, float], now: float) -> TokenBucket:
+        bucket = self._buckets.get(key, None)
+        if bucket == None:
+            if len(self._buckets) >= self.MAX_BUCKETS:
+                # Full buckets carry no state, they are the same as new ones
+                self._buckets = {k: b for (k, b) in self._buckets.items() if b.refill(now) < b.burst}
+            bucket = self._buckets[key] = TokenBucket(limits[0], limits[1], now)
+        return bucket
+
+    @asynccontextmanager
+    async def fetch(self, priority: bool=False) -> AsyncIterator[None]:
+        """Holds one of the upstream fetch slots for the duration of the block."""
+        await self._acquire(priority)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _free(self, priority: bool) -> bool:
+        limit = self._max_fetches if priority else self._max_fetches - self._reserved
+        return self._active < limit
+
+    async def _acquire(self, priority: bool) -> None:
+        if self._free(priority) and (priority or not self._priority_waiting):
+            self._active += 1
+            return
+        queue = self._priority_waiting if priority else self._waiting
+        if not priority and len(queue) >= self._max_waiting:
+            self.busy += 1
+            raise Busy('too many bms-api fetches in progress')
+        waiter = asyncio.get_running_loop().create_future()
+        queue.append(waiter)
+        try:
+            # _release hands the slot over by resolving the future
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            else:
+                queue.remove(waiter)
+            raise
+
+    def _release(self) -> None:
+        self._active -= 1
+        for (queue, priority) in [(self._priority_waiting, True), (self._waiting, False)]:
+            while queue and self._free(priority):
+                waiter = queue.popleft()
+                if not waiter.done():
+                    self._active += 1
+                    waiter.set_result(None)
+            if queue:
+                # Ordinary waiters never overtake priority ones
+                return
+
+    def stats(self) -> dict:
+        return {
+            'admitted': self.admitted,
+            'rate_limited': self.rate_limited,
+            'busy': self.busy,
+            'fetches': self._active,
+            'waiting': len(self._waiting) + len(self._priority_waiting),
+        }
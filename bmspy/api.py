@@ -0,0 +1,159 @@
+# StdLib
+import gzip
+import hashlib
+import json
+import logging
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+# Internal deps
+from .consumer import BMSConsumer
+from .health_update import HealthUpdate
+
+# External deps
+from aiohttp import web
+
+class Snapshot(NamedTuple):
+    """A serialised response, in both plain and gzip encodings."""
+    generation: int
+    status: int
+    body: bytes
+    etag: str
+    gzip_body: bytes
+    gzip_etag: str
+
+class HealthAPI:
+    """A read-only HTTP API serving the BMSConsumer cache.
+
+    GET /ns/                 all namespaces, optionally ?tenant=<x>&state=<healthy_str>
+    GET /ns/{name}           a single namespace, with the state rolled up from its workloads
+    GET /query?q=<query>     counts, names and groups matching a ColumnStore query
+    GET /stats               cache size, websocket traffic per source and delivery waits
+    GET /healthz             liveness
+    GET /readyz              200 once the consumer cache is warm, 503 before
+
+    Responses are serialised once per cache generation and shared between
+    requests, carry strong ETags (one per encoding) and honour If-None-Match."""
+
+    MAX_SNAPSHOTS = 1024
+
+    def __init__(self, consumer: BMSConsumer, host: str='0.0.0.0', port: int=8080) -> None:
+        self._consumer = consumer
+        self._host = host
+        self._port = port
+        self._snapshots: Dict[Tuple[str, ...], Snapshot] = {}
+        self._snapshots_generation = -1
+
+        self._app = web.Application()
+        self._app.router.add_get('/ns/', self.handle_namespaces)
+        self._app.router.add_get('/ns/{name}', self.handle_namespace)
+        self._app.router.add_get('/query', self.handle_query)
+        self._app.router.add_get('/stats', self.handle_stats)
+        self._app.router.add_get('/healthz', self.handle_healthz)
+        self._app.router.add_get('/readyz', self.handle_readyz)
+
+    @property
+    def app(self) -> web.Application:
+        return self._app
+
+    async def start(self) -> None:
+        runner = web.AppRunner(self._app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, self._host, self._port)
+        await site.start()
+        logging.info(f'Health API listening on {self._host}:{self._port}')
+
+    async def handle_healthz(self, request: web.Request) -> web.Response:
+        return web.json_response({'status': 'ok'})
+
+    async def handle_readyz(self, request: web.Request) -> web.Response:
+        if self._consumer.warm:
+            return web.json_response({'status': 'ready', 'namespaces': len(self._consumer.cache)})
+        return web.json_response({'status': 'cache not populated'}, status=503)
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            'namespaces': len(self._consumer.cache),
+            'generation': self._consumer.generation,
+            'cache': self._consumer.cache_stats(),
+            'batching': self._consumer.batch_stats(),
+            'delivery': self._consumer.delivery_stats(),
+            'sources': {url: stats.snapshot() for (url, stats) in self._consumer.wire_stats.items()},
+        })
+
+    async def handle_namespaces(self, request: web.Request) -> web.Response:
+        tenant = request.query.get('tenant', None)
+        state = request.query.get('state', None)
+        if state != None and state not in HealthUpdate.STATES:
+            raise web.HTTPBadRequest(text=f'state must be one of {", ".join(HealthUpdate.STATES)}')
+        snapshot = self._snapshot(('ns', tenant or '', state or ''), lambda: (200, self._select(tenant, state)))
+        return self._respond(request, snapshot)
+
+    async def handle_query(self, request: web.Request) -> web.Response:
+        text = request.query.get('q', '')
+        limit = request.query.get('limit', '100')
+        if not limit.isdigit():
+            raise web.HTTPBadRequest(text='limit must be a number')
+
+        def build():
+            try:
+                return (200, self._consumer.columns.query(text, limit=int(limit))._asdict())
+            except ValueError as e:
+                return (400, {'error': str(e)})
+
+        return self._respond(request, self._snapshot(('query', text, limit), build))
+
+    async def handle_namespace(self, request: web.Request) -> web.Response:
+        name = request.match_info['name']
+
+        def build():
+            hupdate = self._consumer.cache.get(name, None)
+            if hupdate == None:
+                return (404, {'error': f'namespace {name} not found'})
+            obj = hupdate.to_dict()
+            workloads = self._consumer.workload_summary(name)
+            if workloads != None:
+                obj['workloads'] = workloads
+            return (200, obj)
+
+        return self._respond(request, self._snapshot(('name', name), build))
+
+    def _select(self, tenant: Optional[str], state: Optional[str]) -> Iterable[dict]:
+        cache = self._consumer.cache
+        if tenant == None and state == None:
+            names: Iterable[str] = sorted(cache.keys())
+        else:
+            rollup = self._consumer.rollup
+            states = [state] if state != None else HealthUpdate.STATES
+            names = sorted(name for s in states for name in rollup.members(s, tenant))
+        return [cache[name].to_dict() for name in names if name in cache]
+
+    def _snapshot(self, key: Tuple[str, ...], build) -> Snapshot:
+        generation = self._consumer.generation
+        if generation != self._snapshots_generation:
+            self._snapshots = {}
+            self._snapshots_generation = generation
+        snapshot = self._snapshots.get(key, None)
+        if snapshot == None:
+            (status, obj) = build()
+            body = json.dumps(obj, separators=(',', ':')).encode('utf-8')
+            etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+            snapshot = Snapshot(generation, status, body, f'"{etag}"', gzip.compress(body, compresslevel=6), f'"{etag}-gz"')
+            if len(self._snapshots) >= self.MAX_SNAPSHOTS:
+                self._snapshots = {}
+            self._snapshots[key] = snapshot
+        return snapshot
+
+    def _respond(self, request: web.Request, snapshot: Snapshot) -> web.Response:
+        use_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+        etag = snapshot.gzip_etag if use_gzip else snapshot.etag
+        headers = {'ETag': etag, 'Vary': 'Accept-Encoding', 'Cache-Control': 'no-cache'}
+        if snapshot.status == 200:
+            if_none_match = request.headers.get('If-None-Match', '')
+            if etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+                return web.Response(status=304, headers=headers)
+        if use_gzip:
+            headers['Content-Encoding'] = 'gzip'
+            body = snapshot.gzip_body
+        else:
+            body = snapshot.body
+        return web.Response(status=snapshot.status, body=body, headers=headers, content_type='application/json')
@@ -0,0 +1,132 @@
+# StdLib
+from collections import deque
+from contextlib import asynccontextmanager
+import logging
+import time
+from typing import AsyncIterator, Callable, Deque
+
+class BreakerOpen(ConnectionError):
+    """Raised instead of calling upstream while the CircuitBreaker is open.
+    A ConnectionError, so reconnect loops back off on it like on any other."""
+
+class CircuitBreaker:
+    """Stops calling an upstream that is failing, and probes it to recover.
+
+    closed: calls go through. The outcomes of the last window calls are
+    kept; a call fails when it raises an exception is_failure accepts or
+    takes longer than slow_call seconds (other exceptions are successes).
+    Once min_calls are known and failure_rate of them failed, the breaker
+    opens.
+    open: calls raise BreakerOpen at once, for cooldown seconds.
+    half-open: one probe call goes through. Success closes the breaker,
+    failure opens it for another cooldown."""
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name: str='bms-api', failure_rate: float=0.5, slow_call: float=5.0, window: int=20, min_calls: int=5, cooldown: float=30.0,
+                 is_failure: Callable[[BaseException], bool]=lambda e: True) -> None:
+        if not 0 < failure_rate <= 1:
+            raise ValueError('failure_rate must be in (0, 1]')
+        if min_calls < 1 or min_calls > window:
+            raise ValueError('min_calls must be between 1 and window')
+
+        self.name = name
+        self._failure_rate = failure_rate
+        self._slow_call = slow_call
+        self._min_calls = min_calls
+        self._cooldown = cooldown
+        self._is_failure = is_failure
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+
+        self.opens = 0
+        self.rejected = 0
+        self.failures = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() >= self.retry_at:
+            return self.HALF_OPEN
+        return self._state
+
+    @property
+    def retry_at(self) -> float:
+        """When (time.monotonic) an open breaker lets a probe through."""
+        return self._opened_at + self._cooldown
+
+    @property
+    def open_for(self) -> float:
+        """Seconds since the breaker opened, 0 when closed."""
+        return 0.0 if self._state == self.CLOSED else time.monotonic() - self._opened_at
+
+    def _admit(self, now: float) -> bool:
+        """Whether a call may go through now; True makes it the probe when half-open."""
+        if self._state == self.CLOSED:
+            return True
+        if self._state == self.OPEN and now >= self.retry_at:
+            self._state = self.HALF_OPEN
+        if self._state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    @asynccontextmanager
+    async def call(self, timed: bool=True) -> AsyncIterator[None]:
+        """Wraps one upstream call, raising BreakerOpen instead when open.
+        timed=False does not count slowness, eg. for a long streamed list."""
+        now = time.monotonic()
+        if not self._admit(now):
+            self.rejected += 1
+            raise BreakerOpen(f'{self.name} circuit breaker is open')
+        probe = self._state == self.HALF_OPEN
+        try:
+            yield
+        except Exception as e:
+            # Exceptions is_failure rejects, eg. a 404, are upstream answering
+            self._record(not self._is_failure(e), probe)
+            raise
+        except BaseException:
+            # Cancelled or closed early: no outcome
+            if probe:
+                self._probing = False
+            raise
+        else:
+            self._record(not timed or time.monotonic() - now <= self._slow_call, probe)
+
+    def _record(self, ok: bool, probe: bool) -> None:
+        if not ok:
+            self.failures += 1
+        if probe:
+            self._probing = False
+            if ok:
+                logging.info(f'{self.name} recovered, closing its circuit breaker')
+                self._state = self.CLOSED
+                self._outcomes.clear()
+            else:
+                self._open()
+            return
+        if self._state != self.CLOSED:
+            # A call admitted before the breaker opened
+            return
+        self._outcomes.append(ok)
+        failed = self._outcomes.count(False)
+        if len(self._outcomes) >= self._min_calls and failed >= self._failure_rate * len(self._outcomes):
+            logging.error(f'{self.name}: {failed} of the last {len(self._outcomes)} calls failed, opening its circuit breaker for {self._cooldown:.0f}s')
+            self._open()
+
+    def _open(self) -> None:
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self.opens += 1
+
+    def stats(self) -> dict:
+        return {
+            'state': self.state,
+            'opens': self.opens,
+            'rejected': self.rejected,
+            'failures': self.failures,
+            'open_for': round(self.open_for, 1),
+        }
@@ -1,12 +1,16 @@
 # StdLib
 from collections import defaultdict
+from datetime import datetime, timezone
 import os
-from typing import List, Type, Union
+from typing import Dict, List, Optional, Tuple, Type, Union
 
 # Internal deps
+from .columns import QueryResult
 from .health_update import HealthUpdate
+from .history import HistoryStats
 from .utils import (
     alerts_markdown,
+    duration_str,
     errors_markdown,
     warnings_markdown,
 )
@@ -33,6 +37,50 @@ class Builder:
         'Unknown': ':question:',
     }
 
+    def content_change_msg(obj: HealthUpdate, previous: HealthUpdate) -> List[Type[Block]]:
+        """Create a Slack message for an Update whose errors, warnings or alerts
+        changed without a state transition. Only added and removed lines are shown."""
+        icon = Builder.ICONS.get(obj.healthy_str, ':interrobang:')
+        text = f'{icon} [{obj.kind}] {obj.path} changed while {obj.healthy_str}'
+
+        added: List[str] = []
+        removed: List[str] = []
+        for (render, new, old) in [(errors_markdown, obj.errors, previous.errors), (warnings_markdown, obj.warnings, previous.warnings), (alerts_markdown, obj.alerts, previous.alerts)]:
+            old_set = set(old)
+            new_set = set(new)
+            lines = render([item for item in new if item not in old_set])
+            if lines:
+                added.append(lines)
+            lines = render([f'~{item}~' for item in old if item not in new_set])
+            if lines:
+                removed.append(lines)
+
+        blocks: List[Type[Block]] = []
+        blocks.append(
+            HeaderBlock(
+                text = PlainTextObject(
+                    text = text
+                )
+            )
+        )
+        if added:
+            blocks.append(
+                SectionBlock(
+                    text = MarkdownTextObject(
+                        text = '*New:*' + os.linesep + os.linesep.join(added)
+                    )
+                )
+            )
+        if removed:
+            blocks.append(
+                SectionBlock(
+                    text = MarkdownTextObject(
+                        text = '*Resolved:*' + os.linesep + os.linesep.join(removed)
+                    )
+                )
+            )
+        return blocks
+
     def details(obj: Type[HealthUpdate]) -> List[Type[Block]]:
         blocks: List[Type[Block]] = []
         if obj.healthy_str != 'Healthy':
@@ -63,7 +111,34 @@ class Builder:
                 )
         return blocks
 
-    def health(objs: Union[HealthUpdate, List[HealthUpdate]], details: bool=False) -> List[Type[Block]]:
+    def workloads(workloads: List[HealthUpdate], limit: int=10) -> List[Type[Block]]:
+        """The health of a namespace rolled up from its workloads: the worst
+        state, the counts per state and the workloads that are not Healthy."""
+        if not workloads:
+            return []
+        counts: Dict[str, int] = defaultdict(int)
+        for workload in workloads:
+            counts[workload.healthy_str] += 1
+        worst = max(workloads, key=lambda workload: workload.state_code).healthy_str
+        statuses = [f'{state.lower()}({counts[state]})' for state in HealthUpdate.STATES if counts[state]]
+        lines = [f'*Workloads*: {Builder.ICONS.get(worst, ":interrobang:")} *{worst}*, {", ".join(statuses)}']
+        failing = sorted((w for w in workloads if w.healthy_str != 'Healthy'), key=lambda w: (-w.state_code, w.kind, w.name))
+        for workload in failing[:limit]:
+            lines.append(f'{Builder.ICONS.get(workload.healthy_str, ":interrobang:")} [{workload.kind}] {workload.name}')
+        if len(failing) > limit:
+            lines.append(f'... and {len(failing) - limit} more')
+        return [
+            DividerBlock(),
+            SectionBlock(
+                text = MarkdownTextObject(
+                    text = os.linesep.join(lines)[:3000]
+                )
+            ),
+        ]
+
+    def health(objs: Union[HealthUpdate, List[HealthUpdate]], details: bool=False, workloads: Optional[List[HealthUpdate]]=None) -> List[Type[Block]]:
+        """Create the Slack message for the health of objs. With details, a
+        single namespace also shows what its workloads roll up to."""
         # Validate
         if isinstance(objs, HealthUpdate):
             objs = [objs]
@@ -74,54 +149,46 @@ class Builder:
         else:
             raise ValueError('objs variable must be an instance of HealthUpdate or List[HealthUpdate]')
 
-        # Collect data
-        icon = Builder.ICONS.get(obj.healthy_str, ':interrobang:')
-        mrkdown = f'{icon} [{obj.kind}] *{obj.name}* state: *{obj.healthy_str}*.'
-
         # Building blocks
         blocks: List[Type[Block]] = []
-        blocks.append(
-            SectionBlock(
-                text = MarkdownTextObject(
-                    text = mrkdown
+        for obj in objs:
+            icon = Builder.ICONS.get(obj.healthy_str, ':interrobang:')
+            mrkdown = f'{icon} [{obj.kind}] *{obj.path}* state: *{obj.healthy_str}*.'
+            blocks.append(
+                SectionBlock(
+                    text = MarkdownTextObject(
+                        text = mrkdown
+                    )
                 )
             )
-        )
-        if details:
-            blocks.extend(Builder.details(obj))
+            if details:
+                blocks.extend(Builder.details(obj))
+                if workloads and obj.is_namespace:
+                    blocks.extend(Builder.workloads(workloads))
 
         return blocks
 
-    def health_overview(objs: Type[HealthUpdate]) -> List[Type[Block]]:
-        """A health_overview is a one-line list of states and their counts along with a list of namespaces that are unhealthy."""
-
+    def health_summary(counts: Dict[str, int], unhealthy: List[HealthUpdate], title: str='Overall health') -> List[Type[Block]]:
+        """A one-line list of states and their counts along with a list of namespaces that are unhealthy."""
         # Build the summary text
-        collection = defaultdict(lambda: [])
-        for ns in objs:
-            collection[ns.healthy_str].append(ns)
         statuses = []
-        if len(collection['Healthy']):
-            statuses.append(f'healthy({len(collection["Healthy"])})')
-        if len(collection['Unhealthy']):
-            statuses.append(f'unhealthy({len(collection["Unhealthy"])})')
-        if len(collection['Warning']):
-            statuses.append(f'warning({len(collection["Warning"])})')
-        if len(collection['Alert']):
-            statuses.append(f'alert({len(collection["Alert"])})')
+        for state in ['Healthy', 'Unhealthy', 'Warning', 'Alert']:
+            if counts.get(state, 0):
+                statuses.append(f'{state.lower()}({counts[state]})')
 
         # Building Blocks
         blocks: List[Type[Block]] = []
         blocks.append(
             HeaderBlock(
                 text = PlainTextObject(
-                    text = f':medical_symbol: Overall health: {", ".join(statuses)}'
+                    text = f':medical_symbol: {title}: {", ".join(statuses)}'
                 )
             )
         )
-        if len(collection['Unhealthy']):
+        if len(unhealthy):
             blocks.append(DividerBlock())
             lines: List[str] = []
-            for ns in collection['Unhealthy']:
+            for ns in unhealthy:
                 lines.append(f"*{ns.name}*: {len(ns.errors)} errors, {len(ns.warnings)} warnings.")
             # Build SelectBlock for more details
             blocks.append(
@@ -134,7 +201,7 @@ class Builder:
                             text = 'More details...'
                         ),
                         #options=[{'text':{'type':'plain_text','text':ns.name,'value':ns.name}} for ns in collection['Unhealthy']],
-                        options = [Option(text=ns.name, value=ns.name) for ns in collection['Unhealthy']],
+                        options = [Option(text=ns.name, value=ns.name) for ns in unhealthy],
                         action_id = 'health'
                     )
                 )
@@ -142,11 +209,129 @@ class Builder:
 
         return blocks
 
+    def history(name: str, entries: List[Tuple[float, str]], limit: int=20) -> List[Type[Block]]:
+        """Lists the most recent transitions of a namespace, newest first."""
+        blocks: List[Type[Block]] = []
+        blocks.append(
+            HeaderBlock(
+                text = PlainTextObject(
+                    text = f'History of {name}: {len(entries)} transitions recorded'
+                )
+            )
+        )
+        if entries:
+            lines: List[str] = []
+            for (ts, state) in reversed(entries[-limit:]):
+                when = datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
+                lines.append(f'{when} {Builder.ICONS.get(state, ":interrobang:")} {state}')
+            blocks.append(
+                SectionBlock(
+                    text = MarkdownTextObject(
+                        text = os.linesep.join(lines)
+                    )
+                )
+            )
+        return blocks
+
+    def stats(title: str, stats: HistoryStats, flappers: Optional[List[Tuple[str, int]]]=None) -> List[Type[Block]]:
+        """Renders time in state, flap count and MTTR."""
+        mttr = duration_str(stats.mttr) if stats.mttr != None else 'n/a'
+        lines: List[str] = [f'*Flaps:* {stats.flaps}', f'*MTTR:* {mttr} ({len(stats.recoveries)} recoveries)']
+        total = sum(stats.time_in_state.values())
+        for state in HealthUpdate.STATES:
+            seconds = stats.time_in_state.get(state, 0)
+            if seconds:
+                lines.append(f'{Builder.ICONS[state]} {state}: {duration_str(seconds)} ({100 * seconds / total:.1f}%)')
+
+        blocks: List[Type[Block]] = []
+        blocks.append(
+            HeaderBlock(
+                text = PlainTextObject(
+                    text = title
+                )
+            )
+        )
+        blocks.append(
+            SectionBlock(
+                text = MarkdownTextObject(
+                    text = os.linesep.join(lines)
+                )
+            )
+        )
+        if flappers:
+            blocks.append(DividerBlock())
+            blocks.append(
+                SectionBlock(
+                    text = MarkdownTextObject(
+                        text = os.linesep.join([f'*{name}*: {flaps} flaps' for (name, flaps) in flappers])
+                    )
+                )
+            )
+        return blocks
+
+    def incident(members: Dict[str, str], cause: str, resolved: bool=False, limit: int=50) -> List[Type[Block]]:
+        """Create the Slack message for an incident: namespaces that went
+        Unhealthy together, with the state each one is in now."""
+        unhealthy = sum(1 for state in members.values() if state == 'Unhealthy')
+        if resolved:
+            text = f':white_check_mark: Resolved: {len(members)} namespaces recovered ({cause})'
+        else:
+            text = f':rotating_light: Incident: {unhealthy} of {len(members)} namespaces unhealthy ({cause})'
+
+        blocks: List[Type[Block]] = []
+        blocks.append(
+            HeaderBlock(
+                text = PlainTextObject(
+                    text = text[:150]
+                )
+            )
+        )
+        # Still unhealthy first
+        names = sorted(members, key=lambda name: (members[name] != 'Unhealthy', name))
+        lines = [f'{Builder.ICONS.get(members[name], ":interrobang:")} {name}' for name in names[:limit]]
+        if len(names) > limit:
+            lines.append(f'... and {len(names) - limit} more')
+        blocks.append(
+            SectionBlock(
+                text = MarkdownTextObject(
+                    text = os.linesep.join(lines)[:3000]
+                )
+            )
+        )
+        return blocks
+
+    def query(text: str, result: QueryResult, limit: int=50) -> List[Type[Block]]:
+        """Renders the result of a ColumnStore query: the group counts when
+        grouped, otherwise the matching namespaces."""
+        blocks: List[Type[Block]] = []
+        blocks.append(
+            HeaderBlock(
+                text = PlainTextObject(
+                    text = f'{result.count} namespaces match "{text}"'
+                )
+            )
+        )
+        if result.groups != None:
+            lines = [f'*{group}*: {count}' for (group, count) in sorted(result.groups.items(), key=lambda g: (-g[1], g[0]))]
+        else:
+            lines = result.namespaces[:limit]
+            if result.count > len(lines):
+                lines.append(f'... and {result.count - len(lines)} more')
+        if lines:
+            blocks.append(
+                SectionBlock(
+                    text = MarkdownTextObject(
+                        text = os.linesep.join(lines)[:3000]
+                    )
+                )
+            )
+        return blocks
+
     def transition_msg(obj: HealthUpdate) -> List[Type[Block]]:
         """Create a Slack message for an Update stating a state transition."""
         # Gather info
-        icon = Builder.ICONS.get(obj.healthy_str, ':interrobang"')
-        text = f'{icon} [{obj.kind}] {obj.name} transitioned state: {obj.previous_healthy_str} -> {obj.healthy_str}'
+        icon = Builder.ICONS.get(obj.healthy_str, ':interrobang:')
+        text = f'{icon} [{obj.kind}] {obj.path} transitioned state: {obj.previous_healthy_str} -> {obj.healthy_str}'
 
         # Building blocks
         blocks: List[Type[Block]] = []
@@ -0,0 +1,154 @@
+# StdLib
+from collections import OrderedDict
+import time
+from typing import Callable, Dict, ItemsView, Iterator, KeysView, List, Optional, ValuesView
+
+# Internal deps
+from .health_update import HealthUpdate
+
+class NamespaceCache:
+    """The consumer's name -> HealthUpdate map, kept in least recently
+    updated order so it can be bounded.
+
+    max_size caps the number of entries, dropping the least recently updated
+    one. ttl expires entries that have not been updated for ttl seconds. Both
+    are off when 0. on_evict is called with the name of every entry that
+    leaves the cache for any reason, so dependent indexes can follow.
+
+    An entry evicted or expired while its namespace still exists leaves a
+    tombstone with its last state (see last_state), so that its next update
+    is not mistaken for a new namespace. The newest tombstones entries are
+    kept. on_forget is called when a name is gone for good: deleted, pruned,
+    or its tombstone dropped."""
+    def __init__(self, max_size: int=0, ttl: float=0, on_evict: Optional[Callable[[str], None]]=None,
+                 on_forget: Optional[Callable[[str], None]]=None, tombstones: int=65536) -> None:
+        if max_size < 0:
+            raise ValueError('max_size cannot be negative')
+        if ttl < 0:
+            raise ValueError('ttl cannot be negative')
+        if tombstones < 0:
+            raise ValueError('tombstones cannot be negative')
+
+        self._max_size = max_size
+        self._ttl = ttl
+        self._on_evict = on_evict
+        self._on_forget = on_forget
+        self._max_tombstones = tombstones
+        self._entries: 'OrderedDict[str, HealthUpdate]' = OrderedDict()
+        self._updated: Dict[str, float] = {}
+        # name -> healthy_raw of live namespaces evicted from the cache
+        self._tombstones: 'OrderedDict[str, Optional[str]]' = OrderedDict()
+
+        self.evictions = 0
+        self.expirations = 0
+        self.deletions = 0
+        self.prunes = 0
+
+    def __setitem__(self, name: str, hupdate: HealthUpdate) -> None:
+        self._tombstones.pop(name, None)
+        self._entries[name] = hupdate
+        self._entries.move_to_end(name)
+        if self._ttl:
+            self._updated[name] = time.monotonic()
+        while self._max_size and len(self._entries) > self._max_size:
+            (oldest, evicted) = self._entries.popitem(last=False)
+            self._updated.pop(oldest, None)
+            self.evictions += 1
+            self._evicted(oldest)
+            self._bury(oldest, evicted)
+
+    def __getitem__(self, name: str) -> HealthUpdate:
+        return self._entries[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entries
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, name: str, default: Optional[HealthUpdate]=None) -> Optional[HealthUpdate]:
+        return self._entries.get(name, default)
+
+    def last_state(self, name: str) -> Optional[str]:
+        """The healthy_raw name had when it was evicted, or None."""
+        return self._tombstones.get(name, None)
+
+    def buried(self) -> List[str]:
+        """Names evicted while their namespace still existed."""
+        return list(self._tombstones)
+
+    def keys(self) -> KeysView[str]:
+        return self._entries.keys()
+
+    def values(self) -> ValuesView[HealthUpdate]:
+        return self._entries.values()
+
+    def items(self) -> ItemsView[str, HealthUpdate]:
+        return self._entries.items()
+
+    def pop(self, name: str, pruned: bool=False) -> Optional[HealthUpdate]:
+        """Removes name because its namespace was deleted, or because it was
+        missing from a fresh namespace list (pruned)."""
+        hupdate = self._entries.pop(name, None)
+        if hupdate != None:
+            self._updated.pop(name, None)
+            if pruned:
+                self.prunes += 1
+            else:
+                self.deletions += 1
+            self._evicted(name)
+            self._forgotten(name)
+        elif self._tombstones.pop(name, 0) != 0:
+            self._forgotten(name)
+        return hupdate
+
+    def expire(self, now: Optional[float]=None) -> int:
+        """Drops entries older than ttl. Only looks at the oldest entries, so
+        it is O(1) when nothing is due."""
+        if not self._ttl:
+            return 0
+        deadline = (time.monotonic() if now == None else now) - self._ttl
+        expired = 0
+        while self._entries:
+            oldest = next(iter(self._entries))
+            if self._updated.get(oldest, deadline) > deadline:
+                break
+            hupdate = self._entries.pop(oldest)
+            self._updated.pop(oldest, None)
+            self.expirations += 1
+            expired += 1
+            self._evicted(oldest)
+            self._bury(oldest, hupdate)
+        return expired
+
+    def _evicted(self, name: str) -> None:
+        if self._on_evict != None:
+            self._on_evict(name)
+
+    def _bury(self, name: str, hupdate: HealthUpdate) -> None:
+        if not self._max_tombstones:
+            self._forgotten(name)
+            return
+        self._tombstones[name] = hupdate.healthy_raw
+        while len(self._tombstones) > self._max_tombstones:
+            (oldest, _) = self._tombstones.popitem(last=False)
+            self._forgotten(oldest)
+
+    def _forgotten(self, name: str) -> None:
+        if self._on_forget != None:
+            self._on_forget(name)
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._entries),
+            'max_size': self._max_size,
+            'ttl': self._ttl,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'deletions': self.deletions,
+            'prunes': self.prunes,
+            'tombstones': len(self._tombstones),
+        }
@@ -0,0 +1,106 @@
+# StdLib
+import logging
+import re
+from typing import Dict, Iterable, List, Optional
+
+# External deps
+from slack_sdk.web.async_client import AsyncWebClient
+
+# Conversation ids, eg. C0123ABCD for channels and G0123ABCD for private ones
+_ID_RE = re.compile(r'^[CG][A-Z0-9]{8,}$')
+
+class ChannelDirectory:
+    """Slack channel names resolved to conversation ids.
+
+    Routes name channels (#ops), but Slack resolves a name on every
+    chat.postMessage and only fails at send time when the bot is not in the
+    channel. The directory lists the conversations once (conversations.list,
+    paginated), so messages are sent by id and check() can reject
+    misconfigured channels at startup. rename() and left() keep it current
+    from the channel_rename and channel_left events; a renamed channel
+    stays reachable by its old name."""
+    PAGE_SIZE = 1000
+
+    def __init__(self, client: AsyncWebClient) -> None:
+        self._client = client
+        self._ids: Dict[str, str] = {}
+        self._names: Dict[str, str] = {}
+        self._member: Dict[str, bool] = {}
+
+    @staticmethod
+    def _name(channel: str) -> str:
+        return channel[1:] if channel.startswith('#') else channel
+
+    @staticmethod
+    def is_id(channel: str) -> bool:
+        return bool(_ID_RE.match(channel))
+
+    async def refresh(self) -> None:
+        """(Re)loads every channel the bot can see."""
+        ids: Dict[str, str] = {}
+        member: Dict[str, bool] = {}
+        cursor: Optional[str] = None
+        while True:
+            response = await self._client.conversations_list(
+                types='public_channel,private_channel',
+                exclude_archived=True,
+                limit=self.PAGE_SIZE,
+                cursor=cursor,
+            )
+            for channel in response.get('channels', []):
+                ids[channel['name']] = channel['id']
+                member[channel['id']] = bool(channel.get('is_member', False))
+            cursor = (response.get('response_metadata', None) or {}).get('next_cursor', None)
+            if not cursor:
+                break
+        self._ids = ids
+        self._names = {channel_id: name for (name, channel_id) in ids.items()}
+        self._member = member
+        logging.info(f'Resolved {len(ids)} Slack channels.')
+
+    def resolve(self, channel: str) -> str:
+        """The conversation id of channel (a #name or an id). Unknown names
+        are returned as they are and left to Slack."""
+        if self.is_id(channel):
+            return channel
+        return self._ids.get(self._name(channel), channel)
+
+    def name(self, channel_id: str) -> Optional[str]:
+        name = self._names.get(channel_id, None)
+        return None if name == None else '#' + name
+
+    def check(self, channels: Iterable[str]) -> None:
+        """Raises ValueError naming every channel that does not exist or that
+        the bot is not a member of."""
+        missing: List[str] = []
+        not_member: List[str] = []
+        for channel in sorted(set(channels)):
+            channel_id = self.resolve(channel)
+            if channel_id not in self._member:
+                missing.append(channel)
+            elif not self._member[channel_id]:
+                not_member.append(channel)
+        problems = []
+        if missing:
+            problems.append(f'channels not found: {", ".join(missing)}')
+        if not_member:
+            problems.append(f'bot is not a member of: {", ".join(not_member)} (invite it with /invite)')
+        if problems:
+            raise ValueError('; '.join(problems))
+
+    def rename(self, channel_id: str, name: str) -> None:
+        old = self._names.get(channel_id, None)
+        # The old name stays an alias, so Routes configured with it still resolve
+        self._ids[name] = channel_id
+        self._names[channel_id] = name
+        self._member.setdefault(channel_id, False)
+        if old != None and old != name:
+            logging.warning(f'Slack channel #{old} was renamed to #{name}, update the routes using the old name')
+
+    def left(self, channel_id: str) -> None:
+        if self._member.get(channel_id, False):
+            logging.error(f'bmspy was removed from {self.name(channel_id) or channel_id}, messages routed there will fail')
+        self._member[channel_id] = False
+
+    def __len__(self) -> int:
+        return len(self._ids)
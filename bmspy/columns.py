@@ -0,0 +1,200 @@
+# StdLib
+from array import array
+from collections import Counter
+from itertools import compress
+import re
+import sys
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# Internal deps
+from .health_update import HealthUpdate
+
+CATEGORICAL = ['state', 'tenant', 'env']
+NUMERIC = ['errors', 'warnings', 'alerts']
+OPERATORS = ['>=', '<=', '!=', '=', '>', '<']
+
+_TERM_RE = re.compile(r'^(\w+)(>=|<=|!=|=|>|<)(.+)$')
+# Byte offsets of the low and high byte of an 'H' item in array.tobytes()
+(_LO, _HI) = (0, 1) if sys.byteorder == 'little' else (1, 0)
+_MAX_COUNT = 0xFFFF
+
+class Term(NamedTuple):
+    field: str
+    op: str
+    values: Tuple
+
+class QueryResult(NamedTuple):
+    count: int
+    namespaces: List[str]
+    groups: Optional[Dict[str, int]]
+
+def parse_query(text: str) -> Tuple[List[Term], Optional[str]]:
+    """Parses eg. 'tenant=blue env=prod state=unhealthy errors>3' or
+    'state!=healthy by tenant'. Terms are ANDed, comma separated values of
+    state/tenant/env are ORed, and 'by <field>' groups the matches."""
+    terms: List[Term] = []
+    group_by = None
+    tokens = text.split()
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token == 'by':
+            if i + 1 >= len(tokens) or tokens[i + 1] not in CATEGORICAL:
+                raise ValueError(f'"by" takes one of {", ".join(CATEGORICAL)}')
+            group_by = tokens[i + 1]
+            i += 2
+            continue
+        match = _TERM_RE.match(token)
+        if match == None:
+            raise ValueError(f'cannot parse "{token}", use eg. state=unhealthy or errors>3')
+        (field, op, value) = match.groups()
+        if field in CATEGORICAL:
+            if op not in ['=', '!=']:
+                raise ValueError(f'{field} only supports = and !=')
+            values = tuple(value.split(','))
+            if field == 'state':
+                states = {state.lower(): state for state in HealthUpdate.STATES}
+                if any(v.lower() not in states for v in values):
+                    raise ValueError(f'state must be one of {", ".join(HealthUpdate.STATES)}')
+                values = tuple(states[v.lower()] for v in values)
+            terms.append(Term(field, op, values))
+        elif field in NUMERIC:
+            if not value.isdigit():
+                raise ValueError(f'{field} must be compared to a number')
+            terms.append(Term(field, op, (int(value),)))
+        else:
+            raise ValueError(f'unknown field "{field}", use one of {", ".join(CATEGORICAL + NUMERIC)}')
+        i += 1
+    return (terms, group_by)
+
+def _table(predicate) -> bytes:
+    return bytes(1 if predicate(i) else 0 for i in range(256))
+
+def _mask(column: bytes, table: bytes) -> int:
+    """A mask holding one byte, 0 or 1, per row where table maps the column's byte to 1."""
+    return int.from_bytes(column.translate(table), 'little')
+
+class ColumnStore:
+    """A columnar mirror of the namespace cache for ad hoc queries.
+
+    Every namespace is a row; its state code, tenant and env ids and error,
+    warning and alert counts are held in typed arrays, and names map to rows.
+    Removed rows are reused. A query is evaluated a column at a time with
+    bytes.translate into masks (one byte per row, as Python ints), which are
+    combined with & and |, so the per-row work all happens in C."""
+    def __init__(self) -> None:
+        self._rows: Dict[str, int] = {}
+        self._names: List[Optional[str]] = []
+        self._free: List[int] = []
+        self._live = bytearray()
+        self._columns: Dict[str, array] = {
+            'state': array('B'),
+            'tenant': array('H'),
+            'env': array('H'),
+            'errors': array('H'),
+            'warnings': array('H'),
+            'alerts': array('H'),
+        }
+        # Dictionary encoding of tenant and env, id 0 is "none"
+        self._ids: Dict[str, Dict[str, int]] = {'tenant': {'': 0}, 'env': {'': 0}}
+        self._values: Dict[str, List[str]] = {'tenant': [''], 'env': ['']}
+
+    def _id(self, field: str, value: Optional[str]) -> int:
+        ids = self._ids[field]
+        value = value or ''
+        id = ids.get(value, None)
+        if id == None:
+            if len(ids) > 0xFFFF:
+                raise ValueError(f'too many distinct values of {field}')
+            id = ids[value] = len(ids)
+            self._values[field].append(value)
+        return id
+
+    def update(self, hupdate: HealthUpdate) -> None:
+        row = self._rows.get(hupdate.name, None)
+        if row == None:
+            if self._free:
+                row = self._free.pop()
+                self._names[row] = hupdate.name
+            else:
+                row = len(self._names)
+                self._names.append(hupdate.name)
+                self._live.append(0)
+                for column in self._columns.values():
+                    column.append(0)
+            self._rows[hupdate.name] = row
+            self._live[row] = 1
+        columns = self._columns
+        columns['state'][row] = hupdate.state_code
+        columns['tenant'][row] = self._id('tenant', hupdate.tenant)
+        columns['env'][row] = self._id('env', hupdate.env)
+        columns['errors'][row] = min(len(hupdate.errors), _MAX_COUNT)
+        columns['warnings'][row] = min(len(hupdate.warnings), _MAX_COUNT)
+        columns['alerts'][row] = min(len(hupdate.alerts), _MAX_COUNT)
+
+    def remove(self, name: str) -> None:
+        row = self._rows.pop(name, None)
+        if row != None:
+            self._live[row] = 0
+            self._names[row] = None
+            self._free.append(row)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._rows
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def query(self, text: str, limit: int=100) -> QueryResult:
+        """Runs a query (see parse_query), returning the number of matches,
+        up to limit matching names (sorted) and the group counts, if grouped."""
+        (terms, group_by) = parse_query(text)
+        live = int.from_bytes(self._live, 'little')
+        mask = live
+        for term in terms:
+            mask &= self._evaluate(term, live)
+        selected = mask.to_bytes(len(self._live), 'little')
+        count = selected.count(1)
+        namespaces = sorted(compress(self._names, selected))[:limit] if limit else []
+        groups = None
+        if group_by != None:
+            counts = Counter(compress(self._columns[group_by], selected))
+            if group_by == 'state':
+                groups = {HealthUpdate.STATES[code]: n for (code, n) in counts.items()}
+            else:
+                groups = {self._values[group_by][id] or 'none': n for (id, n) in counts.items()}
+        return QueryResult(count, namespaces, groups)
+
+    def _evaluate(self, term: Term, live: int) -> int:
+        if term.field == 'state':
+            codes = set(HealthUpdate.STATES.index(state) for state in term.values)
+            mask = _mask(self._columns['state'].tobytes(), _table(lambda b: b in codes))
+        elif term.field in CATEGORICAL:
+            ids = self._ids[term.field]
+            mask = 0
+            for value in term.values:
+                if value in ids:
+                    mask |= self._compare(self._columns[term.field], '=', ids[value], live)
+        else:
+            return self._compare(self._columns[term.field], term.op, term.values[0], live)
+        return (live ^ mask) & live if term.op == '!=' else mask
+
+    def _compare(self, column: array, op: str, value: int, live: int) -> int:
+        """Compares every item of an 'H' column to value, a byte at a time."""
+        if value > _MAX_COUNT:
+            return 0 if op in ['=', '>', '>='] else live
+        data = column.tobytes()
+        (lo, hi) = (data[_LO::2], data[_HI::2])
+        (vlo, vhi) = (value & 0xFF, value >> 8)
+        if op in ['=', '!=']:
+            mask = _mask(lo, _table(lambda b: b == vlo)) & _mask(hi, _table(lambda b: b == vhi))
+            return (live ^ mask) & live if op == '!=' else mask
+        if op in ['>=', '<']:
+            # x >= v is x > v - 1
+            if value == 0:
+                return live if op == '>=' else 0
+            (vlo, vhi) = ((value - 1) & 0xFF, (value - 1) >> 8)
+        greater = _mask(hi, _table(lambda b: b > vhi)) | (_mask(hi, _table(lambda b: b == vhi)) & _mask(lo, _table(lambda b: b > vlo)))
+        if op in ['>', '>=']:
+            return greater & live
+        return (live ^ greater) & live
@@ -1,24 +1,60 @@
 # StdLib
 import asyncio
+from collections import deque
 import json
 import logging
-from typing import Dict
+import sys
+from typing import Deque, Dict, List, Optional, Tuple, Union
 import urllib.error
 from urllib.parse import urlparse
 import websockets
 
 # Internal deps
+from .breaker import BreakerOpen
 from .builder import Builder
+from .cache import NamespaceCache
+from .columns import ColumnStore
+from .fetch import NotModified
 from .health_update import HealthUpdate
+from .history import TransitionHistory
+from .pipeline import DecodePool
+from .rollup import HealthRollup
 from .router import Router
 from .slack_bot import SlackBot
+from .wire import WireStats
 
 class BMSConsumer:
-    """Creates a websocket to BMS and monitors HealthUpdates to alert SlackBot."""
-    def __init__(self, url: str, slackbot: SlackBot, router: Router, wait: int=1, max_wait: int=60) -> None:
+    """Creates a websocket to BMS and monitors HealthUpdates to alert SlackBot.
+
+    Besides the namespace stream at url, any workload_urls (eg. /ws/deployments)
+    are subscribed to as well. Workloads are cached under their namespace and
+    their states are counted per namespace, so the worst state of the
+    workloads of a namespace is known without walking them.
+
+    connect_options are passed on to websockets.connect, see wire.connect_options
+    for compression. Bytes and frames received are accounted per url in
+    wire_stats.
+
+    Namespaces leave the cache when BMS sends a delete action for them, when
+    they are missing from the list fetched on (re)connect, and optionally when
+    cache_max_size or cache_ttl (see NamespaceCache) is exceeded.
+
+    With batch_size > 1, frames are read into a queue and processed in
+    micro-batches of whatever is already buffered, up to batch_size, see
+    process_batch. A lone frame is processed as soon as it arrives; after a
+    burst the batches grow and per-frame overhead shrinks. batch_wait
+    optionally holds a batch open that many seconds for more frames. Only
+    the latest frame of a namespace in a batch is kept, so transitions that
+    revert within one batch are not notified.
+
+    With a decode_pool, batches are decoded by its worker processes instead,
+    see consume_pipelined and DecodePool."""
+    def __init__(self, url: str, slackbot: SlackBot, router: Router, wait: int=1, max_wait: int=60, workload_urls: List[str]=[], connect_options: dict={},
+                 cache_max_size: int=0, cache_ttl: float=0, batch_size: int=1, batch_wait: float=0, decode_pool: Optional[DecodePool]=None) -> None:
         # Validate
         try:
-            urlparse(url)
+            for u in [url] + list(workload_urls):
+                urlparse(u)
         except urllib.error.URLError as e:
             raise ValueError('failed to parse url') from e
         if slackbot == None:
@@ -27,25 +63,61 @@ class BMSConsumer:
             raise ValueError('invalid router')
         if wait > max_wait:
             raise ValueError(f'wait "{ wait }" cannot be greater than max_wait "{ max_wait }"')
+        if batch_size < 1:
+            raise ValueError('batch_size must be at least 1')
 
         self._url = url
+        self._workload_urls = list(workload_urls)
+        self._connect_options = dict(connect_options)
+        self._wire_stats: Dict[str, WireStats] = {}
         self._slack = slackbot
         self._router = router
         self._wait = wait
         self._max_wait = max_wait
 
-        self._cache: Dict[str, HealthUpdate] = {}
+        self._cache = NamespaceCache(max_size=cache_max_size, ttl=cache_ttl, on_evict=self._evict, on_forget=self._forget)
+        self._workloads: Dict[str, Dict[Tuple[str, str], HealthUpdate]] = {}
+        self._workload_states: Dict[str, List[int]] = {}
+        self._rollup = HealthRollup()
+        self._columns = ColumnStore()
+        self._history = TransitionHistory()
+        self._warm = False
+        # Whether the websocket changed the cache since the last full fetch
+        self._diverged = False
+        self._generation = 0
+        self._batch_size = batch_size
+        self._batch_wait = batch_wait
+        self._decode_pool = decode_pool
+
+        self.batches = 0
+        self.batched_frames = 0
+        self.coalesced = 0
 
     async def start(self):
+        listeners = [asyncio.create_task(self.listen(self._url, populate=True))]
+        listeners.extend(asyncio.create_task(self.listen(url)) for url in self._workload_urls)
+        try:
+            (done, _) = await asyncio.wait(listeners, return_when=asyncio.FIRST_EXCEPTION)
+            for listener in done:
+                listener.result()
+        finally:
+            # One listener failing stops the others, so a restart does not duplicate them
+            for listener in listeners:
+                listener.cancel()
+            await asyncio.gather(*listeners, return_exceptions=True)
+
+    async def listen(self, url: str, populate: bool=False) -> None:
         wait = self._wait
+        stats = self._wire_stats.setdefault(url, WireStats())
         while True:
             try:
-                async with websockets.connect(self._url, ping_interval=None) as websocket:
-                    await self.populate_cache()
+                async with websockets.connect(url, ping_interval=None, create_protocol=stats.protocol_factory(), **self._connect_options) as websocket:
+                    if populate:
+                        await self.populate_cache()
                     wait = self._wait
                     await self.consumer(websocket)
             except (websockets.exceptions.ConnectionClosedError, ConnectionError) as e:
-                logging.error(e, f"connection error contacting bms-api, waiting { wait } seconds to retry")
+                logging.error(f"{e}: connection error contacting bms-api at {url}, waiting { wait } seconds to retry")
                 await asyncio.sleep(wait)
                 wait = wait * 2
                 if wait > self._max_wait:
@@ -53,26 +125,358 @@ class BMSConsumer:
                 continue
 
     async def consumer(self, websocket: websockets.WebSocketClientProtocol) -> None:
+        if self._decode_pool != None:
+            await self.consume_pipelined(websocket)
+            return
+        if self._batch_size > 1:
+            await self.consume_batches(websocket)
+            return
         async for message in websocket:
             await self.process_msg(message)
 
+    async def consume_batches(self, websocket: websockets.WebSocketClientProtocol) -> None:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self._batch_size * 4)
+        reader = asyncio.create_task(self._read(websocket, queue))
+        try:
+            while True:
+                batch = await self._next_batch(queue)
+                end = self._end(batch)
+                if end != None:
+                    if end > 0:
+                        await self.process_batch(batch[:end])
+                    if batch[end] != None:
+                        raise batch[end]
+                    return
+                await self.process_batch(batch)
+        finally:
+            reader.cancel()
+            await asyncio.gather(reader, return_exceptions=True)
+
+    async def consume_pipelined(self, websocket: websockets.WebSocketClientProtocol) -> None:
+        """consume_batches with the decoding done by the decode_pool. While
+        frames keep arriving, up to one batch per worker is in flight;
+        results are applied in the order their batches were read."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self._batch_size * 4)
+        reader = asyncio.create_task(self._read(websocket, queue))
+        pending: Deque[asyncio.Future] = deque()
+        try:
+            while True:
+                batch = await self._next_batch(queue)
+                end = self._end(batch)
+                frames = batch if end == None else batch[:end]
+                if frames:
+                    pending.append(await self._decode_pool.submit(frames))
+                    self.batched_frames += len(frames)
+                # Apply results once every worker has a batch, or nothing more is buffered
+                while pending and (end != None or queue.empty() or len(pending) >= self._decode_pool.workers):
+                    (hupdates, coalesced) = await pending.popleft()
+                    self.batches += 1
+                    self.coalesced += coalesced
+                    await self._process_hupdates(hupdates)
+                if end != None:
+                    if batch[end] != None:
+                        raise batch[end]
+                    return
+        finally:
+            reader.cancel()
+            for future in pending:
+                future.cancel()
+            await asyncio.gather(reader, return_exceptions=True)
+
+    async def _next_batch(self, queue: asyncio.Queue) -> list:
+        """Whatever is buffered in queue, up to batch_size, waiting up to batch_wait for more."""
+        loop = asyncio.get_running_loop()
+        batch = [await queue.get()]
+        deadline = loop.time() + self._batch_wait
+        while len(batch) < self._batch_size:
+            if not queue.empty():
+                batch.append(queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    @staticmethod
+    def _end(batch: list) -> Optional[int]:
+        """The index of the end of the stream in batch, if there: the reader
+        ends it with None, or the exception that closed it."""
+        return next((i for (i, m) in enumerate(batch) if m == None or isinstance(m, Exception)), None)
+
+    @staticmethod
+    async def _read(websocket: websockets.WebSocketClientProtocol, queue: asyncio.Queue) -> None:
+        try:
+            async for message in websocket:
+                await queue.put(message)
+        except Exception as e:
+            # Any error ends the stream, or the consumer would wait forever
+            await queue.put(e)
+            return
+        await queue.put(None)
+
     async def populate_cache(self) -> None:
         """Check remote source and populate current 'healthy' values."""
         # TODO: We should be doing this work instead of relying on functionality in SlackBot for it.
-        values = await self._slack.fetch_all_namespaces()
-        for v in values:
-            self._cache[v.name] = v
+        seen = set()
+        try:
+            # A warm cache only needs the list again if it changed since the last
+            # fetch, unless websocket updates were applied since: they may have
+            # reverted upstream without the list changing
+            async for v in self._slack.iter_namespaces(conditional=self._warm and not self._diverged):
+                seen.add(v.name)
+                self._cache[v.name] = v
+                self._rollup.update(v)
+                self._columns.update(v)
+                self._history.record(v.name, v.state_code)
+        except NotModified:
+            logging.info('namespace list not modified, keeping the cache')
+            return
+        except BreakerOpen:
+            if not self._warm:
+                raise
+            # The websocket keeps it current meanwhile
+            logging.warning('bms-api circuit breaker is open, keeping the cache and refreshing it once bms-api recovers')
+            self._slack.revalidate()
+            return
+        # Anything not in the snapshot was deleted while we were not listening
+        for name in [name for name in [*self._cache.keys(), *self._cache.buried()] if name not in seen]:
+            self._cache.pop(name, pruned=True)
+        self._generation += 1
+        self._warm = True
+        self._diverged = False
 
     async def process_msg(self, message) -> None:
         payload = json.loads(message)
         hupdate = HealthUpdate(payload)
+        self._cache.expire()
+        if hupdate.is_namespace:
+            event = self._apply_namespace(hupdate)
+        else:
+            event = self._apply_workload(hupdate)
+        if event == None:
+            return
+        (hupdate, previous, transition) = event
+        if transition:
+            await self._router.process_msg(hupdate)
+        else:
+            await self._router.process_content_change(hupdate, previous)
+
+    async def process_batch(self, messages: List[Union[str, bytes]]) -> None:
+        """Processes frames received together: they are decoded with one
+        json.loads, only the latest frame of each namespace or workload is
+        kept, and the resulting notifications are routed as one batch."""
+        payloads = self._decode_batch(messages)
+        latest: Dict[Tuple[str, str, str], dict] = {}
+        for payload in payloads:
+            latest[(payload.get('kind', ''), payload.get('namespace', ''), payload.get('name', ''))] = payload
+        self.coalesced += len(payloads) - len(latest)
+        self.batches += 1
+        self.batched_frames += len(messages)
+        await self._process_hupdates([HealthUpdate(payload) for payload in latest.values()])
+
+    async def _process_hupdates(self, hupdates: List[HealthUpdate]) -> None:
+        """Applies the deduplicated HealthUpdates of a batch and routes the result."""
+        self._cache.expire()
+        # Namespaces first, so workloads in the same batch inherit their tenant
+        events = [self._apply_namespace(h) for h in hupdates if h.is_namespace]
+        events.extend(self._apply_workload(h) for h in hupdates if not h.is_namespace)
+        transitions = []
+        changes = []
+        for event in events:
+            if event == None:
+                continue
+            (hupdate, previous, transition) = event
+            if transition:
+                transitions.append(hupdate)
+            else:
+                changes.append((hupdate, previous))
+        if transitions or changes:
+            await self._router.process_batch(transitions, changes)
+
+    @staticmethod
+    def _decode_batch(messages: List[Union[str, bytes]]) -> List[dict]:
+        frames = [m.decode('utf-8') if isinstance(m, bytes) else m for m in messages]
+        try:
+            return json.loads(f'[{",".join(frames)}]')
+        except json.JSONDecodeError:
+            pass
+        # Find the bad frames one by one rather than losing the batch
+        payloads = []
+        for frame in frames:
+            try:
+                payloads.append(json.loads(frame))
+            except json.JSONDecodeError as e:
+                logging.error(f'{e}: dropping undecodable frame')
+        return payloads
+
+    def _apply_namespace(self, hupdate: HealthUpdate) -> Optional[Tuple[HealthUpdate, Optional[HealthUpdate], bool]]:
+        """Updates the cache and indexes with a namespace update. Returns
+        (hupdate, previous, is_transition) when it should be routed."""
+        if hupdate.is_delete:
+            if self._cache.pop(hupdate.name) != None:
+                self._changed()
+            return None
 
         # Check cache to see if new state
-        if hupdate.name in self._cache.keys():
-            hupdate.previous_healthy_raw = self._cache[hupdate.name].healthy_raw
+        previous = self._cache.get(hupdate.name, None)
+        if previous != None:
+            hupdate.previous_healthy_raw = previous.healthy_raw
+        else:
+            # Evicted while live: compare with the state it left in
+            hupdate.previous_healthy_raw = self._cache.last_state(hupdate.name)
 
         # Update cache
         self._cache[hupdate.name] = hupdate
+        self._rollup.update(hupdate)
+        self._columns.update(hupdate)
+        self._history.record(hupdate.name, hupdate.state_code)
 
         if hupdate.healthy_str != hupdate.previous_healthy_str:
-            await self._router.process_msg(hupdate)
+            self._changed()
+            return (hupdate, previous, True)
+        elif previous == None or hupdate.digest != previous.digest:
+            self._changed()
+            if previous != None and self._router.wants_content_changes:
+                return (hupdate, previous, False)
+        elif (hupdate.action, hupdate.tenant, hupdate.env) != (previous.action, previous.tenant, previous.env):
+            # Not worth a message, but served by the API
+            self._changed()
+        return None
+
+    def _changed(self) -> None:
+        """A websocket update changed the cache: new API snapshots, and the
+        next populate_cache cannot trust a 304 (see iter_namespaces)."""
+        self._generation += 1
+        self._diverged = True
+
+    def _apply_workload(self, hupdate: HealthUpdate) -> Optional[Tuple[HealthUpdate, Optional[HealthUpdate], bool]]:
+        parent = self._cache.get(hupdate.namespace, None)
+        if parent != None:
+            hupdate.inherit_tenant(parent)
+
+        children = self._workloads.get(hupdate.namespace, None)
+        if hupdate.is_delete:
+            if children != None:
+                previous = children.pop((hupdate.kind.lower(), hupdate.name), None)
+                if previous != None:
+                    self._workload_states[hupdate.namespace][previous.state_code] -= 1
+                    self._generation += 1
+            return None
+        if children == None:
+            children = self._workloads[hupdate.namespace] = {}
+            self._workload_states[hupdate.namespace] = [0] * len(HealthUpdate.STATES)
+        counts = self._workload_states[hupdate.namespace]
+        key = (sys.intern(hupdate.kind.lower()), hupdate.name)
+        previous = children.get(key, None)
+        if previous != None:
+            hupdate.previous_healthy_raw = previous.healthy_raw
+            counts[previous.state_code] -= 1
+        children[key] = hupdate
+        counts[hupdate.state_code] += 1
+        if previous == None or previous.state_code != hupdate.state_code:
+            # The namespace's rolled up state (see workload_summary) may have changed
+            self._generation += 1
+
+        if hupdate.healthy_str != hupdate.previous_healthy_str:
+            return (hupdate, previous, True)
+        elif previous != None and self._router.wants_content_changes and hupdate.digest != previous.digest:
+            return (hupdate, previous, False)
+        return None
+
+    def _evict(self, name: str) -> None:
+        """Drops the cached data of namespace name once it leaves the cache."""
+        self._columns.remove(name)
+        self._workloads.pop(name, None)
+        self._workload_states.pop(name, None)
+        self._generation += 1
+
+    def _forget(self, name: str) -> None:
+        """Drops the rest of what is known about namespace name once it is gone
+        for good; an evicted namespace keeps its history and rollup state."""
+        self._rollup.remove(name)
+        self._history.remove(name)
+        self._generation += 1
+
+    def batch_stats(self) -> dict:
+        stats = {
+            'batch_size': self._batch_size,
+            'batches': self.batches,
+            'frames': self.batched_frames,
+            'coalesced': self.coalesced,
+            'mean_batch': round(self.batched_frames / self.batches, 2) if self.batches else 0,
+        }
+        if self._decode_pool != None:
+            stats['decode_pool'] = self._decode_pool.stats()
+        return stats
+
+    def delivery_stats(self) -> Optional[dict]:
+        return self._router.delivery.stats() if self._router.delivery != None else None
+
+    def cache_stats(self) -> dict:
+        stats = self._cache.stats()
+        stats['workload_namespaces'] = len(self._workloads)
+        stats['workloads'] = sum(len(children) for children in self._workloads.values())
+        return stats
+
+    def workload(self, kind: str, namespace: str, name: str) -> Optional[HealthUpdate]:
+        """A cached workload; kind is matched case-insensitively."""
+        return self._workloads.get(namespace, {}).get((kind.lower(), name), None)
+
+    def workloads(self, namespace: str) -> List[HealthUpdate]:
+        return list(self._workloads.get(namespace, {}).values())
+
+    def workload_summary(self, namespace: str) -> Optional[dict]:
+        """The worst state and the counts per state of the workloads of
+        namespace, or None if none are cached."""
+        state = self.workload_state(namespace)
+        if state == None:
+            return None
+        counts = self._workload_states[namespace]
+        return {
+            'state': state,
+            'counts': {HealthUpdate.STATES[code]: count for (code, count) in enumerate(counts) if count},
+        }
+
+    def workload_state(self, namespace: str) -> Optional[str]:
+        """The worst state among the workloads of namespace, or None if none are cached."""
+        counts = self._workload_states.get(namespace, None)
+        if counts == None:
+            return None
+        for code in range(len(counts) - 1, -1, -1):
+            if counts[code] > 0:
+                return HealthUpdate.STATES[code]
+        return None
+
+    @property
+    def cache(self) -> NamespaceCache:
+        return self._cache
+
+    @property
+    def columns(self) -> ColumnStore:
+        return self._columns
+
+    @property
+    def generation(self) -> int:
+        """Incremented every time the content of the cache changes."""
+        return self._generation
+
+    @property
+    def history(self) -> TransitionHistory:
+        return self._history
+
+    @property
+    def rollup(self) -> HealthRollup:
+        return self._rollup
+
+    @property
+    def wire_stats(self) -> Dict[str, WireStats]:
+        return self._wire_stats
+
+    @property
+    def warm(self) -> bool:
+        """True once the cache has been populated from a full namespace list."""
+        return self._warm
@@ -0,0 +1,192 @@
+# StdLib
+import asyncio
+from collections import deque
+import heapq
+import logging
+import time
+from typing import Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Set, Tuple, Union
+
+# Internal deps
+from .health_update import HealthUpdate
+
+# External deps
+from slack_sdk.models.blocks import Block
+
+# Priority classes, most urgent first
+PRIORITIES = ['critical', 'high', 'medium', 'low', 'recovery']
+_STATE_PRIORITY = {'Unhealthy': 0, 'Alert': 1, 'Warning': 2, 'Unknown': 3, 'Healthy': 4}
+
+def priority(hupdate: HealthUpdate, weight: int=0) -> int:
+    """The priority class of a message about hupdate, an index in PRIORITIES.
+
+    Follows its new state, one class up when it carries errors (see
+    has_above), and weight classes up for a Route that asks for it."""
+    value = _STATE_PRIORITY.get(hupdate.healthy_str, 3)
+    if value > 0 and hupdate.has_above('error'):
+        value -= 1
+    return min(max(value - weight, 0), len(PRIORITIES) - 1)
+
+class _ClassStats:
+    __slots__ = ['sent', 'wait', 'max_wait']
+
+    def __init__(self) -> None:
+        self.sent = 0
+        self.wait = 0.0
+        self.max_wait = 0.0
+
+class DeliveryQueue:
+    """Sends messages through send with at most concurrency in flight, most
+    urgent first.
+
+    Messages are ordered by their enqueue time plus aging seconds per
+    priority class, so a recovery (class 4) waits behind critical messages
+    arriving up to 4 * aging seconds after it, but no longer: low classes
+    are never starved. Wait times are accounted per class, see stats().
+    put() waits while max_size messages are queued.
+
+    Messages put with the same key (the Router uses the channel and the
+    namespace) stay in order: only the oldest is scheduled, ranked by the
+    most urgent of them, and the next one only once it was sent. A recovery
+    queued before a later failure of the same namespace is sent first."""
+    def __init__(self, send: Callable[[str, str, Union[List[Block], List[dict]]], Awaitable], concurrency: int=4, aging: float=10.0, max_size: int=10000) -> None:
+        if concurrency < 1:
+            raise ValueError('concurrency must be at least 1')
+        if aging <= 0:
+            raise ValueError('aging must be positive')
+
+        self._send = send
+        self._concurrency = concurrency
+        self._aging = aging
+        self._max_size = max_size
+        # (rank, seq, key) of each key ready to send; stale when seq is not _scheduled[key]
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        # key -> its messages in put order, (rank, enqueued, priority, channel, text, blocks)
+        self._queues: Dict[Hashable, Deque[Tuple[float, float, int, str, str, Union[List[Block], List[dict]]]]] = {}
+        # key -> (seq, rank) of its live heap entry
+        self._scheduled: Dict[Hashable, Tuple[int, float]] = {}
+        self._busy: Set[Hashable] = set()
+        self._seq = 0
+        self._queued = 0
+        self._inflight = 0
+        self._workers: List[asyncio.Task] = []
+        self._items: Optional[asyncio.Semaphore] = None
+        self._space: Optional[asyncio.Semaphore] = None
+        self._idle: Optional[asyncio.Event] = None
+        self._classes = [_ClassStats() for _ in PRIORITIES]
+
+        self.failed = 0
+
+    def _start(self) -> None:
+        self._items = asyncio.Semaphore(0)
+        self._space = asyncio.Semaphore(self._max_size)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self._concurrency)]
+
+    def _schedule(self, key: Hashable, rank: float) -> None:
+        self._seq += 1
+        heapq.heappush(self._heap, (rank, self._seq, key))
+        if key not in self._scheduled:
+            # A new ready key; otherwise this replaces its less urgent entry
+            self._items.release()
+        self._scheduled[key] = (self._seq, rank)
+
+    async def put(self, channel: str, text: str, blocks: Union[List[Block], List[dict]], priority: int, key: Optional[Hashable]=None) -> None:
+        if not self._workers:
+            self._start()
+        await self._space.acquire()
+        now = time.monotonic()
+        priority = min(max(priority, 0), len(PRIORITIES) - 1)
+        rank = now + priority * self._aging
+        if key == None:
+            # Unordered: a key of its own
+            self._seq += 1
+            key = ('', self._seq)
+        self._queues.setdefault(key, deque()).append((rank, now, priority, channel, text, blocks))
+        self._queued += 1
+        self._idle.clear()
+        if key in self._busy:
+            # Scheduled once the message in flight was sent
+            return
+        scheduled = self._scheduled.get(key, None)
+        if scheduled == None or rank < scheduled[1]:
+            self._schedule(key, rank)
+
+    def _pop(self) -> Hashable:
+        while True:
+            (_, seq, key) = heapq.heappop(self._heap)
+            scheduled = self._scheduled.get(key, None)
+            if scheduled != None and scheduled[0] == seq:
+                del self._scheduled[key]
+                return key
+
+    async def _work(self) -> None:
+        while True:
+            await self._items.acquire()
+            key = self._pop()
+            (_, enqueued, priority, channel, text, blocks) = self._queues[key].popleft()
+            self._queued -= 1
+            self._busy.add(key)
+            self._space.release()
+            wait = time.monotonic() - enqueued
+            stats = self._classes[priority]
+            stats.sent += 1
+            stats.wait += wait
+            stats.max_wait = max(stats.max_wait, wait)
+            self._inflight += 1
+            try:
+                await self._send(channel, text, blocks)
+            except Exception:
+                self.failed += 1
+                logging.exception(f'failed to send a {PRIORITIES[priority]} message to {channel}')
+            finally:
+                self._inflight -= 1
+                self._busy.discard(key)
+                queue = self._queues[key]
+                if queue:
+                    self._schedule(key, min(entry[0] for entry in queue))
+                else:
+                    del self._queues[key]
+                if self._queued == 0 and self._inflight == 0:
+                    self._idle.set()
+
+    async def drain(self, timeout: float) -> int:
+        """Waits up to timeout seconds for the queue to empty. Returns how
+        many messages were still queued or in flight."""
+        if self._idle != None and not self._idle.is_set():
+            logging.info(f'Draining {len(self)} queued Slack messages...')
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                logging.warning(f'{len(self)} queued Slack messages were not sent before the drain deadline')
+        return len(self)
+
+    async def close(self) -> None:
+        """Stops the senders, dropping whatever is still queued."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._heap.clear()
+        self._queues.clear()
+        self._scheduled.clear()
+        self._busy.clear()
+        self._queued = 0
+
+    def __len__(self) -> int:
+        return self._queued + self._inflight
+
+    def stats(self) -> dict:
+        return {
+            'queued': self._queued,
+            'in_flight': self._inflight,
+            'failed': self.failed,
+            'classes': {
+                name: {
+                    'sent': stats.sent,
+                    'mean_wait': round(stats.wait / stats.sent, 3) if stats.sent else 0,
+                    'max_wait': round(stats.max_wait, 3),
+                }
+                for (name, stats) in zip(PRIORITIES, self._classes)
+            },
+        }
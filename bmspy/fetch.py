@@ -0,0 +1,119 @@
+# StdLib
+import codecs
+import json
+from typing import AsyncIterator, Dict, Optional
+from urllib.parse import urljoin
+
+# Internal deps
+from .health_update import HealthUpdate
+
+# External deps
+import aiohttp
+
+class NotModified(Exception):
+    """The resource has not changed since it was last fetched."""
+
+async def iter_json_array(chunks: AsyncIterator[bytes]) -> AsyncIterator:
+    """Yields the items of a JSON array as its bytes arrive, so neither the
+    whole body nor the whole decoded list is ever held at once."""
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buf = ''
+    pos = 0
+    started = False
+    done = False
+    eof = False
+    chunks = chunks.__aiter__()
+    while not done:
+        # Skip whitespace and separators to the next item
+        while pos < len(buf) and (buf[pos].isspace() or (started and buf[pos] == ',')):
+            pos += 1
+        if pos < len(buf):
+            if not started:
+                if buf[pos] != '[':
+                    raise ValueError(f'expected a JSON array, got "{buf[pos]}"')
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                done = True
+                continue
+            try:
+                (item, end) = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                # A number at the very end of the buffer may still be growing
+                if end < len(buf) or eof:
+                    yield item
+                    pos = end
+                    continue
+        elif eof:
+            raise ValueError('unexpected end of JSON array')
+
+        # Need more data: drop what was consumed and read the next chunk
+        buf = buf[pos:]
+        pos = 0
+        try:
+            buf += utf8.decode(await chunks.__anext__())
+        except StopAsyncIteration:
+            buf += utf8.decode(b'', final=True)
+            eof = True
+
+class NamespaceFetcher:
+    """Fetches namespaces from bms-api over a shared aiohttp session.
+
+    The namespace list is requested gzipped and conditionally: the ETag and
+    Last-Modified of the previous full fetch are sent back, and a 304 raises
+    NotModified instead of transferring the list again."""
+    NAMESPACE_URI = '/ns/{namespace}'
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, source: str, timeout: float=30.0) -> None:
+        self._source = source
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._validators: Dict[str, str] = {}
+
+        self.not_modified = 0
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session == None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=self._timeout, headers={'Accept-Encoding': 'gzip'})
+        return self._session
+
+    async def close(self) -> None:
+        if self._session != None:
+            await self._session.close()
+
+    async def namespace(self, namespace: str) -> HealthUpdate:
+        url = urljoin(self._source, self.NAMESPACE_URI.format(namespace=namespace))
+        async with self._get_session().get(url, ssl=False) as resp:
+            resp.raise_for_status()
+            return HealthUpdate(await resp.json())
+
+    async def namespaces(self, conditional: bool=False) -> AsyncIterator[HealthUpdate]:
+        """Streams every namespace. With conditional, raises NotModified when
+        the list is unchanged since the last complete fetch."""
+        url = urljoin(self._source, self.NAMESPACE_URI.format(namespace=''))
+        headers = {}
+        if conditional:
+            if 'etag' in self._validators:
+                headers['If-None-Match'] = self._validators['etag']
+            if 'last_modified' in self._validators:
+                headers['If-Modified-Since'] = self._validators['last_modified']
+        async with self._get_session().get(url, headers=headers, ssl=False) as resp:
+            if resp.status == 304:
+                self.not_modified += 1
+                raise NotModified(url)
+            resp.raise_for_status()
+            validators = {}
+            if resp.headers.get('ETag', None):
+                validators['etag'] = resp.headers['ETag']
+            if resp.headers.get('Last-Modified', None):
+                validators['last_modified'] = resp.headers['Last-Modified']
+            async for item in iter_json_array(resp.content.iter_chunked(self.CHUNK_SIZE)):
+                yield HealthUpdate(item)
+            # Only a list that was read to the end can be revalidated
+            self._validators = validators
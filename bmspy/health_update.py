@@ -1,23 +1,60 @@
+import hashlib
 import jmespath
-from typing import List, Union
+import sys
+from typing import List, Optional, Union
 from .utils import get_or_die
 
+def _intern(value):
+    """Interns strings so that the many copies of the same kind, tenant or
+    error string held in the caches share one object."""
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+def _intern_all(values) -> List[str]:
+    return [_intern(value) for value in values]
+
 class HealthUpdate(object):
     """An object representing a HealthUpdate from BMS."""
 
+    # Every value healthy_str can take, from best to worst.
+    STATES = ['Healthy', 'Warning', 'Alert', 'Unknown', 'Unhealthy']
+
+    __slots__ = ('_action', '_alerts', '_env', '_errors', '_healthy', '_kind', '_name', '_namespace', '_tenant', '_warnings', '_previous_healthy', '_digest')
+
     def __init__(self, hupdate: dict):
-        self._action = hupdate.get('action', '')
-        self._alerts = hupdate.get('alerts', [])
-        self._env = jmespath.search('tenant.env', hupdate)
-        self._errors = hupdate.get('errors', [])
-        self._healthy = get_or_die(hupdate, 'healthy')
-        self._kind = get_or_die(hupdate, 'kind')
-        self._name = get_or_die(hupdate, 'name')
-        self._namespace = hupdate.get('namespace', '')
-        self._tenant = jmespath.search('tenant.name', hupdate)
-        self._warnings = hupdate.get('warnings', [])
+        self._action = _intern(hupdate.get('action', ''))
+        self._alerts = _intern_all(hupdate.get('alerts', None) or [])
+        self._env = _intern(jmespath.search('tenant.env', hupdate))
+        self._errors = _intern_all(hupdate.get('errors', None) or [])
+        self._healthy = _intern(get_or_die(hupdate, 'healthy'))
+        self._kind = _intern(get_or_die(hupdate, 'kind'))
+        self._name = _intern(get_or_die(hupdate, 'name'))
+        self._namespace = _intern(hupdate.get('namespace', ''))
+        self._tenant = _intern(jmespath.search('tenant.name', hupdate))
+        self._warnings = _intern_all(hupdate.get('warnings', None) or [])
 
         self._previous_healthy = hupdate.get('previous_healthy', None)
+        self._digest = None
+
+    @classmethod
+    def from_values(cls, kind: str, name: str, namespace: str, action: str, healthy: str, tenant: Optional[str], env: Optional[str],
+                    errors: List[str], warnings: List[str], alerts: List[str], previous_healthy: Optional[str]=None) -> 'HealthUpdate':
+        """Builds a HealthUpdate from already decoded values, eg. by decode_update, without a dict and jmespath."""
+        obj = cls.__new__(cls)
+        obj._action = _intern(action)
+        obj._alerts = _intern_all(alerts)
+        obj._env = _intern(env)
+        obj._errors = _intern_all(errors)
+        obj._healthy = _intern(healthy)
+        obj._kind = _intern(kind)
+        obj._name = _intern(name)
+        obj._namespace = _intern(namespace)
+        obj._tenant = _intern(tenant)
+        obj._warnings = _intern_all(warnings)
+        obj._previous_healthy = previous_healthy
+        obj._digest = None
+        return obj
 
     @property
     def action(self) -> str:
@@ -27,6 +64,19 @@ class HealthUpdate(object):
     def alerts(self) -> List[str]:
         return self._alerts
 
+    @property
+    def digest(self) -> bytes:
+        """A stable digest of the sorted errors, warnings and alerts, computed once."""
+        if self._digest == None:
+            h = hashlib.blake2b(digest_size=8)
+            for items in [self._errors, self._warnings, self._alerts]:
+                for item in sorted(items):
+                    h.update(item.encode('utf-8'))
+                    h.update(b'\x1f')
+                h.update(b'\x1e')
+            self._digest = h.digest()
+        return self._digest
+
     @property
     def env(self) -> str:
         return self._env
@@ -75,6 +125,21 @@ class HealthUpdate(object):
     def healthy_str(self) -> str:
         return HealthUpdate.healthy_to_str(self._healthy)
 
+    def inherit_tenant(self, parent: 'HealthUpdate') -> None:
+        """Workload updates may come without a tenant; take it from their namespace."""
+        if self._tenant == None:
+            self._tenant = parent.tenant
+            self._env = parent.env
+
+    @property
+    def is_delete(self) -> bool:
+        """True when BMS reports the object as deleted."""
+        return self._action.lower() in ['delete', 'deleted'] if isinstance(self._action, str) else False
+
+    @property
+    def is_namespace(self) -> bool:
+        return self._kind == 'Namespace'
+
     @property
     def kind(self) -> str:
         return self._kind
@@ -87,6 +152,13 @@ class HealthUpdate(object):
     def namespace(self) -> str:
         return self._namespace
 
+    @property
+    def path(self) -> str:
+        """namespace/name for workloads, just the name for a Namespace."""
+        if self._namespace and not self.is_namespace:
+            return f'{self._namespace}/{self._name}'
+        return self._name
+
     @property
     def previous_healthy(self) -> Union[bool, None]:
         if self._previous_healthy == None:
@@ -110,6 +182,11 @@ class HealthUpdate(object):
     def previous_healthy_str(self) -> Union[str, None]:
         return HealthUpdate.healthy_to_str(self._previous_healthy)
 
+    @property
+    def state_code(self) -> int:
+        """healthy_str as its index in STATES, for compact storage."""
+        return HealthUpdate.STATES.index(self.healthy_str)
+
     @property
     def tenant(self) -> str:
         return self._tenant
@@ -118,8 +195,22 @@ class HealthUpdate(object):
     def warnings(self) -> List[str]:
         return self._warnings
 
+    def to_dict(self) -> dict:
+        """The update in the shape bms-api serves it."""
+        return {
+            'kind': self._kind,
+            'name': self._name,
+            'namespace': self._namespace,
+            'action': self._action,
+            'healthy': self._healthy,
+            'tenant': {'name': self._tenant, 'env': self._env},
+            'errors': self._errors,
+            'warnings': self._warnings,
+            'alerts': self._alerts,
+        }
+
     def to_s(self) -> str:
-        return f'[{self.kind}] {self.name} state: {self.healthy_str}'
+        return f'[{self.kind}] {self.path} state: {self.healthy_str}'
 
     @staticmethod
     def healthy_to_str(healthy: str) -> str:
@@ -0,0 +1,153 @@
+# StdLib
+from array import array
+from collections import OrderedDict, defaultdict
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+# Internal deps
+from .health_update import HealthUpdate
+
+HEALTHY = HealthUpdate.STATES.index('Healthy')
+UNHEALTHY = HealthUpdate.STATES.index('Unhealthy')
+
+class HistoryStats(NamedTuple):
+    """Statistics for one namespace (or the fleet) over a window."""
+    time_in_state: Dict[str, float]
+    flaps: int
+    recoveries: List[float]
+
+    @property
+    def mttr(self) -> Optional[float]:
+        """Mean time from going Unhealthy to being Healthy again, in seconds."""
+        if not self.recoveries:
+            return None
+        return sum(self.recoveries) / len(self.recoveries)
+
+class _Ring:
+    """Fixed size ring buffer of (timestamp, state code) held in typed arrays."""
+    __slots__ = ('times', 'codes', 'start', 'count')
+
+    def __init__(self, capacity: int) -> None:
+        self.times = array('d', bytes(8 * capacity))
+        self.codes = array('b', bytes(capacity))
+        self.start = 0
+        self.count = 0
+
+    def append(self, ts: float, code: int) -> None:
+        capacity = len(self.codes)
+        index = (self.start + self.count) % capacity
+        if self.count == capacity:
+            self.start = (self.start + 1) % capacity
+        else:
+            self.count += 1
+        self.times[index] = ts
+        self.codes[index] = code
+
+    def last(self) -> Optional[int]:
+        if self.count == 0:
+            return None
+        return self.codes[(self.start + self.count - 1) % len(self.codes)]
+
+    def __iter__(self) -> Iterator[Tuple[float, int]]:
+        capacity = len(self.codes)
+        for i in range(self.count):
+            index = (self.start + i) % capacity
+            yield (self.times[index], self.codes[index])
+
+class TransitionHistory:
+    """Bounded history of state transitions for every namespace.
+
+    Each namespace gets a ring buffer of the last `capacity` transitions. The
+    total number of slots is capped at `max_entries`; past that, the buffer of
+    the namespace that transitioned least recently is dropped."""
+    def __init__(self, capacity: int=64, max_entries: int=1048576) -> None:
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1')
+        if max_entries < capacity:
+            raise ValueError(f'max_entries "{ max_entries }" cannot be less than capacity "{ capacity }"')
+
+        self._capacity = capacity
+        self._max_namespaces = max_entries // capacity
+        self._rings: 'OrderedDict[str, _Ring]' = OrderedDict()
+
+    def record(self, name: str, code: int, ts: Optional[float]=None) -> bool:
+        """Records code for name if it differs from the last one recorded.
+        Returns True when a transition was recorded."""
+        ring = self._rings.get(name, None)
+        if ring == None:
+            ring = _Ring(self._capacity)
+            self._rings[name] = ring
+            if len(self._rings) > self._max_namespaces:
+                self._rings.popitem(last=False)
+        elif ring.last() == code:
+            return False
+        ring.append(time.time() if ts == None else ts, code)
+        self._rings.move_to_end(name)
+        return True
+
+    def remove(self, name: str) -> None:
+        self._rings.pop(name, None)
+
+    def entries(self, name: str) -> List[Tuple[float, str]]:
+        """Transitions of name, oldest first, as (timestamp, healthy_str)."""
+        ring = self._rings.get(name, None)
+        if ring == None:
+            return []
+        return [(ts, HealthUpdate.STATES[code]) for (ts, code) in ring]
+
+    def stats(self, name: str, window: float=604800.0, now: Optional[float]=None) -> HistoryStats:
+        """Time in state, flap count and recoveries of name over the last window seconds."""
+        now = time.time() if now == None else now
+        ring = self._rings.get(name, None)
+        return self._stats(ring if ring != None else [], now - window, now)
+
+    def fleet_stats(self, window: float=604800.0, now: Optional[float]=None) -> HistoryStats:
+        now = time.time() if now == None else now
+        time_in_state: Dict[str, float] = defaultdict(float)
+        flaps = 0
+        recoveries: List[float] = []
+        for ring in self._rings.values():
+            stats = self._stats(ring, now - window, now)
+            for (state, seconds) in stats.time_in_state.items():
+                time_in_state[state] += seconds
+            flaps += stats.flaps
+            recoveries.extend(stats.recoveries)
+        return HistoryStats(dict(time_in_state), flaps, recoveries)
+
+    def top_flappers(self, count: int=5, window: float=604800.0, now: Optional[float]=None) -> List[Tuple[str, int]]:
+        now = time.time() if now == None else now
+        flaps = [(name, self._stats(ring, now - window, now).flaps) for (name, ring) in self._rings.items()]
+        flaps = [f for f in flaps if f[1] > 0]
+        flaps.sort(key=lambda f: f[1], reverse=True)
+        return flaps[:count]
+
+    @staticmethod
+    def _stats(entries, since: float, now: float) -> HistoryStats:
+        time_in_state: Dict[str, float] = defaultdict(float)
+        flaps = 0
+        recoveries: List[float] = []
+        state = None
+        cursor = since
+        down_since = None
+        for (ts, code) in entries:
+            if ts > since and state != None:
+                time_in_state[HealthUpdate.STATES[state]] += ts - max(cursor, since)
+                flaps += 1
+            cursor = ts
+            if code == UNHEALTHY:
+                if down_since == None:
+                    down_since = ts
+            elif code == HEALTHY and down_since != None:
+                if ts > since:
+                    recoveries.append(ts - down_since)
+                down_since = None
+            state = code
+        if state != None:
+            time_in_state[HealthUpdate.STATES[state]] += now - max(cursor, since)
+        return HistoryStats(dict(time_in_state), flaps, recoveries)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._rings
+
+    def __len__(self) -> int:
+        return len(self._rings)
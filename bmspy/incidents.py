@@ -0,0 +1,256 @@
+# StdLib
+from collections import Counter, OrderedDict
+import logging
+import re
+import time
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple, TYPE_CHECKING
+
+# Internal deps
+from .builder import Builder
+from .health_update import HealthUpdate
+
+if TYPE_CHECKING:
+    from .slack_bot import SlackBot
+
+_NUMBERS_RE = re.compile(r'\d+')
+
+def error_key(error: str, namespace: str) -> str:
+    """An error string with what differs between namespaces (their name and
+    any numbers) masked, so the same failure matches across namespaces."""
+    if namespace:
+        error = error.replace(namespace, '*')
+    return _NUMBERS_RE.sub('#', error)
+
+class Cluster:
+    """Namespaces that went Unhealthy together, and the incident messages
+    posted for them.
+
+    Members are tracked per channel they are routed to: each channel's
+    incident only ever lists (and summarises) its own members."""
+    def __init__(self, now: float) -> None:
+        self.members: Dict[str, str] = {}
+        self.keys: Counter = Counter()
+        self.member_keys: Dict[str, List[Hashable]] = {}
+        # channel -> names routed there
+        self.routed: Dict[str, Set[str]] = {}
+        # Channels where the cluster is an incident, and those whose message changed
+        self.incidents: Set[str] = set()
+        self.dirty: Set[str] = set()
+        self.newest = now
+        # channel -> (channel id, ts) of the incident message
+        self.posted: Dict[str, Tuple[str, str]] = {}
+
+    @property
+    def incident(self) -> bool:
+        return bool(self.incidents)
+
+    @property
+    def unhealthy(self) -> int:
+        return sum(1 for state in self.members.values() if state == 'Unhealthy')
+
+    def unhealthy_in(self, channel: str) -> int:
+        return sum(1 for name in self.routed.get(channel, ()) if self.members[name] == 'Unhealthy')
+
+    def members_in(self, channel: str) -> Dict[str, str]:
+        return {name: self.members[name] for name in self.routed.get(channel, ())}
+
+    def summary(self, names: Iterable[str]) -> str:
+        """What the named members have in common: their most shared key."""
+        keys: Counter = Counter()
+        for name in names:
+            keys.update(self.member_keys.get(name, []))
+        ((key, count),) = keys.most_common(1) or ((None, 0),)
+        if key == None:
+            return 'no common cause'
+        if key[0] == 'env':
+            return f'tenant {key[1] or "unknown"}, env {key[2] or "unknown"}'
+        return f'"{key[1]}"'
+
+class Correlator:
+    """Groups Unhealthy transitions into incidents.
+
+    Each transition is keyed by its (tenant, env) and by each of its
+    normalised error strings (see error_key). A key seen within the last
+    window seconds joins the transition to the cluster that key belongs to,
+    merging clusters when one transition shares keys with several; clusters
+    are merged smaller into larger, so grouping is near linear instead of
+    comparing transitions pairwise.
+
+    Once a cluster has min_size Unhealthy members routed to a channel, it
+    becomes an incident there: one message lists the channel's members and
+    is updated (chat.update) as they join or recover, instead of one
+    message per namespace. Channels only ever see the members routed to
+    them, even when a shared error joins namespaces of several tenants. An
+    incident closes when its members have recovered, or after incident_ttl
+    seconds without activity.
+
+    Clusters are kept in the order they were last touched, so expiring them
+    only looks at the oldest: a storm of unrelated transitions costs linear
+    time, not a scan of every cluster per transition."""
+    def __init__(self, slackbot: 'SlackBot', window: float=60.0, min_size: int=3, incident_ttl: float=6 * 3600) -> None:
+        if min_size < 2:
+            raise ValueError('min_size must be at least 2')
+
+        self._slackbot = slackbot
+        self._window = window
+        self._min_size = min_size
+        self._incident_ttl = incident_ttl
+        self._cluster_of: Dict[str, Cluster] = {}
+        self._owner: Dict[Hashable, Cluster] = {}
+        # Least recently touched first: clusters, and those that are incidents
+        self._clusters: 'OrderedDict[Cluster, None]' = OrderedDict()
+        self._open: 'OrderedDict[Cluster, None]' = OrderedDict()
+        self._dirty: Set[Cluster] = set()
+
+        self.incidents = 0
+        self.absorbed = 0
+
+    def _keys(self, hupdate: HealthUpdate) -> List[Hashable]:
+        keys: List[Hashable] = []
+        if hupdate.tenant != None:
+            keys.append(('env', hupdate.tenant, hupdate.env))
+        keys.extend(('error', error_key(error, hupdate.name)) for error in set(hupdate.errors))
+        return keys
+
+    def observe(self, hupdate: HealthUpdate, channels: List[str], now: Optional[float]=None) -> Set[str]:
+        """Accounts a namespace transition routed to channels. Returns the
+        channels where it is part of an incident, in which case the
+        incident message replaces its own there."""
+        if not hupdate.is_namespace:
+            return set()
+        now = time.time() if now == None else now
+        self._prune(now)
+        if hupdate.healthy_str != 'Unhealthy':
+            cluster = self._cluster_of.get(hupdate.name, None)
+            if cluster == None:
+                return set()
+            cluster.members[hupdate.name] = hupdate.healthy_str
+            absorbed = set()
+            for channel in cluster.incidents:
+                if hupdate.name in cluster.routed[channel]:
+                    self._mark(cluster, channel)
+                    if channel in channels:
+                        absorbed.add(channel)
+            if absorbed:
+                self.absorbed += 1
+            return absorbed
+
+        keys = self._keys(hupdate)
+        cluster = self._cluster_of.get(hupdate.name, None)
+        for key in keys:
+            owner = self._owner.get(key, None)
+            if owner != None and owner.newest < now - self._window:
+                owner = None
+            if owner == None:
+                continue
+            cluster = owner if cluster == None else self._union(cluster, owner)
+        if cluster == None:
+            cluster = Cluster(now)
+        for key in keys:
+            self._owner[key] = cluster
+        cluster.keys.update(keys)
+        cluster.member_keys[hupdate.name] = keys
+        cluster.members[hupdate.name] = hupdate.healthy_str
+        cluster.newest = now
+        self._cluster_of[hupdate.name] = cluster
+
+        absorbed = set()
+        for channel in channels:
+            cluster.routed.setdefault(channel, set()).add(hupdate.name)
+            if channel not in cluster.incidents and cluster.unhealthy_in(channel) >= self._min_size:
+                cluster.incidents.add(channel)
+                self.incidents += 1
+            if channel in cluster.incidents:
+                self._mark(cluster, channel)
+                absorbed.add(channel)
+        self._touch(cluster)
+        if absorbed:
+            self.absorbed += 1
+        return absorbed
+
+    def _touch(self, cluster: Cluster) -> None:
+        """Moves cluster to the back of its expiry order."""
+        (queue, other) = (self._open, self._clusters) if cluster.incident else (self._clusters, self._open)
+        other.pop(cluster, None)
+        queue[cluster] = None
+        queue.move_to_end(cluster)
+
+    def _mark(self, cluster: Cluster, channel: str) -> None:
+        cluster.dirty.add(channel)
+        self._dirty.add(cluster)
+
+    def _union(self, a: Cluster, b: Cluster) -> Cluster:
+        if a is b:
+            return a
+        if len(a.members) < len(b.members):
+            (a, b) = (b, a)
+        for name in b.members:
+            self._cluster_of[name] = a
+        for key in b.keys:
+            if self._owner.get(key, None) is b:
+                self._owner[key] = a
+        a.members.update(b.members)
+        a.keys.update(b.keys)
+        a.member_keys.update(b.member_keys)
+        for (channel, names) in b.routed.items():
+            a.routed.setdefault(channel, set()).update(names)
+        a.incidents.update(b.incidents)
+        for channel in b.dirty:
+            self._mark(a, channel)
+        for (channel, posted) in b.posted.items():
+            a.posted.setdefault(channel, posted)
+        a.newest = max(a.newest, b.newest)
+        self._forget(b)
+        return a
+
+    def _forget(self, cluster: Cluster) -> None:
+        self._clusters.pop(cluster, None)
+        self._open.pop(cluster, None)
+        self._dirty.discard(cluster)
+
+    def _remove(self, cluster: Cluster) -> None:
+        self._forget(cluster)
+        for name in cluster.members:
+            if self._cluster_of.get(name, None) is cluster:
+                del self._cluster_of[name]
+        for key in cluster.keys:
+            if self._owner.get(key, None) is cluster:
+                del self._owner[key]
+
+    def _prune(self, now: float) -> None:
+        for (queue, ttl) in [(self._clusters, self._window), (self._open, self._incident_ttl)]:
+            while queue:
+                cluster = next(iter(queue))
+                # A dirty cluster is flushed (and maybe removed) first
+                if cluster.newest >= now - ttl or cluster.dirty:
+                    break
+                self._remove(cluster)
+
+    async def flush(self) -> None:
+        """Posts new incident messages and updates changed ones."""
+        (dirty, self._dirty) = (self._dirty, set())
+        for cluster in dirty:
+            (channels, cluster.dirty) = (sorted(cluster.dirty), set())
+            for channel in channels:
+                members = cluster.members_in(channel)
+                resolved = cluster.unhealthy_in(channel) == 0
+                blocks = Builder.incident(members, cluster.summary(members), resolved)
+                text = blocks[0].text.text
+                try:
+                    if channel in cluster.posted:
+                        (channel_id, ts) = cluster.posted[channel]
+                        await self._slackbot.update_message(channel_id, ts, text, blocks)
+                    else:
+                        cluster.posted[channel] = await self._slackbot.post_message(channel, text, blocks)
+                except Exception:
+                    logging.exception(f'failed to post incident to {channel}')
+                if resolved:
+                    # Later members routed here start counting anew
+                    cluster.incidents.discard(channel)
+                    cluster.posted.pop(channel, None)
+                    cluster.routed.pop(channel, None)
+            if cluster.unhealthy == 0:
+                self._remove(cluster)
+
+    def __len__(self) -> int:
+        return sum(1 for cluster in self._open if cluster.incident)
@@ -0,0 +1,276 @@
+# StdLib
+import asyncio
+from collections import deque
+import json
+import logging
+import multiprocessing
+from multiprocessing.connection import Connection
+import signal
+import struct
+from typing import Deque, Dict, List, Optional, Tuple, Union
+
+# Internal deps
+from .health_update import HealthUpdate
+
+VERSION = 1
+# version, then how many errors, warnings and alerts follow the fixed fields
+_HEADER = struct.Struct('!BIII')
+_LENGTH = struct.Struct('!I')
+# records, frames coalesced away
+_BATCH = struct.Struct('!II')
+_NONE = 0xFFFFFFFF
+_FIXED = 8
+
+def _pack_str(parts: List[bytes], value: Optional[str]) -> None:
+    if value == None:
+        parts.append(_LENGTH.pack(_NONE))
+        return
+    data = value.encode('utf-8')
+    parts.append(_LENGTH.pack(len(data)))
+    parts.append(data)
+
+def encode_update(hupdate: HealthUpdate) -> bytes:
+    """hupdate as a compact record: no keys, no quoting, just length-prefixed
+    strings after a fixed header. See decode_update."""
+    parts = [_HEADER.pack(VERSION, len(hupdate.errors), len(hupdate.warnings), len(hupdate.alerts))]
+    for value in [hupdate.kind, hupdate.name, hupdate.namespace, hupdate.action, hupdate.healthy_raw, hupdate.previous_healthy_raw, hupdate.tenant, hupdate.env]:
+        _pack_str(parts, value)
+    for value in hupdate.errors + hupdate.warnings + hupdate.alerts:
+        _pack_str(parts, value)
+    return b''.join(parts)
+
+def decode_update(data: bytes, offset: int=0) -> Tuple[HealthUpdate, int]:
+    """The HealthUpdate encoded at offset in data, and the offset after it."""
+    (version, errors, warnings, alerts) = _HEADER.unpack_from(data, offset)
+    if version != VERSION:
+        raise ValueError(f'unsupported record version {version}')
+    offset += _HEADER.size
+    values: List[Optional[str]] = []
+    for _ in range(_FIXED + errors + warnings + alerts):
+        (length,) = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        if length == _NONE:
+            values.append(None)
+        else:
+            values.append(data[offset:offset + length].decode('utf-8'))
+            offset += length
+    (kind, name, namespace, action, healthy, previous, tenant, env) = values[:_FIXED]
+    lists = values[_FIXED:]
+    hupdate = HealthUpdate.from_values(kind, name, namespace, action, healthy, tenant, env,
+                                       lists[:errors], lists[errors:errors + warnings], lists[errors + warnings:], previous_healthy=previous)
+    return (hupdate, offset)
+
+def _pack_frames(frames: List[Union[str, bytes]]) -> bytes:
+    parts = []
+    for frame in frames:
+        if isinstance(frame, str):
+            frame = frame.encode('utf-8')
+        parts.append(_LENGTH.pack(len(frame)))
+        parts.append(frame)
+    return b''.join(parts)
+
+def decode_frames(data: bytes) -> bytes:
+    """What a worker does with a batch of length-prefixed JSON frames: decode
+    them, keep the latest per (kind, namespace, name) like
+    BMSConsumer.process_batch, and encode the result."""
+    latest: Dict[Tuple[str, str, str], HealthUpdate] = {}
+    frames = 0
+    offset = 0
+    while offset < len(data):
+        (length,) = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        frame = data[offset:offset + length]
+        offset += length
+        frames += 1
+        try:
+            hupdate = HealthUpdate(json.loads(frame))
+        except (ValueError, KeyError, AttributeError) as e:
+            logging.error(f'{e}: dropping undecodable frame')
+            continue
+        latest[(hupdate.kind, hupdate.namespace, hupdate.name)] = hupdate
+    parts = [_BATCH.pack(len(latest), frames - len(latest))]
+    parts.extend(encode_update(hupdate) for hupdate in latest.values())
+    return b''.join(parts)
+
+def unpack_batch(data: bytes) -> Tuple[List[HealthUpdate], int]:
+    """The HealthUpdates of a decode_frames result, and how many frames were coalesced away."""
+    (count, coalesced) = _BATCH.unpack_from(data, 0)
+    offset = _BATCH.size
+    hupdates = []
+    for _ in range(count):
+        (hupdate, offset) = decode_update(data, offset)
+        hupdates.append(hupdate)
+    return (hupdates, coalesced)
+
+def _work(conn: Connection) -> None:
+    # The parent handles signals and stops us by closing the pipe
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    while True:
+        try:
+            data = conn.recv_bytes()
+        except (EOFError, OSError):
+            return
+        conn.send_bytes(decode_frames(data))
+
+class DecodePool:
+    """Worker processes that take JSON decoding off the event loop.
+
+    At high message rates json.loads and building HealthUpdates hold the GIL
+    long enough to starve the websocket reader. With a pool, BMSConsumer
+    sends each batch of raw frames over a pipe to the next worker (round
+    robin) and gets back compact binary records (see encode_update) that are
+    cheap to turn into HealthUpdates. Results are applied in the order the batches
+    were read, so per-namespace ordering is kept while several workers
+    decode at once. Routing, the caches and Slack delivery stay in the main
+    process.
+
+    One pool may be shared by several consumers (eg. the workload
+    listeners): writes to a worker are serialised, so each future gets the
+    result of its own batch.
+
+    A worker that dies is restarted and its pending batches fail with
+    ConnectionError, which the consumer handles like a dropped websocket."""
+    def __init__(self, workers: int=2) -> None:
+        if workers < 1:
+            raise ValueError('workers must be at least 1')
+
+        self._size = workers
+        self._context = multiprocessing.get_context('spawn')
+        self._processes: List[Optional[multiprocessing.process.BaseProcess]] = [None] * workers
+        self._conns: List[Optional[Connection]] = [None] * workers
+        self._pending: List[Deque[asyncio.Future]] = [deque() for _ in range(workers)]
+        self._writing: List[asyncio.Lock] = []
+        self._next = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        self.batches = 0
+        self.frames = 0
+        self.restarts = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+
+    @property
+    def workers(self) -> int:
+        return self._size
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._writing = [asyncio.Lock() for _ in range(self._size)]
+        for i in range(self._size):
+            self._spawn(i)
+
+    def _spawn(self, i: int) -> None:
+        (parent, child) = self._context.Pipe()
+        process = self._context.Process(target=_work, args=(child,), name=f'bmspy-decode-{i}', daemon=True)
+        process.start()
+        child.close()
+        self._processes[i] = process
+        self._conns[i] = parent
+        self._loop.add_reader(parent.fileno(), self._on_result, i)
+
+    def _stop(self, i: int) -> None:
+        conn = self._conns[i]
+        if conn != None:
+            self._loop.remove_reader(conn.fileno())
+            conn.close()
+            self._conns[i] = None
+
+    def _restart(self, i: int, reason: str) -> None:
+        logging.error(f'decode worker {i} {reason}, restarting it')
+        self._stop(i)
+        process = self._processes[i]
+        if process != None and process.is_alive():
+            process.kill()
+        pending = self._pending[i]
+        while pending:
+            future = pending.popleft()
+            if not future.done():
+                future.set_exception(ConnectionError(f'decode worker {i} {reason}'))
+        self.restarts += 1
+        self._spawn(i)
+
+    async def submit(self, frames: List[Union[str, bytes]]) -> asyncio.Future:
+        """Sends frames to the next worker. The returned future resolves to
+        (hupdates, coalesced), see unpack_batch."""
+        if self._loop == None:
+            raise RuntimeError('DecodePool is not started')
+        i = self._next
+        self._next = (i + 1) % self._size
+        data = _pack_frames(frames)
+        future = self._loop.create_future()
+        # One write at a time per worker: a Connection is not thread safe, and
+        # results are matched to futures in the order the batches were written
+        async with self._writing[i]:
+            self._pending[i].append(future)
+            try:
+                # In a thread: a large batch may not fit in the pipe at once
+                await self._loop.run_in_executor(None, self._conns[i].send_bytes, data)
+            except (OSError, AttributeError):
+                # AttributeError: the worker was restarted and its conn closed meanwhile
+                if not future.done():
+                    self._restart(i, 'stopped taking batches')
+        self.batches += 1
+        self.frames += len(frames)
+        self.bytes_out += len(data)
+        return future
+
+    def _on_result(self, i: int) -> None:
+        # A result larger than the pipe buffer arrives in pieces: read it in a
+        # thread, like submit writes, and stop watching until it is read
+        conn = self._conns[i]
+        self._loop.remove_reader(conn.fileno())
+        read = self._loop.run_in_executor(None, conn.recv_bytes)
+        read.add_done_callback(lambda read: self._on_read(i, conn, read))
+
+    def _on_read(self, i: int, conn: Connection, read: asyncio.Future) -> None:
+        if conn is not self._conns[i]:
+            # Stopped or restarted meanwhile
+            return
+        try:
+            data = read.result()
+        except (EOFError, OSError):
+            self._restart(i, 'exited')
+            return
+        self._loop.add_reader(conn.fileno(), self._on_result, i)
+        self.bytes_in += len(data)
+        if not self._pending[i]:
+            return
+        future = self._pending[i].popleft()
+        # Cancelled when the consumer stopped waiting, eg. on reconnect
+        if future.done():
+            return
+        try:
+            future.set_result(unpack_batch(data))
+        except Exception as e:
+            future.set_exception(e)
+
+    async def close(self, timeout: float=5.0) -> int:
+        """Stops the workers, waiting up to timeout seconds for them to exit.
+        Returns how many had to be killed."""
+        for i in range(self._size):
+            self._stop(i)
+            for future in self._pending[i]:
+                future.cancel()
+            self._pending[i].clear()
+        killed = 0
+        deadline = self._loop.time() + timeout if self._loop != None else 0
+        for process in self._processes:
+            if process == None:
+                continue
+            await self._loop.run_in_executor(None, process.join, max(0.0, deadline - self._loop.time()))
+            if process.is_alive():
+                process.kill()
+                killed += 1
+        self._processes = [None] * self._size
+        return killed
+
+    def stats(self) -> dict:
+        return {
+            'workers': self._size,
+            'batches': self.batches,
+            'frames': self.frames,
+            'restarts': self.restarts,
+            'bytes_out': self.bytes_out,
+            'bytes_in': self.bytes_in,
+        }
@@ -0,0 +1,146 @@
+# StdLib
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+from typing import Optional
+
+class Profiler:
+    """Profiles the running process on demand: cProfile over the event loop
+    thread for a number of seconds, plus a tracemalloc snapshot at the end.
+
+    Each run writes <directory>/bmspy-<timestamp>.prof (load it with pstats
+    or snakeviz) and a readable .txt with the top functions and the top
+    allocation sites. Only one run can be in progress."""
+    def __init__(self, directory: str, top: int=25) -> None:
+        self._directory = directory
+        self._top = top
+        self._running = False
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    async def profile(self, seconds: float) -> str:
+        """Profiles for seconds and returns the path of the text report."""
+        if self._running:
+            raise RuntimeError('a profile is already running')
+        if seconds <= 0:
+            raise ValueError('seconds must be positive')
+        self._running = True
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        profiler = cProfile.Profile()
+        try:
+            logging.info(f'Profiling for {seconds} seconds...')
+            profiler.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+            self._running = False
+        return self._write(profiler, snapshot, seconds)
+
+    def _write(self, profiler: cProfile.Profile, snapshot: tracemalloc.Snapshot, seconds: float) -> str:
+        os.makedirs(self._directory, exist_ok=True)
+        base = os.path.join(self._directory, time.strftime('bmspy-%Y%m%d-%H%M%S'))
+        profiler.dump_stats(f'{base}.prof')
+
+        report = io.StringIO()
+        report.write(f'Profile of pid {os.getpid()} over {seconds} seconds{os.linesep}{os.linesep}')
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(self._top)
+        report.write(f'Top {self._top} allocation sites{os.linesep}')
+        for stat in snapshot.statistics('lineno')[:self._top]:
+            report.write(f'{stat}{os.linesep}')
+        with open(f'{base}.txt', 'w') as f:
+            f.write(report.getvalue())
+        logging.info(f'Wrote profile to {base}.txt and {base}.prof')
+        return f'{base}.txt'
+
+    def install_signal(self, seconds: float, sig: signal.Signals=signal.SIGUSR1) -> None:
+        """Starts a profile of seconds whenever sig is received."""
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(sig, self._signalled, seconds)
+
+    def _signalled(self, seconds: float) -> None:
+        if self._running:
+            logging.warning('Ignoring profile signal, a profile is already running')
+            return
+        task = asyncio.get_running_loop().create_task(self.profile(seconds))
+        task.add_done_callback(self._done)
+
+    @staticmethod
+    def _done(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() != None:
+            logging.error(f'profile failed: {task.exception()}')
+
+class LoopMonitor:
+    """Watches the event loop for callbacks that block it.
+
+    A coroutine on the loop bumps a heartbeat every interval seconds and a
+    watchdog thread checks it. When the heartbeat is more than threshold
+    seconds late, the loop is stuck in a callback: the watchdog logs the task
+    that is running and the loop thread's current stack, which points
+    straight at eg. a synchronous HTTP call."""
+    def __init__(self, threshold: float=0.25, interval: Optional[float]=None) -> None:
+        if interval == None:
+            interval = threshold / 5
+        if threshold <= interval:
+            raise ValueError('threshold must be greater than interval')
+
+        self._threshold = threshold
+        self._interval = interval
+        self._heartbeat = time.monotonic()
+        self._stop = threading.Event()
+
+        self.stalls = 0
+        self.max_lag = 0.0
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        thread_id = threading.get_ident()
+        self._stop.clear()
+        self._heartbeat = time.monotonic()
+        watchdog = threading.Thread(target=self._watch, args=(loop, thread_id), name='loop-monitor', daemon=True)
+        watchdog.start()
+        try:
+            while True:
+                expected = time.monotonic() + self._interval
+                await asyncio.sleep(self._interval)
+                lag = time.monotonic() - expected
+                self.max_lag = max(self.max_lag, lag)
+                self._heartbeat = time.monotonic()
+        finally:
+            self._stop.set()
+
+    def _watch(self, loop: asyncio.AbstractEventLoop, thread_id: int) -> None:
+        reported = None
+        while not self._stop.wait(self._interval):
+            heartbeat = self._heartbeat
+            lag = time.monotonic() - heartbeat
+            if lag < self._threshold or reported == heartbeat:
+                continue
+            # Report each stall once, from where the loop is stuck
+            reported = heartbeat
+            self.stalls += 1
+            task = asyncio.current_task(loop)
+            coro = task.get_coro().__qualname__ if task != None else 'a callback outside any task'
+            frame = sys._current_frames().get(thread_id, None)
+            stack = ''.join(traceback.format_stack(frame)) if frame != None else ''
+            logging.warning(f'Event loop blocked for {lag:.3f}s in {coro}:{os.linesep}{stack}')
+
+    def stats(self) -> dict:
+        return {'stalls': self.stalls, 'max_lag': round(self.max_lag, 3)}
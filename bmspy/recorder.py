@@ -0,0 +1,133 @@
+# StdLib
+import asyncio
+import gzip
+import json
+import logging
+import time
+from typing import Iterator, List, Tuple
+import websockets
+
+# Internal deps
+from .consumer import BMSConsumer
+from .slack_bot import SlackBot
+
+# External deps
+from slack_sdk.models.blocks import Block
+
+def read_capture(path: str) -> Iterator[Tuple[float, str]]:
+    """Lazily yields (timestamp, frame) tuples from a capture file.
+
+    A capture is a gzip file of JSON lines. Recording appends a new gzip member
+    every time it is (re)opened, and a truncated trailing member (eg. the
+    recorder was killed mid-write) ends the capture instead of failing it."""
+    with gzip.open(path, 'rt', encoding='utf-8') as capture:
+        try:
+            for line in capture:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                yield (entry['ts'], entry['frame'])
+        except EOFError:
+            logging.warning(f'capture "{path}" ends with a truncated record, stopping there')
+
+class Recorder:
+    """Connects to a BMS websocket and appends every raw frame, with the time
+    it was received, to a compressed capture file."""
+    def __init__(self, url: str, path: str, flush_interval: float=5.0, wait: int=1, max_wait: int=60) -> None:
+        if wait > max_wait:
+            raise ValueError(f'wait "{ wait }" cannot be greater than max_wait "{ max_wait }"')
+
+        self._url = url
+        self._path = path
+        self._flush_interval = flush_interval
+        self._wait = wait
+        self._max_wait = max_wait
+
+        self.frames = 0
+
+    async def start(self) -> None:
+        wait = self._wait
+        with gzip.open(self._path, 'ab') as capture:
+            while True:
+                try:
+                    async with websockets.connect(self._url, ping_interval=None) as websocket:
+                        wait = self._wait
+                        await self.record(websocket, capture)
+                except (websockets.exceptions.ConnectionClosedError, ConnectionError) as e:
+                    capture.flush()
+                    logging.error(f'{e}: connection error contacting bms-api, waiting { wait } seconds to retry')
+                    await asyncio.sleep(wait)
+                    wait = min(wait * 2, self._max_wait)
+
+    async def record(self, websocket: websockets.WebSocketClientProtocol, capture: gzip.GzipFile) -> None:
+        last_flush = time.monotonic()
+        async for message in websocket:
+            if isinstance(message, bytes):
+                message = message.decode('utf-8')
+            entry = json.dumps({'ts': time.time(), 'frame': message}, separators=(',', ':'))
+            capture.write(entry.encode('utf-8') + b'\n')
+            self.frames += 1
+            if time.monotonic() - last_flush >= self._flush_interval:
+                capture.flush()
+                last_flush = time.monotonic()
+
+class SinkSlackBot(SlackBot):
+    """A SlackBot that never talks to Slack. Messages are counted and, when
+    keep is True, held so they can be reported after a replay."""
+    def __init__(self, keep: bool=False) -> None:
+        super().__init__('testing', [])
+        self.keep = keep
+        self.sent = 0
+        self.updated = 0
+        self.messages: List[dict] = []
+
+    async def send_message(self, channel: str, text: str, blocks: List[Block]=[]):
+        self.sent += 1
+        if self.keep:
+            self.messages.append({'channel': channel, 'text': text})
+
+    async def post_message(self, channel: str, text: str, blocks: List[Block]=[]) -> Tuple[str, str]:
+        await self.send_message(channel, text, blocks)
+        return (channel, str(self.sent))
+
+    async def update_message(self, channel: str, ts: str, text: str, blocks: List[Block]=[]):
+        self.updated += 1
+        if self.keep:
+            self.messages.append({'channel': channel, 'text': text})
+
+class Replayer:
+    """Feeds a capture back through a BMSConsumer.
+
+    speed is a multiplier of the recorded pace (1 = real time, 10 = ten times
+    faster); 0 replays as fast as the consumer can take it. The capture is
+    streamed, so its size is not bounded by memory."""
+    def __init__(self, path: str, consumer: BMSConsumer, speed: float=1.0) -> None:
+        if speed < 0:
+            raise ValueError('speed cannot be negative')
+
+        self._path = path
+        self._consumer = consumer
+        self._speed = speed
+
+        self.frames = 0
+        self.elapsed = 0.0
+
+    async def run(self) -> None:
+        started = time.monotonic()
+        first_ts = None
+        for (ts, frame) in read_capture(self._path):
+            if self._speed > 0:
+                if first_ts == None:
+                    first_ts = ts
+                delay = started + (ts - first_ts) / self._speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await self._consumer.process_msg(frame)
+            self.frames += 1
+        self.elapsed = time.monotonic() - started
+
+    @property
+    def throughput(self) -> float:
+        if self.elapsed <= 0:
+            return 0.0
+        return self.frames / self.elapsed
@@ -0,0 +1,68 @@
+# StdLib
+from collections import defaultdict
+from typing import Dict, Optional, Set, Tuple
+
+# Internal deps
+from .health_update import HealthUpdate
+
+class HealthRollup:
+    """Incrementally maintained membership sets of namespaces by state.
+
+    Every namespace is a member of exactly one set at each level: by state,
+    by (tenant, state) and by (tenant, env, state). A transition moves the name
+    between sets, so updates are O(1) and summaries cost the same whatever
+    the size of the fleet."""
+    def __init__(self) -> None:
+        self._keys: Dict[str, Tuple[str, str, str]] = {}
+        self._by_state: Dict[str, Set[str]] = defaultdict(set)
+        self._by_tenant: Dict[Tuple[str, str], Set[str]] = defaultdict(set)
+        self._by_env: Dict[Tuple[str, str, str], Set[str]] = defaultdict(set)
+
+    def update(self, hupdate: HealthUpdate) -> None:
+        key = (hupdate.tenant, hupdate.env, hupdate.healthy_str)
+        previous = self._keys.get(hupdate.name, None)
+        if previous == key:
+            return
+        if previous != None:
+            self._discard(hupdate.name, previous)
+        self._keys[hupdate.name] = key
+        (tenant, env, state) = key
+        self._by_state[state].add(hupdate.name)
+        self._by_tenant[(tenant, state)].add(hupdate.name)
+        self._by_env[key].add(hupdate.name)
+
+    def remove(self, name: str) -> None:
+        previous = self._keys.pop(name, None)
+        if previous != None:
+            self._discard(name, previous)
+
+    def _discard(self, name: str, key: Tuple[str, str, str]) -> None:
+        (tenant, env, state) = key
+        # Empty sets are dropped, so tenants that are gone do not pile up
+        for (sets, set_key) in [(self._by_state, state), (self._by_tenant, (tenant, state)), (self._by_env, key)]:
+            members = sets[set_key]
+            members.discard(name)
+            if not members:
+                del sets[set_key]
+
+    def counts(self, tenant: Optional[str]=None, env: Optional[str]=None) -> Dict[str, int]:
+        """Number of namespaces per state, optionally within a tenant (and
+        env, which is only used along with tenant)."""
+        return {state: len(self.members(state, tenant, env)) for state in HealthUpdate.STATES}
+
+    def members(self, state: str, tenant: Optional[str]=None, env: Optional[str]=None) -> Set[str]:
+        if tenant != None and env != None:
+            return self._by_env.get((tenant, env, state), set())
+        if tenant != None:
+            return self._by_tenant.get((tenant, state), set())
+        return self._by_state.get(state, set())
+
+    def state(self, name: str) -> Optional[str]:
+        key = self._keys.get(name, None)
+        return key[2] if key else None
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._keys
+
+    def __len__(self) -> int:
+        return len(self._keys)
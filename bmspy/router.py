@@ -1,13 +1,22 @@
 import asyncio
+import logging
 import re
-from typing import List, Type, Union
+from typing import Dict, List, Optional, Set, Tuple, Type, Union
+
+# External deps
+from slack_sdk.models.blocks import Block
 
 from .builder import Builder
+from .delivery import DeliveryQueue, priority
 from .health_update import HealthUpdate
+from .incidents import Correlator
+from .silences import Silences
 from .slack_bot import SlackBot
+from .templates import Template
 
 class Route:
-    def __init__(self, channel: str, namespaces: List[str]=[], tenants: List[str]=[]) -> None:
+    def __init__(self, channel: str, namespaces: List[str]=[], tenants: List[str]=[], content_changes: bool=False, kinds: List[str]=['Namespace'],
+                 template: Optional[str]=None, weight: int=0) -> None:
         # Init
         self._namespaces = []
         self._tenants = []
@@ -16,6 +25,13 @@ class Route:
         self.channel = channel
         self.namespaces = namespaces
         self.tenants = tenants
+        # Also notify when errors/warnings/alerts change without a state transition
+        self.content_changes = content_changes
+        self.kinds = kinds
+        # Name of the Template used for transitions, None for the Builder format
+        self.template = template
+        # Priority classes to raise (or, negative, lower) messages by, see delivery.priority
+        self.weight = weight
 
     @property
     def channel(self) -> str:
@@ -27,12 +43,26 @@ class Route:
             value = '#' + value
         self._channel = value
 
+    @property
+    def kinds(self) -> List[str]:
+        return self._kinds
+
+    @kinds.setter
+    def kinds(self, values: Union[List[str],None]) -> None:
+        self._kinds = values if values else ['Namespace']
+        self._kinds_lower = set(kind.lower() for kind in self._kinds)
+
     def matches(self, hupdate: HealthUpdate) -> bool:
-        for tenant in self._tenants:
-            if tenant.match(hupdate.tenant):
-                return True
+        if hupdate.kind.lower() not in self._kinds_lower:
+            return False
+        if hupdate.tenant != None:
+            for tenant in self._tenants:
+                if tenant.match(hupdate.tenant):
+                    return True
+        # Workloads are matched on the namespace they live in
+        name = hupdate.name if hupdate.is_namespace else hupdate.namespace
         for namespace in self._namespaces:
-            if namespace.match(hupdate.name):
+            if namespace.match(name):
                 return True
         return False
 
@@ -68,7 +98,7 @@ class Route:
 
     def __eq__(self, other):
         if isinstance(other, self.__class__):
-            if self._channel == other.channel and self._namespaces == other.namespaces and self._tenants == other.tenants:
+            if self._channel == other.channel and self._namespaces == other.namespaces and self._tenants == other.tenants and self.content_changes == other.content_changes and self._kinds_lower == other._kinds_lower and self.template == other.template and self.weight == other.weight:
                 return True
             else:
                 return False
@@ -110,11 +140,37 @@ class Router:
           - 'testing-stage'
         tenants:
           - 'tenant1'
-          - 'tenant2'"""
+          - 'tenant2'
+        content_changes: true
+
+    content_changes is optional (default false). When true, the Route is also
+    notified when the errors, warnings or alerts of a namespace change while
+    its state stays the same.
+
+    kinds is optional (default [Namespace]). Routes for workload kinds, eg.
+    [Deployment], match namespaces and tenants against the namespace the
+    workload lives in.
 
-    def __init__(self, slackbot: Type[SlackBot], routes: List[dict] = []) -> None:
+    template is optional and names an entry of the 'templates' key, see
+    Template; transitions for the Route are rendered with it.
+
+    weight is optional (default 0). With a delivery queue, messages for the
+    Route are sent that many priority classes ahead, see DeliveryQueue.
+
+    When silences are set, updates they match are counted instead of sent,
+    see Silences. When a correlator is set, namespaces going Unhealthy
+    together are reported as one incident message, see Correlator."""
+
+    def __init__(self, slackbot: Type[SlackBot], routes: List[dict] = [], silences: Optional[Silences] = None, templates: Dict[str, Template] = {},
+                 correlator: Optional[Correlator] = None, delivery: Optional[DeliveryQueue] = None) -> None:
         # Init
         self._routes = []
+        self._templates = dict(templates)
+        self._wants_content_changes = False
+        self._pending: Set[asyncio.Task] = set()
+        self.silences = silences
+        self.correlator = correlator
+        self.delivery = delivery
 
         # Assignment
         self._slackbot = slackbot
@@ -135,9 +191,14 @@ class Router:
                 raise KeyError('must include either a list of namespaces or tenants')
 
             # Create the Route
-            route = Route(channel, namespaces, tenants)
+            route = Route(channel, namespaces, tenants, content_changes=bool(route.get('content_changes', False)), kinds=route.get('kinds', None),
+                          template=route.get('template', None), weight=int(route.get('weight', 0)))
+
+        if route.template != None and route.template not in self._templates:
+            raise KeyError(f'template "{route.template}" is not defined')
 
         self._routes.append(route)
+        self._wants_content_changes = self._wants_content_changes or route.content_changes
 
     def add_routes(self, routes: Union[List[dict], List[Route]]) -> None:
         for route in routes:
@@ -150,21 +211,111 @@ class Router:
         return False
 
     async def process_msg(self, hupdate: HealthUpdate) -> None:
-        blocks = Builder.transition_msg(hupdate)
+        await self._send_each(self._transition_messages(hupdate))
+        await self._flush_incidents()
+
+    async def process_content_change(self, hupdate: HealthUpdate, previous: HealthUpdate) -> None:
+        """Notifies the Routes that opted in to content_changes that hupdate
+        differs from previous while in the same state."""
+        await self._send_each(self._content_change_messages(hupdate, previous))
+
+    async def process_batch(self, transitions: List[HealthUpdate], changes: List[Tuple[HealthUpdate, HealthUpdate]] = []) -> None:
+        """process_msg and process_content_change for a whole batch, with
+        every resulting message sent concurrently."""
+        messages = []
+        for hupdate in transitions:
+            messages.extend(self._transition_messages(hupdate))
+        for (hupdate, previous) in changes:
+            messages.extend(self._content_change_messages(hupdate, previous))
+        await self._send_each(messages)
+        await self._flush_incidents()
+
+    def _transition_messages(self, hupdate: HealthUpdate) -> List[Tuple[str, str, Union[List[Block], List[dict]], int, Optional[str]]]:
+        routes = [route for route in self._routes if route.matches(hupdate)]
+        if not routes or self._silenced(hupdate, routes):
+            return []
+        if self.correlator != None:
+            absorbed = self.correlator.observe(hupdate, [route.channel for route in routes])
+            routes = [route for route in routes if route.channel not in absorbed]
+            if not routes:
+                return []
+        # Render once per template in use
+        rendered: Dict[Optional[str], Tuple[str, Union[List[Block], List[dict]]]] = {}
+        for route in routes:
+            if route.template not in rendered:
+                if route.template == None:
+                    blocks = Builder.transition_msg(hupdate)
+                    rendered[None] = (blocks[0].text.text, blocks)
+                else:
+                    rendered[route.template] = self._templates[route.template].render(hupdate)
+        return [(route.channel, *rendered[route.template], priority(hupdate, route.weight), hupdate.path) for route in routes]
+
+    def _content_change_messages(self, hupdate: HealthUpdate, previous: HealthUpdate) -> List[Tuple[str, str, Union[List[Block], List[dict]], int, Optional[str]]]:
+        routes = [route for route in self._routes if route.content_changes and route.matches(hupdate)]
+        if not routes or self._silenced(hupdate, routes):
+            return []
+        blocks = Builder.content_change_msg(hupdate, previous)
         text = blocks[0].text.text
+        return [(route.channel, text, blocks, priority(hupdate, route.weight), hupdate.path) for route in routes]
 
+    def _silenced(self, hupdate: HealthUpdate, routes: List[Route]) -> bool:
+        if self.silences == None:
+            return False
+        return self.silences.suppress(hupdate, [route.channel for route in routes])
+
+    async def _flush_incidents(self) -> None:
+        if self.correlator == None:
+            return
+        # Tracked and shielded like _send_each, so drain() waits on it too
+        task = asyncio.create_task(self.correlator.flush())
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+        await asyncio.shield(task)
+
+    async def _send_each(self, messages: List[Tuple[str, str, Union[List[Block], List[dict]], int, Optional[str]]]) -> None:
+        """Sends (channel, text, blocks, priority, path) messages concurrently,
+        or queues them by priority when there is a delivery queue, keeping
+        the messages about one path in order per channel."""
+        if self.delivery != None:
+            for (channel, text, blocks, priority, path) in messages:
+                await self.delivery.put(channel, text, blocks, priority, key=None if path == None else (channel, path))
+            return
         pending = []
-        for route in self._routes:
-            if route.matches(hupdate):
-                pending.append(asyncio.create_task(self._slackbot.send_message(channel = route.channel, text = text, blocks = blocks)))
+        for (channel, text, blocks, _, _) in messages:
+            task = asyncio.create_task(self._slackbot.send_message(channel = channel, text = text, blocks = blocks))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+            pending.append(task)
 
         if pending:
+            # Shielded so that cancelling the caller (eg. on shutdown) leaves
+            # the sends running for drain() to wait on.
             group = asyncio.gather(*pending, return_exceptions = True)
-            await group
+            await asyncio.shield(group)
+
+    async def drain(self, timeout: float) -> int:
+        """Waits up to timeout seconds for in-flight sends. Returns how many
+        were still pending when it gave up."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        if self._pending:
+            logging.info(f'Draining {len(self._pending)} pending Slack messages...')
+            await asyncio.wait(set(self._pending), timeout=timeout)
+        if self._pending:
+            logging.warning(f'{len(self._pending)} Slack messages were not sent before the drain deadline')
+        if self.delivery != None:
+            # Whatever time is left
+            return len(self._pending) + await self.delivery.drain(max(0.0, deadline - loop.time()))
+        return len(self._pending)
 
     def __len__(self) -> bool:
         return len(self._routes)
 
+    @property
+    def wants_content_changes(self) -> bool:
+        """True if any Route opted in to content_changes."""
+        return self._wants_content_changes
+
     @property
     def routes(self) -> List[Route]:
         return self._routes
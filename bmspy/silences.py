@@ -0,0 +1,304 @@
+# StdLib
+import asyncio
+from bisect import bisect_right
+from datetime import datetime, timezone
+from fnmatch import fnmatchcase
+import itertools
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING, Union
+
+# Internal deps
+from .health_update import HealthUpdate
+
+if TYPE_CHECKING:
+    from .slack_bot import SlackBot
+
+PERIODS = {'daily': 86400, 'weekly': 604800}
+
+def parse_time(value: Union[str, datetime, float, int]) -> float:
+    """Epoch seconds from an epoch, a datetime or an ISO 8601 string. Naive times are UTC."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    if isinstance(value, datetime):
+        if value.tzinfo == None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    raise ValueError(f'cannot parse time "{ value }"')
+
+def parse_duration(value: str) -> float:
+    """Seconds from eg. '90s', '30m', '2h' or '1d'."""
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    if not value or value[-1] not in units or not value[:-1].isdigit():
+        raise ValueError(f'invalid duration "{ value }", use eg. 30m, 2h or 1d')
+    return int(value[:-1]) * units[value[-1]]
+
+class Silence:
+    """Silences the transitions of matching namespaces between start and end,
+    optionally repeating every period seconds (or 'daily'/'weekly') until
+    `until`.
+
+    namespaces are globs matched against the namespace name; tenants and envs
+    are exact. Every criterion given must match; at least one is required."""
+    _ids = itertools.count(1)
+
+    def __init__(self, start: float, end: float, namespaces: List[str]=[], tenants: List[str]=[], envs: List[str]=[],
+                 every: Union[str, float, None]=None, until: Optional[float]=None, created_by: str='', comment: str='') -> None:
+        if end <= start:
+            raise ValueError('end must be after start')
+        if not (namespaces or tenants or envs):
+            raise ValueError('a silence needs namespaces, tenants or envs to match')
+        if isinstance(every, str):
+            if every not in PERIODS:
+                raise ValueError(f'every must be one of {", ".join(PERIODS)} or a number of seconds')
+            every = PERIODS[every]
+        if every != None and every < end - start:
+            raise ValueError('a recurring silence cannot be longer than its period')
+
+        self.id = next(Silence._ids)
+        self.start = start
+        self.end = end
+        self.namespaces = list(namespaces)
+        self.tenants = set(tenants)
+        self.envs = set(envs)
+        self.every = every
+        self.until = until
+        self.created_by = created_by
+        self.comment = comment
+
+    @classmethod
+    def from_dict(cls, values: dict) -> 'Silence':
+        """A Silence from a settings.yaml entry."""
+        start = parse_time(values['start'])
+        if 'end' in values:
+            end = parse_time(values['end'])
+        else:
+            end = start + parse_duration(str(values['duration']))
+        until = parse_time(values['until']) if values.get('until', None) != None else None
+        return cls(start, end, values.get('namespaces', None) or [], values.get('tenants', None) or [], values.get('envs', None) or [],
+                   every=values.get('every', None), until=until, comment=values.get('comment', ''))
+
+    def matches(self, hupdate: HealthUpdate) -> bool:
+        if self.tenants and hupdate.tenant not in self.tenants:
+            return False
+        if self.envs and hupdate.env not in self.envs:
+            return False
+        if self.namespaces:
+            name = hupdate.name if hupdate.is_namespace else hupdate.namespace
+            return any(fnmatchcase(name, pattern) for pattern in self.namespaces)
+        return True
+
+    def occurrences(self, since: float, until: float) -> List[Tuple[float, float]]:
+        """The (start, end) windows of this silence that overlap [since, until)."""
+        if self.every == None:
+            return [(self.start, self.end)] if self.start < until and self.end > since else []
+        duration = self.end - self.start
+        last = min(until, self.until) if self.until != None else until
+        k = max(0, int((since - self.end) // self.every) + 1)
+        result = []
+        while True:
+            start = self.start + k * self.every
+            if start >= last:
+                break
+            if start + duration > since:
+                result.append((start, start + duration))
+            k += 1
+        return result
+
+    def finished(self, now: float) -> bool:
+        """True once no occurrence can start or still be running after now."""
+        if self.every == None:
+            return self.end <= now
+        return self.until != None and self.until + (self.end - self.start) <= now
+
+    def describe(self) -> str:
+        criteria = []
+        if self.namespaces:
+            criteria.append(f'namespaces {", ".join(self.namespaces)}')
+        if self.tenants:
+            criteria.append(f'tenants {", ".join(sorted(self.tenants))}')
+        if self.envs:
+            criteria.append(f'envs {", ".join(sorted(self.envs))}')
+        when = f'{_fmt(self.start)} to {_fmt(self.end)}'
+        if self.every != None:
+            period = {v: k for (k, v) in PERIODS.items()}.get(self.every, f'every {int(self.every)}s')
+            when += f', {period}'
+        text = f'#{self.id}: {"; ".join(criteria)} from {when}'
+        if self.created_by:
+            text += f' (by <@{self.created_by}>)'
+        if self.comment:
+            text += f': {self.comment}'
+        return text
+
+def _fmt(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%d %H:%M UTC')
+
+class SilenceIndex:
+    """Interval index over silence occurrences.
+
+    The occurrences within [since, until) are kept sorted by start. Those
+    covering t all start in (t - longest, t], so finding them is a bisect and
+    a scan of that slice; the few longer than LONG (eg. a month long freeze)
+    are kept aside and scanned on their own, so they do not widen the slice.
+    Memory is linear in the occurrences, and silences are added and removed
+    without rebuilding the index."""
+    LONG = 86400.0
+
+    def __init__(self, silences: List[Silence], since: float, until: float) -> None:
+        self.since = since
+        self.until = until
+        self._starts: List[float] = []
+        self._occurrences: List[Tuple[Silence, float, float]] = []
+        self._long: List[Tuple[Silence, float, float]] = []
+        self._longest = 0.0
+        for silence in silences:
+            self.add(silence)
+
+    def add(self, silence: Silence) -> None:
+        for (start, end) in silence.occurrences(self.since, self.until):
+            occurrence = (silence, start, end)
+            if end - start > self.LONG:
+                self._long.append(occurrence)
+                continue
+            i = bisect_right(self._starts, start)
+            self._starts.insert(i, start)
+            self._occurrences.insert(i, occurrence)
+            self._longest = max(self._longest, end - start)
+
+    def remove(self, id: int) -> None:
+        kept = [(start, occurrence) for (start, occurrence) in zip(self._starts, self._occurrences) if occurrence[0].id != id]
+        self._starts = [start for (start, _) in kept]
+        self._occurrences = [occurrence for (_, occurrence) in kept]
+        self._long = [occurrence for occurrence in self._long if occurrence[0].id != id]
+
+    def active(self, ts: float) -> Tuple[Tuple[Silence, float, float], ...]:
+        """The (silence, start, end) occurrences covering ts, by start."""
+        lo = bisect_right(self._starts, ts - self._longest)
+        hi = bisect_right(self._starts, ts)
+        active = [o for o in self._occurrences[lo:hi] if o[2] > ts]
+        if self._long:
+            active.extend(o for o in self._long if o[1] <= ts < o[2])
+            active.sort(key=lambda o: o[1])
+        return tuple(active)
+
+    def __len__(self) -> int:
+        return len(self._occurrences) + len(self._long)
+
+class Silences:
+    """Silences from settings.yaml and Slack, with suppressed transitions
+    counted per occurrence and channel. Once an occurrence ends, run() sends
+    each channel that missed transitions one summary of them.
+
+    Silences are defined in the 'silences' key of the config file or with the
+    silence Slack command. An example weekly maintenance window:
+    silences:
+      - tenants:
+          - blue
+        namespaces:
+          - 'blue-*'
+        envs:
+          - prod
+        start: '2024-01-06T02:00:00Z'
+        duration: 2h
+        every: weekly
+        comment: 'Saturday patching'
+
+    end can be given instead of duration, and until ends a recurring window.
+    The index covers HORIZON seconds ahead and is rebuilt when that runs out;
+    adding or removing a silence updates it in place."""
+    HORIZON = 7 * 86400
+
+    def __init__(self, slackbot: 'SlackBot', silences: List[Silence]=[], interval: float=30.0) -> None:
+        self._slackbot = slackbot
+        self._interval = interval
+        self._silences: Dict[int, Silence] = {s.id: s for s in silences}
+        self._index: Optional[SilenceIndex] = None
+        # (silence id, occurrence start, occurrence end) -> channel -> namespace -> (count, last state)
+        self._suppressed: Dict[Tuple[int, float, float], Dict[str, Dict[str, List]]] = {}
+
+        self.suppressed_total = 0
+
+    def add(self, silence: Silence) -> Silence:
+        if silence.id in self._silences:
+            self.remove(silence.id)
+        self._silences[silence.id] = silence
+        if self._index != None:
+            self._index.add(silence)
+        return silence
+
+    def add_dicts(self, values: List[dict]) -> None:
+        for v in values:
+            self.add(Silence.from_dict(v))
+
+    def remove(self, id: int) -> Optional[Silence]:
+        silence = self._silences.pop(id, None)
+        if silence != None and self._index != None:
+            self._index.remove(id)
+        return silence
+
+    def list(self, now: Optional[float]=None) -> List[Silence]:
+        """Silences that are active now or will be within the horizon."""
+        now = time.time() if now == None else now
+        return [s for s in self._silences.values() if s.occurrences(now, now + self.HORIZON)]
+
+    def _index_at(self, now: float) -> SilenceIndex:
+        if self._index == None or now >= self._index.until or now < self._index.since:
+            self._index = SilenceIndex(list(self._silences.values()), now - 60, now + self.HORIZON)
+        return self._index
+
+    def active(self, hupdate: HealthUpdate, now: Optional[float]=None) -> List[Tuple[Silence, float, float]]:
+        now = time.time() if now == None else now
+        if not self._silences:
+            return []
+        return [o for o in self._index_at(now).active(now) if o[0].matches(hupdate)]
+
+    def suppress(self, hupdate: HealthUpdate, channels: List[str], now: Optional[float]=None) -> bool:
+        """True when hupdate is silenced; it is then counted against every
+        channel that would have been notified."""
+        occurrences = self.active(hupdate, now)
+        if not occurrences:
+            return False
+        (silence, start, end) = occurrences[0]
+        per_channel = self._suppressed.setdefault((silence.id, start, end), {})
+        for channel in channels:
+            entry = per_channel.setdefault(channel, {}).setdefault(hupdate.path, [0, None])
+            entry[0] += 1
+            entry[1] = hupdate.healthy_str
+        self.suppressed_total += 1
+        return True
+
+    async def flush(self, now: Optional[float]=None) -> int:
+        """Sends the summaries of occurrences that have ended and forgets
+        finished silences. Returns how many summaries were sent."""
+        now = time.time() if now == None else now
+        sent = 0
+        for key in [key for key in self._suppressed if key[2] <= now]:
+            (id, start, end) = key
+            silence = self._silences.get(id, None)
+            label = silence.describe() if silence != None else f'#{id}'
+            for (channel, namespaces) in self._suppressed.pop(key).items():
+                total = sum(count for (count, _) in namespaces.values())
+                lines = [f'*{name}*: {count} transitions, last {state}' for (name, (count, state)) in sorted(namespaces.items())]
+                text = f':mute: Silence ended, {total} transitions were suppressed in {len(namespaces)} namespaces. {label}'
+                await self._slackbot.send_message(channel=channel, text=text, blocks=[
+                    {'type': 'section', 'text': {'type': 'mrkdwn', 'text': text}},
+                    {'type': 'section', 'text': {'type': 'mrkdwn', 'text': os.linesep.join(lines[:50])[:3000]}},
+                ])
+                sent += 1
+        for silence in [s for s in self._silences.values() if s.finished(now)]:
+            self.remove(silence.id)
+        return sent
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.flush()
+            except Exception:
+                logging.exception('failed to send silence summaries')
+            await asyncio.sleep(self._interval)
+
+    def __len__(self) -> int:
+        return len(self._silences)
@@ -1,30 +1,55 @@
 # StdLib
+import asyncio
 from asyncio import sleep
+from collections import defaultdict
 import logging
+import os
 from pprint import pprint
 import re
-import requests
-from typing import List, Type
-from urllib.parse import urljoin
+import time
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple, Type, TYPE_CHECKING, Union
 
 # Internal Deps
+from .admission import Admission, Busy
+from .breaker import BreakerOpen, CircuitBreaker
 from .builder import Builder
+from .channels import ChannelDirectory
+from .fetch import NamespaceFetcher, NotModified
 from .health_update import HealthUpdate
+from .profiler import Profiler
+from .silences import Silence, Silences, parse_duration
+from .utils import duration_str
 
 # External Deps
+import aiohttp
 from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
 from slack_bolt.async_app import AsyncApp
-from slack_sdk.models.blocks import Block, DividerBlock, HeaderBlock
-from slack_sdk.models.blocks.basic_components import PlainTextObject
+from slack_sdk.models.blocks import Block, DividerBlock, HeaderBlock, SectionBlock
+from slack_sdk.models.blocks.basic_components import MarkdownTextObject, PlainTextObject
+from slack_sdk.web.async_client import AsyncWebClient
+
+if TYPE_CHECKING:
+    from .consumer import BMSConsumer
 
 class SlackBot:
     HEALTHY = ('healthy', ':white_check_mark:')
     UNHEALTHY = ('unhealthy', ':x:')
     WARNING = ('warning', ':warning:')
-
-    NAMESPACE_URI = '/ns/{namespace}'
+    # Commands that fetch from bms-api, and so go through admission control;
+    # the others (silence, help, ...) must keep working when it is busy
+    FETCHING = ['h', 'health', 'status']
 
     def __init__(self, token: str, sources: List[str], wait: int=30) -> None:
+        self._consumer: Optional['BMSConsumer'] = None
+        self.admission = Admission()
+        self.breaker = CircuitBreaker(is_failure=_upstream_failure)
+        self._revalidating: Optional[asyncio.Task] = None
+        self._silences: Optional[Silences] = None
+        # Slack user ids allowed to run admin commands, eg. profile
+        self.admins: Set[str] = set()
+        self.profiler: Optional[Profiler] = None
+        self.channels: Optional[ChannelDirectory] = None
+
         # This is for unittest and returns a known unusable object
         if token == 'testing':
             return
@@ -36,31 +61,62 @@ class SlackBot:
             raise ValueError('sources cannot be empty')
 
         # Init self
-        self._app = AsyncApp(token=token)
+        # SLACK_API_URL points the Web API (and so Socket Mode) at another host, eg. the load-test harness
+        if os.environ.get('SLACK_API_URL', None):
+            self._app = AsyncApp(client=AsyncWebClient(token=token, base_url=os.environ['SLACK_API_URL']))
+        else:
+            self._app = AsyncApp(token=token)
         self.token = token
         self._sources = sources
         self._wait = wait
+        self._fetcher = NamespaceFetcher(sources[0])
+        self.channels = ChannelDirectory(self._app.client)
 
         # Setup handlers
         self._app.action('health')(self.action_health)
         self._app.event('app_mention')(self.handle_mention)
-        shortcut_re = f"^b ({'|'.join(self.commands())}) ?(.*)$"
+        shortcut_re = f"^b ({'|'.join(self.commands())})\\b ?(.*)$"
         self._app.message(re.compile(shortcut_re))(self.handle_message)
         self._app.event('message')(self.handle_message)
+        for event in ['channel_rename', 'group_rename']:
+            self._app.event(event)(self.handle_rename)
+        for event in ['channel_left', 'group_left']:
+            self._app.event(event)(self.handle_left)
 
     async def start(self) -> None:
         handler = AsyncSocketModeHandler(self._app)
-        while True:
-            try:
-                await handler.start_async()
-            except (ConnectionError, TimeoutError) as e:
-                logging.error(e, f"connection error contacting Slack, waiting { self._wait } seconds to retry")
-                await sleep(self._wait)
-                continue
+        try:
+            while True:
+                try:
+                    await handler.start_async()
+                except (ConnectionError, TimeoutError) as e:
+                    logging.error(f"{e}: connection error contacting Slack, waiting { self._wait } seconds to retry")
+                    await sleep(self._wait)
+                    continue
+        finally:
+            await handler.close_async()
+            await self._fetcher.close()
+
+    async def resolve_channels(self, channels: List[str]) -> None:
+        """Resolves channels to ids for sending, raising ValueError if any
+        is missing or the bot is not in it."""
+        await self.channels.refresh()
+        self.channels.check(channels)
+
+    async def handle_rename(self, event) -> None:
+        channel = event['channel']
+        self.channels.rename(channel['id'], channel['name'])
+
+    async def handle_left(self, event) -> None:
+        self.channels.left(event['channel'])
+
+    def _channel_id(self, channel: str) -> str:
+        return channel if self.channels == None else self.channels.resolve(channel)
 
     async def action_health(self, ack, action, say):
         await ack()
-        await self.say_health(action['selected_option']['value'], say)
+        # Clicks are interactive, they skip the rate limits and the fetch queue
+        await self.say_health(action['selected_option']['value'], say, priority=True)
 
     async def cmd_h(self, event, text, say) -> None:
         await self.cmd_health(event, text, say)
@@ -71,18 +127,23 @@ class SlackBot:
         text may be 0-2 "tokens".
         Case #1: No tokens. text=''. Will return a overall summary of all namespaces.
         Case #2: 1 token. text='mynamespace'. Will return the health of that namespace.
+                 text='tenant=mytenant' will return a summary of the namespaces of mytenant.
         Case #3: 2 tokens. text='deployment mynamespace/mydeployment. Will return the health of mydeployment from mynamespace.
+                 Served from the consumer's workload cache, see BMSConsumer workload_urls.
         """
         token_count = len(text.split())
         if token_count == 0:
-            namespaces = await self.fetch_all_namespaces()
-            blocks = Builder.health_overview(namespaces)
+            blocks = await self.health_overview()
             text = blocks[0].text.text
             await say(text, blocks, thread_ts=event.get('thread_ts', None))
         elif token_count == 1:
             (namespace, text) = self.next_token(text)
+            if namespace.startswith('tenant='):
+                blocks = await self.health_overview(tenant=namespace[len('tenant='):])
+                text = blocks[0].text.text
+                await say(text, blocks, thread_ts=event.get('thread_ts', None))
             # Check for wildcards
-            if '*' in namespace:
+            elif '*' in namespace:
                 namespace_regex = re.compile(namespace.replace('*', '.*'))
                 blocks: List[Block] = []
                 blocks.append(
@@ -93,12 +154,24 @@ class SlackBot:
                     )
                 )
                 blocks.append(DividerBlock())
-                for ns in await self.fetch_all_namespaces():
+                async for ns in self._iter_namespaces_admitted():
                     if namespace_regex.fullmatch(ns.name):
                         blocks.extend(Builder.health(ns))
                 await say(f'Health results for "{namespace}".', blocks)
             else:
                 await self.say_health(namespace, say, event)
+        elif token_count == 2:
+            (kind, text) = self.next_token(text)
+            (path, text) = self.next_token(text)
+            (namespace, _, name) = path.partition('/')
+            hupdate = None
+            if self._consumer != None:
+                hupdate = self._consumer.workload(kind, namespace, name)
+            if hupdate == None:
+                await say(f'No health cached for {kind} {path}. Is bmspy subscribed to {kind} updates?')
+                return
+            blocks = Builder.health(hupdate, details=True)
+            await say(hupdate.to_s(), blocks, thread_ts=event.get('thread_ts', None))
 
     async def cmd_help(self, event, text, say) -> None:
         """Returns a help message, duh?"""
@@ -106,34 +179,273 @@ class SlackBot:
         if token == '':
             await say("I do one thing, and I try to do it well. Just @mention me with 'health %namespace%' or just 'health'.")
 
+    async def cmd_history(self, event, text, say) -> None:
+        """Lists the recorded state transitions of a namespace."""
+        (namespace, text) = self.next_token(text)
+        if namespace == '':
+            await say('Usage: history <namespace>')
+            return
+        if self._consumer == None or namespace not in self._consumer.history:
+            await say(f'No history recorded for {namespace}.')
+            return
+        blocks = Builder.history(namespace, self._consumer.history.entries(namespace))
+        await say(blocks[0].text.text, blocks, thread_ts=event.get('thread_ts', None))
+
+    async def cmd_profile(self, event, text, say) -> None:
+        """Admins only: profiles bmspy for N seconds (default 30) and writes the report to disk."""
+        if event.get('user', None) not in self.admins:
+            await say('Sorry, only bmspy admins can do that.')
+            return
+        if self.profiler == None:
+            await say('Profiling is not enabled.')
+            return
+        (token, text) = self.next_token(text)
+        seconds = int(token) if token.isdigit() else 30
+        if self.profiler.running:
+            await say('A profile is already running.')
+            return
+        await say(f'Profiling for {seconds} seconds...', thread_ts=event.get('thread_ts', None))
+        try:
+            path = await self.profiler.profile(seconds)
+        except Exception as e:
+            logging.exception('profile failed')
+            await say(f'Profiling failed: {e}')
+            return
+        await say(f'Profile written to {path}', thread_ts=event.get('thread_ts', None))
+
+    async def cmd_query(self, event, text, say) -> None:
+        """Filters and groups the cached namespaces, eg. 'query tenant=blue env=prod state=unhealthy errors>3' or 'query state!=healthy by tenant'."""
+        if self._consumer == None or not self._consumer.warm:
+            await say('The namespace cache is not populated yet, try again shortly.')
+            return
+        text = text.strip()
+        try:
+            result = self._consumer.columns.query(text)
+        except ValueError as e:
+            await say(f'{e}. Usage: query [field=value ...] [by tenant|env|state], fields: state, tenant, env, errors, warnings, alerts')
+            return
+        blocks = Builder.query(text, result)
+        await say(blocks[0].text.text, blocks, thread_ts=event.get('thread_ts', None))
+
+    async def cmd_silence(self, event, text, say) -> None:
+        """Silences transitions for a while, eg. 'silence blue-* 2h env=prod upgrading'."""
+        if self._silences == None:
+            await say('Silences are not enabled.')
+            return
+        usage = 'Usage: silence [namespace-glob] <duration> [tenant=<tenant>] [env=<env>] [comment]'
+        (namespaces, tenants, envs, duration, comment) = ([], [], [], None, [])
+        for token in text.split():
+            if token.startswith('tenant='):
+                tenants.append(token[len('tenant='):])
+            elif token.startswith('env='):
+                envs.append(token[len('env='):])
+            elif duration == None and re.fullmatch(r'\d+[smhd]', token):
+                duration = parse_duration(token)
+            elif duration == None and not namespaces:
+                namespaces.append(token)
+            else:
+                comment.append(token)
+        if duration == None:
+            await say(usage)
+            return
+        now = time.time()
+        try:
+            silence = Silence(now, now + duration, namespaces, tenants, envs, created_by=event.get('user', ''), comment=' '.join(comment))
+        except ValueError as e:
+            await say(f'{e}. {usage}')
+            return
+        self._silences.add(silence)
+        await say(f':mute: Silenced {silence.describe()}', thread_ts=event.get('thread_ts', None))
+
+    async def cmd_silences(self, event, text, say) -> None:
+        """Lists the active and upcoming silences."""
+        silences = self._silences.list() if self._silences != None else []
+        if not silences:
+            await say('There are no active or upcoming silences.')
+            return
+        await say(os.linesep.join(silence.describe() for silence in silences), thread_ts=event.get('thread_ts', None))
+
+    async def cmd_unsilence(self, event, text, say) -> None:
+        """Removes a silence by id, eg. 'unsilence 3'."""
+        (token, text) = self.next_token(text)
+        token = token.lstrip('#')
+        if not token.isdigit():
+            await say('Usage: unsilence <id>')
+            return
+        silence = self._silences.remove(int(token)) if self._silences != None else None
+        if silence == None:
+            await say(f'There is no silence #{token}.')
+            return
+        await say(f':loud_sound: Removed silence {silence.describe()}', thread_ts=event.get('thread_ts', None))
+
+    async def cmd_stats(self, event, text, say) -> None:
+        """Time in state, flaps and MTTR over the last week, for a namespace or the whole fleet."""
+        if self._consumer == None:
+            await say('No history has been recorded yet.')
+            return
+        history = self._consumer.history
+        (namespace, text) = self.next_token(text)
+        if namespace == '':
+            blocks = Builder.stats('Fleet stats for the last 7 days', history.fleet_stats(), history.top_flappers())
+        elif namespace in history:
+            blocks = Builder.stats(f'Stats for {namespace} for the last 7 days', history.stats(namespace))
+        else:
+            await say(f'No history recorded for {namespace}.')
+            return
+        await say(blocks[0].text.text, blocks, thread_ts=event.get('thread_ts', None))
+
     async def cmd_status(self, event, text, say) -> None:
         await self.cmd_health(event, text, say)
 
+    @property
+    def consumer(self) -> Optional['BMSConsumer']:
+        return self._consumer
+
+    @consumer.setter
+    def consumer(self, value: 'BMSConsumer') -> None:
+        """Attaching a BMSConsumer lets commands answer from its live cache."""
+        self._consumer = value
+
+    @property
+    def silences(self) -> Optional[Silences]:
+        return self._silences
+
+    @silences.setter
+    def silences(self, value: Silences) -> None:
+        """Attaching the Router's Silences enables the silence commands."""
+        self._silences = value
+
     def commands(self) -> List[str]:
         command_list = [func[len('cmd_'):] for func in dir(self) if callable(getattr(self, func)) and func.startswith('cmd_')]
         return command_list
 
-    async def fetch_namespace(self, namespace) -> HealthUpdate:
-        url = urljoin(self._sources[0], self.NAMESPACE_URI.format(namespace=namespace))
-        resp = requests.get(url, verify=False)
-        resp.raise_for_status()
-        return HealthUpdate(resp.json())
+    async def fetch_namespace(self, namespace, priority: bool=False) -> HealthUpdate:
+        async with self.admission.fetch(priority):
+            async with self.breaker.call():
+                return await self._fetcher.namespace(namespace)
 
-    async def fetch_all_namespaces(self) -> List[HealthUpdate]:
-        url = urljoin(self._sources[0], self.NAMESPACE_URI.format(namespace=''))
-        resp = requests.get(url, verify=False)
-        resp.raise_for_status()
-        objs = resp.json()
-        return [HealthUpdate(ns) for ns in objs]
+    async def iter_namespaces(self, conditional: bool=False) -> AsyncIterator[HealthUpdate]:
+        """Streams every namespace from bms-api, see NamespaceFetcher.namespaces."""
+        # Streaming the whole list is expected to be slow, only errors count
+        async with self.breaker.call(timed=False):
+            async for ns in self._fetcher.namespaces(conditional=conditional):
+                yield ns
 
-    async def handle_mention(self, event, say) -> None:
-        (cmd, text) = self.next_token(event['text'])
+    def revalidate(self) -> None:
+        """Refreshes the consumer cache in the background once the breaker
+        lets a probe through, see say_stale."""
+        if self._consumer == None or (self._revalidating != None and not self._revalidating.done()):
+            return
+        self._revalidating = asyncio.create_task(self._revalidate())
+
+    async def _revalidate(self) -> None:
+        while True:
+            await sleep(max(1.0, self.breaker.retry_at - time.monotonic()))
+            try:
+                await self._consumer.populate_cache()
+            except Exception as e:
+                logging.warning(f'{e}: background refresh from bms-api failed')
+            if self.breaker.state == CircuitBreaker.CLOSED:
+                return
+
+    async def _iter_namespaces_admitted(self) -> AsyncIterator[HealthUpdate]:
+        """iter_namespaces for commands, holding a fetch slot while streaming."""
+        async with self.admission.fetch():
+            async for ns in self.iter_namespaces():
+                yield ns
+
+    async def health_overview(self, tenant: Optional[str]=None) -> List[Block]:
+        """Builds the overview from the consumer's rollup when its cache is
+        warm and falls back to fetching every namespace from bms-api."""
+        title = 'Overall health' if tenant == None else f'Health of tenant {tenant}'
+        if self._consumer != None and self._consumer.warm:
+            return self._cached_overview(tenant, title)
+
+        counts: Dict[str, int] = defaultdict(int)
+        unhealthy: List[HealthUpdate] = []
+        async for ns in self._iter_namespaces_admitted():
+            if tenant != None and ns.tenant != tenant:
+                continue
+            counts[ns.healthy_str] += 1
+            if ns.healthy_str == 'Unhealthy':
+                unhealthy.append(ns)
+        return Builder.health_summary(counts, unhealthy, title)
+
+    def _cached_overview(self, tenant: Optional[str], title: str) -> List[Block]:
+        rollup = self._consumer.rollup
+        cache = self._consumer.cache
+        # The rollup keeps namespaces evicted from the cache, which have no details to show
+        unhealthy = [cache[name] for name in sorted(rollup.members('Unhealthy', tenant)) if name in cache]
+        return Builder.health_summary(rollup.counts(tenant), unhealthy, title)
+
+    def cached_health(self, text: str) -> Optional[List[Block]]:
+        """Answers a health command from the consumer cache alone, or returns None if it cannot."""
+        if self._consumer == None or not self._consumer.warm:
+            return None
+        tokens = text.split()
+        if len(tokens) > 1:
+            return None
+        token = tokens[0] if tokens else ''
+        if token == '':
+            return self._cached_overview(None, 'Overall health')
+        if token.startswith('tenant='):
+            tenant = token[len('tenant='):]
+            return self._cached_overview(tenant, f'Health of tenant {tenant}')
+        if '*' in token:
+            namespace_regex = re.compile(token.replace('*', '.*'))
+            blocks: List[Block] = []
+            for name in sorted(name for name in self._consumer.cache.keys() if namespace_regex.fullmatch(name)):
+                blocks.extend(Builder.health(self._consumer.cache[name]))
+            return blocks[:50] if blocks else None
+        hupdate = self._consumer.cache.get(token, None)
+        return Builder.health(hupdate, details=True, workloads=self._workloads(token)) if hupdate != None else None
+
+    def _workloads(self, namespace: str) -> Optional[List[HealthUpdate]]:
+        """The cached workloads of namespace, when subscribed to any."""
+        return self._consumer.workloads(namespace) if self._consumer != None else None
+
+    async def dispatch(self, cmd: str, event, text: str, say) -> None:
+        """Runs a command; those in FETCHING only if their user and channel
+        are within their rate limits."""
         try:
             method = getattr(self, f'cmd_{cmd}')
         except AttributeError:
             await say(f'{cmd}: Unknown command.')
             return
-        await method(event, text, say)
+        if cmd in self.FETCHING and not self.admission.allow(event.get('user', None), event.get('channel', None)):
+            await self.say_busy(cmd, event, text, say)
+            return
+        try:
+            await method(event, text, say)
+        except Busy:
+            await self.say_busy(cmd, event, text, say)
+        except BreakerOpen:
+            await self.say_stale(cmd, event, text, say)
+
+    async def say_busy(self, cmd: str, event, text: str, say) -> None:
+        """The fast reply to a command that was not admitted: cached data when there is some."""
+        await self._say_cached(cmd, event, text, say, ':hourglass: bmspy is busy', 'try again in a minute')
+
+    async def say_stale(self, cmd: str, event, text: str, say) -> None:
+        """The reply to a command while the bms-api breaker is open: cached
+        data at once, with the cache refreshed in the background."""
+        self.revalidate()
+        down = f':warning: bms-api has been unavailable for {duration_str(self.breaker.open_for)}'
+        await self._say_cached(cmd, event, text, say, down, 'try again later')
+
+    async def _say_cached(self, cmd: str, event, text: str, say, notice: str, otherwise: str) -> None:
+        blocks = self.cached_health(text) if cmd in self.FETCHING else None
+        if blocks == None:
+            await say(f'{notice}, {otherwise}.', thread_ts=event.get('thread_ts', None))
+            return
+        notice = f'{notice}, showing cached data.'
+        # Slack takes at most 50 blocks
+        blocks = [SectionBlock(text=MarkdownTextObject(text=notice))] + blocks[:49]
+        await say(notice, blocks, thread_ts=event.get('thread_ts', None))
+
+    async def handle_mention(self, event, say) -> None:
+        (cmd, text) = self.next_token(event['text'])
+        await self.dispatch(cmd, event, text, say)
 
     async def handle_message(self, context, event, say) -> None:
         # If they didn't come in on the regex, ignore
@@ -141,29 +453,45 @@ class SlackBot:
             return
 
         (cmd, text) = context.matches
-        try:
-            method = getattr(self, f'cmd_{cmd}')
-        except AttributeError:
-            await say(f'{cmd}: Unknown command.')
-            return
-        await method(event, text, say)
+        await self.dispatch(cmd, event, text, say)
 
-    async def say_health(self, namespace, say, payload=None) -> None:
+    async def say_health(self, namespace, say, payload=None, priority: bool=False) -> None:
         try:
-            result = await self.fetch_namespace(namespace)
-            blocks = Builder.health(result, details=True)
+            result = await self.fetch_namespace(namespace, priority=priority)
+            blocks = Builder.health(result, details=True, workloads=self._workloads(result.name))
             # Reply in thread if applicable
             if payload and payload.get('thread_ts', None):
                 await say(result.to_s(), blocks, thread_ts=payload['thread_ts'])
             else:
                 await say(result.to_s(), blocks)
+        except Busy:
+            raise
+        except BreakerOpen:
+            await self.say_stale('health', payload or {}, namespace, say)
         except Exception:
             await say(f'There was an error while fetching the health of {namespace}. Check logs for details.')
             #raise
 
-    async def send_message(self, channel: str, text: str, blocks: List[Type[Block]]=[]):
+    async def send_message(self, channel: str, text: str, blocks: Union[List[Type[Block]], List[dict]]=[]):
         await self._app.client.chat_postMessage(
+            channel=self._channel_id(channel),
+            text=text,
+            blocks=blocks,
+        )
+
+    async def post_message(self, channel: str, text: str, blocks: Union[List[Type[Block]], List[dict]]=[]) -> Tuple[str, str]:
+        """send_message, returning the (channel id, ts) that update_message needs."""
+        response = await self._app.client.chat_postMessage(
+            channel=self._channel_id(channel),
+            text=text,
+            blocks=blocks,
+        )
+        return (response['channel'], response['ts'])
+
+    async def update_message(self, channel: str, ts: str, text: str, blocks: Union[List[Type[Block]], List[dict]]=[]):
+        await self._app.client.chat_update(
             channel=channel,
+            ts=ts,
             text=text,
             blocks=blocks,
         )
@@ -176,3 +504,11 @@ class SlackBot:
         if token.startswith('<') or token in ['of']:
             return self.next_token(text)
         return (token, text)
+
+def _upstream_failure(e: BaseException) -> bool:
+    """Whether e means bms-api is in trouble, as opposed to eg. an unknown namespace."""
+    if isinstance(e, (Busy, NotModified)):
+        return False
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status >= 500 or e.status == 429
+    return True
@@ -0,0 +1,97 @@
+# StdLib
+import asyncio
+import logging
+import signal
+from typing import Awaitable, Callable, Dict, List
+
+class Supervisor:
+    """Runs long-lived components, restarting them with backoff when they
+    crash or return, until SIGTERM/SIGINT (or stop()) is received.
+
+    On shutdown the components are cancelled first, so no new work comes in,
+    then every drain callback is awaited with whatever is left of
+    drain_timeout."""
+    def __init__(self, wait: int=1, max_wait: int=60, drain_timeout: float=10.0) -> None:
+        if wait > max_wait:
+            raise ValueError(f'wait "{ wait }" cannot be greater than max_wait "{ max_wait }"')
+
+        self._wait = wait
+        self._max_wait = max_wait
+        self._drain_timeout = drain_timeout
+        self._components: Dict[str, Callable[[], Awaitable]] = {}
+        self._drains: List[Callable[[float], Awaitable]] = []
+        self._stopping: asyncio.Event = None
+
+        self.restarts: Dict[str, int] = {}
+
+    def add(self, name: str, factory: Callable[[], Awaitable]) -> None:
+        """factory is called to (re)start the component, eg. slackbot.start."""
+        if name in self._components:
+            raise ValueError(f'component "{ name }" already added')
+        self._components[name] = factory
+        self.restarts[name] = 0
+
+    def add_drain(self, drain: Callable[[float], Awaitable]) -> None:
+        """drain is awaited on shutdown with the number of seconds it may take."""
+        self._drains.append(drain)
+
+    def stop(self) -> None:
+        if self._stopping != None:
+            self._stopping.set()
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        for sig in [signal.SIGTERM, signal.SIGINT]:
+            try:
+                loop.add_signal_handler(sig, self._signalled, sig)
+            except (NotImplementedError, RuntimeError):
+                # Not on the main thread, or not supported by the platform
+                pass
+
+        tasks = [asyncio.create_task(self._supervise(name, factory)) for (name, factory) in self._components.items()]
+        try:
+            await self._stopping.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self._drain(loop)
+            for sig in [signal.SIGTERM, signal.SIGINT]:
+                try:
+                    loop.remove_signal_handler(sig)
+                except (NotImplementedError, RuntimeError):
+                    pass
+
+    def _signalled(self, sig: signal.Signals) -> None:
+        logging.info(f'Received {sig.name}, shutting down...')
+        self.stop()
+
+    async def _drain(self, loop: asyncio.AbstractEventLoop) -> None:
+        deadline = loop.time() + self._drain_timeout
+        for drain in self._drains:
+            try:
+                await asyncio.wait_for(drain(max(0.0, deadline - loop.time())), timeout=max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                logging.warning('drain deadline reached before shutdown finished')
+            except Exception:
+                logging.exception('error while draining')
+
+    async def _supervise(self, name: str, factory: Callable[[], Awaitable]) -> None:
+        loop = asyncio.get_running_loop()
+        wait = self._wait
+        while True:
+            started = loop.time()
+            try:
+                await factory()
+                logging.error(f'{name} exited, restarting in {wait} seconds')
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception(f'{name} crashed, restarting in {wait} seconds')
+            self.restarts[name] += 1
+            # A component that ran for a while before failing starts over with a short wait
+            if loop.time() - started > self._max_wait:
+                wait = self._wait
+            await asyncio.sleep(wait)
+            wait = min(wait * 2, self._max_wait)
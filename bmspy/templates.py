@@ -0,0 +1,164 @@
+# StdLib
+from string import Formatter
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Internal deps
+from .builder import Builder
+from .health_update import HealthUpdate
+from .utils import alerts_markdown, errors_markdown, warnings_markdown
+
+FIELDS = [
+    'icon', 'kind', 'name', 'namespace', 'path', 'state', 'previous_state', 'tenant', 'env',
+    'errors', 'warnings', 'alerts', 'error_count', 'warning_count', 'alert_count',
+]
+BLOCK_TYPES = ['header', 'section', 'context', 'divider']
+# Slack's limits on text per block type and per message
+TEXT_LIMITS = {'header': 150, 'section': 3000, 'context': 3000, 'text': 4000}
+MAX_BLOCKS = 50
+
+def template_values(hupdate: HealthUpdate) -> Dict[str, str]:
+    """The values a template can refer to for hupdate."""
+    return {
+        'icon': Builder.ICONS.get(hupdate.healthy_str, ':interrobang:'),
+        'kind': hupdate.kind,
+        'name': hupdate.name,
+        'namespace': hupdate.namespace,
+        'path': hupdate.path,
+        'state': hupdate.healthy_str,
+        'previous_state': hupdate.previous_healthy_str,
+        'tenant': hupdate.tenant or '',
+        'env': hupdate.env or '',
+        'errors': errors_markdown(hupdate.errors),
+        'warnings': warnings_markdown(hupdate.warnings),
+        'alerts': alerts_markdown(hupdate.alerts),
+        'error_count': str(len(hupdate.errors)),
+        'warning_count': str(len(hupdate.warnings)),
+        'alert_count': str(len(hupdate.alerts)),
+    }
+
+def _compile_text(fmt: str, limit: int, where: str) -> Callable[[Dict[str, str]], str]:
+    """Checks that fmt only uses known {field}s and that its literal text
+    fits in limit, and returns a function rendering it truncated to limit."""
+    if not isinstance(fmt, str):
+        raise ValueError(f'{where}: text must be a string')
+    literal = 0
+    try:
+        parsed = list(Formatter().parse(fmt))
+    except ValueError as e:
+        raise ValueError(f'{where}: {e}') from e
+    for (text, field, spec, conversion) in parsed:
+        literal += len(text)
+        if field == None:
+            continue
+        if field not in FIELDS:
+            raise ValueError(f'{where}: unknown field "{{{field}}}", use one of {", ".join(FIELDS)}')
+        if spec or conversion:
+            raise ValueError(f'{where}: format specs and conversions are not supported in "{{{field}}}"')
+    if literal > limit:
+        raise ValueError(f'{where}: {literal} characters of fixed text is over the Slack limit of {limit}')
+
+    def render(values: Dict[str, str]) -> str:
+        text = fmt.format_map(values)
+        if len(text) > limit:
+            text = text[:limit - 1] + '…'
+        return text
+    return render
+
+def _compile_block(spec: dict, where: str) -> Callable[[Dict[str, str]], Optional[dict]]:
+    if not isinstance(spec, dict):
+        raise ValueError(f'{where}: a block must be a mapping')
+    unknown = set(spec.keys()) - {'type', 'text', 'when'}
+    if unknown:
+        raise ValueError(f'{where}: unknown keys {", ".join(sorted(unknown))}')
+    block_type = spec.get('type', None)
+    if block_type not in BLOCK_TYPES:
+        raise ValueError(f'{where}: type must be one of {", ".join(BLOCK_TYPES)}')
+    when = spec.get('when', None)
+    if when != None and when not in FIELDS:
+        raise ValueError(f'{where}: when must be one of {", ".join(FIELDS)}')
+
+    if block_type == 'divider':
+        if 'text' in spec:
+            raise ValueError(f'{where}: a divider has no text')
+        return lambda values: {'type': 'divider'} if when == None or values[when] else None
+    if 'text' not in spec:
+        raise ValueError(f'{where}: a {block_type} needs text')
+    text = _compile_text(spec['text'], TEXT_LIMITS[block_type], where)
+
+    if block_type == 'header':
+        def build(text: str) -> dict:
+            return {'type': 'header', 'text': {'type': 'plain_text', 'text': text, 'emoji': True}}
+    elif block_type == 'section':
+        def build(text: str) -> dict:
+            return {'type': 'section', 'text': {'type': 'mrkdwn', 'text': text}}
+    else:
+        def build(text: str) -> dict:
+            return {'type': 'context', 'elements': [{'type': 'mrkdwn', 'text': text}]}
+
+    def render(values: Dict[str, str]) -> Optional[dict]:
+        if when != None and not values[when]:
+            return None
+        rendered = text(values)
+        # Slack rejects blocks with empty text
+        return build(rendered) if rendered.strip() else None
+    return render
+
+class Template:
+    """A message format from the 'templates' key of the config file,
+    compiled once into functions that render Block Kit dicts.
+
+    Everything that can be checked without a HealthUpdate (field names,
+    block types, fixed text against Slack's limits) is checked here, and
+    rendered text is truncated to the limits, so a template that loads
+    cannot produce a message Slack rejects. An example:
+    templates:
+      compact:
+        text: '{icon} {path}: {previous_state} -> {state}'
+        blocks:
+          - type: header
+            text: '{icon} {path} is {state}'
+          - type: section
+            text: '{errors}'
+            when: errors
+          - type: context
+            text: 'tenant {tenant}, env {env}'
+
+    when skips a block unless that field is non-empty. Fields are
+    icon, kind, name, namespace, path, state, previous_state, tenant, env,
+    errors, warnings and alerts (as markdown lists) and their *_count."""
+    def __init__(self, name: str, spec: dict) -> None:
+        where = f'template {name}'
+        if not isinstance(spec, dict):
+            raise ValueError(f'{where}: must be a mapping with text and blocks')
+        unknown = set(spec.keys()) - {'text', 'blocks'}
+        if unknown:
+            raise ValueError(f'{where}: unknown keys {", ".join(sorted(unknown))}')
+        if 'text' not in spec:
+            raise ValueError(f'{where}: text is required, it is the notification and fallback text')
+        blocks = spec.get('blocks', None) or []
+        if not isinstance(blocks, list):
+            raise ValueError(f'{where}: blocks must be a list')
+        if len(blocks) > MAX_BLOCKS:
+            raise ValueError(f'{where}: {len(blocks)} blocks is over the Slack limit of {MAX_BLOCKS}')
+
+        self.name = name
+        self._text = _compile_text(spec['text'], TEXT_LIMITS['text'], f'{where} text')
+        self._blocks = [_compile_block(block, f'{where} block {i + 1}') for (i, block) in enumerate(blocks)]
+
+    def render(self, hupdate: HealthUpdate) -> Tuple[str, List[dict]]:
+        """The text and blocks of the message for hupdate."""
+        values = template_values(hupdate)
+        blocks = []
+        for render in self._blocks:
+            block = render(values)
+            if block != None:
+                blocks.append(block)
+        return (self._text(values), blocks)
+
+def compile_templates(specs: Optional[Dict[str, dict]]) -> Dict[str, Template]:
+    """Compiles the 'templates' key of the config file, raising ValueError on the first invalid template."""
+    if not specs:
+        return {}
+    if not isinstance(specs, dict):
+        raise ValueError('templates must be a mapping of names to templates')
+    return {name: Template(name, spec) for (name, spec) in specs.items()}
@@ -1,4 +1,5 @@
 from typing import Any, List
+from urllib.parse import urljoin, urlparse
 
 ALERT_PREFIX=':question:'
 ERROR_PREFIX=':small_red_triangle:'
@@ -18,8 +19,27 @@ def lines_markdown(items: List[str], prefix: str=''):
 def alerts_markdown(alerts: List[str]):
     return lines_markdown(alerts, prefix=ALERT_PREFIX)
 
+def duration_str(seconds: float) -> str:
+    """Renders seconds as the two most significant units, eg. '2d 3h' or '4m 5s'."""
+    seconds = int(seconds)
+    parts = []
+    for (unit, size) in [('d', 86400), ('h', 3600), ('m', 60), ('s', 1)]:
+        if seconds >= size or (unit == 's' and not parts):
+            parts.append(f'{seconds // size}{unit}')
+            seconds = seconds % size
+    return ' '.join(parts[:2])
+
 def errors_markdown(errors: List[str]):
     return lines_markdown(errors, prefix=ERROR_PREFIX)
 
 def warnings_markdown(warnings: List[str]):
-    return lines_markdown(warnings, prefix=WARNING_PREFIX)
\ No newline at end of file
+    return lines_markdown(warnings, prefix=WARNING_PREFIX)
+
+def ws_url(source: str, path: str='/ws/ns') -> str:
+    """Translates a bms-api http(s) url into the websocket url for path."""
+    parse_result = urlparse(source)
+    if parse_result.scheme == 'https':
+        parse_result = parse_result._replace(scheme='wss')
+    else:
+        parse_result = parse_result._replace(scheme='ws')
+    return urljoin(parse_result.geturl(), path)
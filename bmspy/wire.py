@@ -0,0 +1,102 @@
+# StdLib
+from collections import deque
+import time
+from typing import Callable, Deque, Optional, Tuple
+import websockets
+from websockets.extensions.permessage_deflate import ClientPerMessageDeflateFactory
+
+def connect_options(compression: bool=True, window_bits: Optional[int]=None, mem_level: int=8, client_window_bits: Optional[int]=None) -> dict:
+    """Keyword arguments for websockets.connect negotiating permessage-deflate.
+
+    window_bits (9-15) caps the window the server compresses with, which is
+    what bounds our decompression memory and ratio for the BMS stream.
+    client_window_bits and mem_level tune our own (outbound) compressor."""
+    if not compression:
+        return {'compression': None}
+    if mem_level < 1 or mem_level > 9:
+        raise ValueError('mem_level must be between 1 and 9')
+    for bits in [window_bits, client_window_bits]:
+        if bits != None and (bits < 9 or bits > 15):
+            raise ValueError('window bits must be between 9 and 15')
+    extension = ClientPerMessageDeflateFactory(
+        server_max_window_bits=window_bits,
+        client_max_window_bits=client_window_bits if client_window_bits != None else True,
+        compress_settings={'memLevel': mem_level},
+    )
+    return {'compression': None, 'extensions': [extension]}
+
+class WireStats:
+    """Bytes and frames received on one websocket source: wire bytes as read
+    from the socket (compressed, framing included) and payload bytes after
+    decompression.
+
+    Rates are over the last window seconds, from samples of the totals kept
+    at most once a second, so every reader of snapshot() sees the same rates
+    however often it polls."""
+    def __init__(self, window: float=60.0) -> None:
+        self.wire_bytes = 0
+        self.payload_bytes = 0
+        self.frames = 0
+        self._window = window
+        self._started = time.monotonic()
+        # (time, frames, wire bytes, payload bytes), oldest first
+        self._samples: Deque[Tuple[float, int, int, int]] = deque([(self._started, 0, 0, 0)])
+
+    def add_wire(self, count: int) -> None:
+        self.wire_bytes += count
+
+    def add_message(self, message) -> None:
+        self.frames += 1
+        if isinstance(message, str):
+            self.payload_bytes += len(message) if message.isascii() else len(message.encode('utf-8'))
+        else:
+            self.payload_bytes += len(message)
+
+    @property
+    def ratio(self) -> float:
+        """payload bytes per wire byte."""
+        if self.wire_bytes == 0:
+            return 0.0
+        return self.payload_bytes / self.wire_bytes
+
+    def _sample(self, now: float) -> Tuple[float, int, int, int]:
+        """The totals now, and the sample the window starts at."""
+        current = (now, self.frames, self.wire_bytes, self.payload_bytes)
+        if now - self._samples[-1][0] >= 1.0:
+            self._samples.append(current)
+        # Keep the newest sample at or before the start of the window as the base
+        while len(self._samples) > 1 and self._samples[1][0] <= now - self._window:
+            self._samples.popleft()
+        return self._samples[0]
+
+    def snapshot(self, now: Optional[float]=None) -> dict:
+        """Totals, plus rates over the last window seconds."""
+        now = time.monotonic() if now == None else now
+        (since, frames, wire_bytes, payload_bytes) = self._sample(now)
+        elapsed = max(now - since, 1e-9)
+        return {
+            'frames': self.frames,
+            'wire_bytes': self.wire_bytes,
+            'payload_bytes': self.payload_bytes,
+            'ratio': round(self.ratio, 3),
+            'rate_window': round(now - since, 1),
+            'frames_per_second': round((self.frames - frames) / elapsed, 3),
+            'wire_bytes_per_second': round((self.wire_bytes - wire_bytes) / elapsed, 3),
+            'payload_bytes_per_second': round((self.payload_bytes - payload_bytes) / elapsed, 3),
+        }
+
+    def protocol_factory(self) -> Callable[..., websockets.WebSocketClientProtocol]:
+        """A create_protocol for websockets.connect that accounts into self."""
+        stats = self
+
+        class _Protocol(websockets.WebSocketClientProtocol):
+            def data_received(self, data: bytes) -> None:
+                stats.add_wire(len(data))
+                super().data_received(data)
+
+            async def recv(self):
+                message = await super().recv()
+                stats.add_message(message)
+                return message
+
+        return _Protocol
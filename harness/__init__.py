@@ -0,0 +1,5 @@
+"""End-to-end load-test harness: a synthetic fleet served by a fake BMS and
+a rate-limited fake Slack Web API, with the real bmspy.py run against both.
+
+    python -m harness.run --help
+"""
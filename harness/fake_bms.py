@@ -0,0 +1,84 @@
+# StdLib
+import asyncio
+import hashlib
+import json
+import time
+from typing import Dict, List, Set, Tuple
+
+# Internal deps
+from bmspy import HealthUpdate
+from harness.fleet import Fleet
+
+# External deps
+from aiohttp import web, WSMsgType
+
+class FakeBMS:
+    """Serves a Fleet the way bms-api does: /ns/, /ns/{name} and the /ws/ns
+    websocket. The time every state transition is sent is kept so that the
+    notification latency can be measured on the Slack side."""
+    def __init__(self, fleet: Fleet) -> None:
+        self._fleet = fleet
+        self._clients: Set[web.WebSocketResponse] = set()
+        self._sent_state: Dict[str, str] = {frame['name']: frame['healthy'] for frame in fleet.snapshot()}
+
+        self.connected = asyncio.Event()
+        self.frames = 0
+        self.list_requests = 0
+        self.not_modified = 0
+        # (name, healthy_str) -> times the transition was sent
+        self.transitions: Dict[Tuple[str, str], List[float]] = {}
+        self.transition_count = 0
+
+        self.app = web.Application()
+        self.app.router.add_get('/ns/', self.handle_list)
+        self.app.router.add_get('/ns/{name}', self.handle_get)
+        self.app.router.add_get('/ws/ns', self.handle_ws)
+
+    async def handle_list(self, request: web.Request) -> web.Response:
+        self.list_requests += 1
+        body = json.dumps(self._fleet.snapshot())
+        etag = f'"{hashlib.blake2b(body.encode("utf-8"), digest_size=8).hexdigest()}"'
+        if request.headers.get('If-None-Match', None) == etag:
+            self.not_modified += 1
+            return web.Response(status=304, headers={'ETag': etag})
+        resp = web.Response(text=body, content_type='application/json', headers={'ETag': etag})
+        resp.enable_compression()
+        return resp
+
+    async def handle_get(self, request: web.Request) -> web.Response:
+        frame = self._fleet.get(request.match_info['name'])
+        if frame == None:
+            raise web.HTTPNotFound()
+        return web.json_response(frame)
+
+    async def handle_ws(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(compress=True)
+        await ws.prepare(request)
+        self._clients.add(ws)
+        self.connected.set()
+        try:
+            async for msg in ws:
+                if msg.type == WSMsgType.ERROR:
+                    break
+        finally:
+            self._clients.discard(ws)
+        return ws
+
+    async def broadcast(self, frames: List[dict]) -> None:
+        now = time.monotonic()
+        for frame in frames:
+            if self._sent_state.get(frame['name'], None) != frame['healthy']:
+                self._sent_state[frame['name']] = frame['healthy']
+                self.transitions.setdefault((frame['name'], HealthUpdate.healthy_to_str(frame['healthy'])), []).append(now)
+                self.transition_count += 1
+            data = json.dumps(frame)
+            for ws in list(self._clients):
+                try:
+                    await ws.send_str(data)
+                except ConnectionError:
+                    self._clients.discard(ws)
+            self.frames += 1
+
+    @property
+    def clients(self) -> int:
+        return len(self._clients)
@@ -0,0 +1,96 @@
+# StdLib
+import json
+import re
+import time
+from typing import Dict, List, Tuple
+
+# External deps
+from aiohttp import web
+
+TRANSITION_RE = re.compile(r'\] (\S+) transitioned state: \S+ -> (\S+)$')
+
+class _Bucket:
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+class FakeSlack:
+    """Just enough of the Slack Web API and Socket Mode for bmspy to run.
+
+    chat.postMessage is rate limited like Slack does it: channel_rate messages
+    per second per channel (with some burst) and workspace_rate overall.
+    Over the limit it answers 429 with a Retry-After header."""
+    def __init__(self, channel_rate: float=1.0, channel_burst: int=5, workspace_rate: float=50.0, channels: List[str]=[]) -> None:
+        self._channel_rate = channel_rate
+        self._channel_burst = channel_burst
+        self._workspace = _Bucket(workspace_rate, int(workspace_rate))
+        self._channels: Dict[str, _Bucket] = {}
+        self._channel_names = list(channels)
+
+        self.messages: List[dict] = []
+        self.rate_limited = 0
+        # (name, healthy_str, time) of every transition notification accepted
+        self.transitions: List[Tuple[str, str, float]] = []
+
+        self.app = web.Application()
+        self.app.router.add_post('/api/{method}', self.handle_api)
+        self.app.router.add_get('/api/{method}', self.handle_api)
+        self.app.router.add_get('/socket', self.handle_socket)
+
+    async def _params(self, request: web.Request) -> dict:
+        if request.method == 'GET':
+            return dict(request.query)
+        if request.content_type == 'application/json':
+            return await request.json()
+        return dict(await request.post())
+
+    async def handle_api(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        params = await self._params(request)
+        if method == 'auth.test':
+            return web.json_response({'ok': True, 'url': 'https://harness.slack.com/', 'team': 'harness', 'user': 'bmspy', 'team_id': 'T0', 'user_id': 'U0', 'bot_id': 'B0'})
+        if method == 'apps.connections.open':
+            return web.json_response({'ok': True, 'url': f'ws://{request.host}/socket'})
+        if method == 'conversations.list':
+            channels = [{'id': f'C{i:08d}', 'name': name, 'is_member': True, 'is_archived': False} for (i, name) in enumerate(self._channel_names)]
+            return web.json_response({'ok': True, 'channels': channels, 'response_metadata': {'next_cursor': ''}})
+        if method in ['chat.postMessage', 'chat.update']:
+            return self._post(method, params)
+        return web.json_response({'ok': False, 'error': 'unknown_method'}, status=404)
+
+    def _post(self, method: str, params: dict) -> web.Response:
+        channel = params.get('channel', '')
+        bucket = self._channels.get(channel, None)
+        if bucket == None:
+            bucket = self._channels[channel] = _Bucket(self._channel_rate, self._channel_burst)
+        if not bucket.take() or not self._workspace.take():
+            self.rate_limited += 1
+            return web.json_response({'ok': False, 'error': 'ratelimited'}, status=429, headers={'Retry-After': '1'})
+
+        now = time.monotonic()
+        text = params.get('text', '')
+        self.messages.append({'method': method, 'channel': channel, 'text': text, 'time': now})
+        match = TRANSITION_RE.search(text)
+        if match:
+            self.transitions.append((match.group(1), match.group(2), now))
+        ts = f'{now:.6f}'
+        return web.json_response({'ok': True, 'channel': channel, 'ts': params.get('ts', ts), 'message': {'text': text, 'ts': ts}})
+
+    async def handle_socket(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(autoping=True)
+        await ws.prepare(request)
+        await ws.send_str(json.dumps({'type': 'hello', 'num_connections': 1, 'debug_info': {'host': 'harness'}}))
+        async for msg in ws:
+            pass
+        return ws
@@ -0,0 +1,103 @@
+# StdLib
+import random
+from typing import Dict, List, Optional
+
+class Fleet:
+    """A synthetic fleet of namespaces producing BMS health updates.
+
+    Namespaces are spread over tenants with a zipf-like skew (tenant 0 is the
+    biggest). Every tick, on average namespaces * flap_rate * dt namespaces
+    change state and namespaces * refresh_rate * dt are refreshed unchanged.
+    Every storm_every seconds, storm_size of the namespaces of one tenant go
+    Unhealthy together with a shared error and recover storm_duration later."""
+    STATES = ['True', 'Warn', 'Alert', 'False']
+
+    def __init__(self, namespaces: int=1000, tenants: int=20, skew: float=1.0, flap_rate: float=0.001, refresh_rate: float=0.01,
+                 storm_every: float=0.0, storm_size: float=0.5, storm_duration: float=10.0, seed: int=0) -> None:
+        self._rng = random.Random(seed)
+        self._flap_rate = flap_rate
+        self._refresh_rate = refresh_rate
+        self._storm_every = storm_every
+        self._storm_size = storm_size
+        self._storm_duration = storm_duration
+
+        weights = [1 / (i + 1) ** skew for i in range(tenants)]
+        envs = ['dev', 'stage', 'prod']
+        self._names: List[str] = []
+        self._by_tenant: Dict[str, List[str]] = {}
+        self._state: Dict[str, dict] = {}
+        for (i, tenant) in enumerate(self._rng.choices([f'tenant-{t}' for t in range(tenants)], weights=weights, k=namespaces)):
+            name = f'{tenant}-ns-{i}'
+            self._names.append(name)
+            self._by_tenant.setdefault(tenant, []).append(name)
+            self._state[name] = self._frame(name, tenant, envs[i % len(envs)], 'True')
+
+        self._clock = 0.0
+        self._next_storm = storm_every if storm_every > 0 else None
+        self._storm_members: List[str] = []
+        self._storm_ends: Optional[float] = None
+
+    def _frame(self, name: str, tenant: str, env: str, healthy: str, errors: Optional[List[str]]=None) -> dict:
+        return {
+            'kind': 'Namespace',
+            'name': name,
+            'namespace': '',
+            'action': 'refresh',
+            'healthy': healthy,
+            'tenant': {'name': tenant, 'env': env},
+            'errors': errors if errors != None else ([f'Deployment {name}/app has 0/1 ready replicas'] if healthy == 'False' else []),
+            'warnings': ['Pod restarted 5 times in the last hour'] if healthy == 'Warn' else [],
+            'alerts': ['Certificate expires in 7 days'] if healthy == 'Alert' else [],
+        }
+
+    def _set(self, name: str, healthy: str, errors: Optional[List[str]]=None) -> dict:
+        current = self._state[name]
+        frame = self._frame(name, current['tenant']['name'], current['tenant']['env'], healthy, errors)
+        self._state[name] = frame
+        return frame
+
+    def _count(self, rate: float, dt: float) -> int:
+        expected = len(self._names) * rate * dt
+        count = int(expected)
+        if self._rng.random() < expected - count:
+            count += 1
+        return count
+
+    def snapshot(self) -> List[dict]:
+        """Current state of every namespace, as served by /ns/."""
+        return list(self._state.values())
+
+    def get(self, name: str) -> Optional[dict]:
+        return self._state.get(name, None)
+
+    def tick(self, dt: float) -> List[dict]:
+        """Advances the fleet by dt seconds and returns the frames to send."""
+        self._clock += dt
+        frames: List[dict] = []
+
+        if self._storm_ends != None and self._clock >= self._storm_ends:
+            frames.extend(self._set(name, 'True') for name in self._storm_members)
+            self._storm_members = []
+            self._storm_ends = None
+        if self._next_storm != None and self._clock >= self._next_storm:
+            self._next_storm += self._storm_every
+            if self._storm_ends == None:
+                tenant = self._rng.choice(list(self._by_tenant.keys()))
+                members = self._by_tenant[tenant]
+                self._storm_members = self._rng.sample(members, max(1, int(len(members) * self._storm_size)))
+                self._storm_ends = self._clock + self._storm_duration
+                error = f'Dependency {tenant}-db is unreachable'
+                frames.extend(self._set(name, 'False', [error]) for name in self._storm_members)
+
+        for _ in range(self._count(self._flap_rate, dt)):
+            name = self._rng.choice(self._names)
+            if name in self._storm_members:
+                continue
+            current = self._state[name]['healthy']
+            frames.append(self._set(name, self._rng.choice([s for s in self.STATES if s != current])))
+        for _ in range(self._count(self._refresh_rate, dt)):
+            frames.append(self._state[self._rng.choice(self._names)])
+        return frames
+
+    def __len__(self) -> int:
+        return len(self._names)
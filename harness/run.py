@@ -0,0 +1,156 @@
+"""Runs the real bmspy.py against a fake BMS and a fake Slack and reports
+throughput, notification latency, memory and dropped notifications.
+
+    python -m harness.run --namespaces 5000 --flap-rate 0.002 --duration 60 --storm-every 20
+"""
+# StdLib
+import argparse
+import asyncio
+from bisect import bisect_right
+import math
+import os
+import signal
+import socket
+import sys
+import time
+from typing import List, Optional
+
+# Internal deps
+from harness.fake_bms import FakeBMS
+from harness.fake_slack import FakeSlack
+from harness.fleet import Fleet
+
+# External deps
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[max(0, math.ceil(p * len(values)) - 1)]
+
+def rss_kb(pid: int) -> Optional[int]:
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+async def serve(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    return runner
+
+def latencies(bms: FakeBMS, slack: FakeSlack) -> List[float]:
+    """Matches every notification to the latest matching transition sent
+    before it. Each transition is matched at most once."""
+    matched = set()
+    result: List[float] = []
+    for (name, state, arrived) in slack.transitions:
+        sent = bms.transitions.get((name, state), [])
+        index = bisect_right(sent, arrived) - 1
+        if index >= 0 and (name, state, index) not in matched:
+            matched.add((name, state, index))
+            result.append(arrived - sent[index])
+    return result
+
+async def main(args: argparse.Namespace) -> int:
+    fleet = Fleet(args.namespaces, args.tenants, args.skew, args.flap_rate, args.refresh_rate, args.storm_every, args.storm_size, args.storm_duration, args.seed)
+    bms = FakeBMS(fleet)
+    slack = FakeSlack(args.slack_channel_rate, args.slack_channel_burst, args.slack_workspace_rate, channels=[args.channel])
+    bms_port = free_port()
+    slack_port = free_port()
+    runners = [await serve(bms.app, bms_port), await serve(slack.app, slack_port)]
+
+    env = dict(os.environ)
+    env.update({
+        'SLACK_BOT_TOKEN': 'xoxb-harness',
+        'SLACK_APP_TOKEN': 'xapp-harness',
+        'SLACK_API_URL': f'http://127.0.0.1:{slack_port}/api/',
+    })
+    command = [sys.executable, os.path.join(ROOT, 'bmspy.py'), '-c', args.config, '-a', args.channel, '-s', f'http://127.0.0.1:{bms_port}'] + args.bmspy_args
+    log = open(args.log, 'w')
+    proc = await asyncio.create_subprocess_exec(*command, env=env, cwd=ROOT, stdout=log, stderr=log)
+    print(f'fleet: {len(fleet)} namespaces; bmspy pid {proc.pid}, log in {args.log}')
+
+    rss: List[int] = []
+    try:
+        await asyncio.wait_for(bms.connected.wait(), timeout=args.startup_timeout)
+        # Give populate_cache time to finish before transitions start
+        await asyncio.sleep(1.0)
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        next_tick = started
+        next_sample = started
+        while loop.time() - started < args.duration:
+            await bms.broadcast(fleet.tick(args.tick))
+            if loop.time() >= next_sample:
+                sample = rss_kb(proc.pid)
+                if sample != None:
+                    rss.append(sample)
+                next_sample += 1.0
+            next_tick += args.tick
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+        elapsed = loop.time() - started
+
+        await asyncio.sleep(args.grace)
+        stopping = time.monotonic()
+        proc.send_signal(signal.SIGTERM)
+        await asyncio.wait_for(proc.wait(), timeout=30)
+        shutdown = time.monotonic() - stopping
+    finally:
+        if proc.returncode == None:
+            proc.kill()
+            await proc.wait()
+        log.close()
+        for runner in runners:
+            await runner.cleanup()
+
+    lat = latencies(bms, slack)
+    dropped = bms.transition_count - len(lat)
+    print(f'frames sent:       {bms.frames} ({bms.frames / elapsed:.1f}/s over {elapsed:.1f}s)')
+    print(f'namespace lists:   {bms.list_requests} ({bms.not_modified} not modified)')
+    print(f'transitions:       {bms.transition_count}')
+    print(f'notifications:     {len(slack.messages)} accepted, {slack.rate_limited} rate limited (429)')
+    print(f'dropped:           {dropped} ({100 * dropped / max(1, bms.transition_count):.1f}% of transitions never notified)')
+    print(f'latency (s):       p50 {percentile(lat, 0.5):.3f}  p90 {percentile(lat, 0.9):.3f}  p99 {percentile(lat, 0.99):.3f}  max {max(lat) if lat else float("nan"):.3f}')
+    if rss:
+        print(f'bmspy RSS (MB):    start {rss[0] / 1024:.1f}  max {max(rss) / 1024:.1f}  end {rss[-1] / 1024:.1f}')
+    print(f'bmspy shutdown:    exit {proc.returncode} after {shutdown:.2f}s')
+    return 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--namespaces', type=int, default=1000)
+    parser.add_argument('--tenants', type=int, default=20)
+    parser.add_argument('--skew', type=float, default=1.0, help='zipf exponent of the tenant size distribution')
+    parser.add_argument('--flap-rate', type=float, default=0.001, help='state changes per namespace per second')
+    parser.add_argument('--refresh-rate', type=float, default=0.01, help='unchanged refreshes per namespace per second')
+    parser.add_argument('--storm-every', type=float, default=0.0, help='seconds between burst storms, 0 for none')
+    parser.add_argument('--storm-size', type=float, default=0.5, help='fraction of a tenant failing in a storm')
+    parser.add_argument('--storm-duration', type=float, default=10.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds of traffic')
+    parser.add_argument('--tick', type=float, default=0.1)
+    parser.add_argument('--grace', type=float, default=5.0, help='seconds to wait for notifications after traffic stops')
+    parser.add_argument('--startup-timeout', type=float, default=30.0)
+    parser.add_argument('--slack-channel-rate', type=float, default=1.0, help='chat.postMessage per second per channel')
+    parser.add_argument('--slack-channel-burst', type=int, default=5)
+    parser.add_argument('--slack-workspace-rate', type=float, default=50.0)
+    parser.add_argument('--channel', default='loadtest', help='alert channel bmspy sends everything to')
+    parser.add_argument('--config', default=os.devnull, help='settings.yaml for bmspy')
+    parser.add_argument('--log', default='harness.log', help='where bmspy output goes')
+    parser.add_argument('bmspy_args', nargs='*', help='extra arguments for bmspy.py, after --')
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -27,6 +27,13 @@ class SlackBot(_SlackBot):
     async def send_message(self, channel: str, text: str, blocks: List[Type[Block]] = ...):
         self._messages.append({'channel': channel, 'text': text, 'blocks': blocks})
 
+    async def post_message(self, channel: str, text: str, blocks: List[Type[Block]] = ...):
+        await self.send_message(channel, text, blocks)
+        return (channel, str(len(self._messages)))
+
+    async def update_message(self, channel: str, ts: str, text: str, blocks: List[Type[Block]] = ...):
+        self._messages[int(ts) - 1] = {'channel': channel, 'text': text, 'blocks': blocks, 'updated': True}
+
 @pytest.fixture
 def slackbot():
     return SlackBot()
@@ -149,3 +156,12 @@ def tenant2_dev_ns(base_hupdate_dict):
     subj['healthy'] = 'True'
     subj['tenant'] = {'name': 'tenant2', 'env': 'dev'}
     return HealthUpdate(subj)
+
+@pytest.fixture
+def deployment_hupdate_dict(base_hupdate_dict):
+    subj = copy.deepcopy(base_hupdate_dict)
+    subj['kind'] = 'Deployment'
+    subj['name'] = 'app'
+    subj['namespace'] = 'tenant1-prod'
+    subj['healthy'] = 'True'
+    return subj
@@ -0,0 +1,105 @@
+import asyncio
+import pytest
+
+from bmspy import Admission, BMSConsumer, Busy, HealthUpdate
+
+def test_token_buckets():
+    admission = Admission(user_rate=1, user_burst=2, channel_rate=1, channel_burst=3)
+    assert admission.allow('U1', 'C1', now=0)
+    assert admission.allow('U1', 'C1', now=0)
+    # U1 is out of tokens, U2 still has its own
+    assert not admission.allow('U1', 'C1', now=0)
+    assert admission.allow('U2', 'C1', now=0)
+    # ... but the channel is now exhausted for everyone
+    assert not admission.allow('U3', 'C1', now=0)
+    assert admission.allow('U3', 'C2', now=0)
+    # Refilled at rate
+    assert admission.allow('U1', 'C1', now=1)
+    assert admission.rate_limited == 2
+
+@pytest.mark.asyncio
+async def test_fetch_slots_and_priority():
+    admission = Admission(max_fetches=2, max_waiting=1, reserved=1)
+    order = []
+    release = asyncio.Event()
+
+    async def fetch(name, priority=False):
+        async with admission.fetch(priority):
+            order.append(name)
+            await release.wait()
+
+    first = asyncio.create_task(fetch('first'))
+    await asyncio.sleep(0)
+    # The second slot is reserved for priority fetches
+    queued = asyncio.create_task(fetch('queued'))
+    await asyncio.sleep(0)
+    assert order == ['first']
+    with pytest.raises(Busy):
+        await fetch('rejected')
+    assert admission.busy == 1
+
+    click = asyncio.create_task(fetch('click', priority=True))
+    await asyncio.sleep(0)
+    assert order == ['first', 'click']
+    release.set()
+    await asyncio.gather(first, queued, click)
+    assert order == ['first', 'click', 'queued']
+    assert admission.stats()['fetches'] == 0
+
+@pytest.mark.asyncio
+async def test_busy_reply_from_cache(slackbot, test_router, tenant1_prod_ns):
+    bms = BMSConsumer('ws://testing', slackbot, test_router)
+    async def iter_namespaces(conditional=False):
+        yield tenant1_prod_ns
+    slackbot.iter_namespaces = iter_namespaces
+    await bms.populate_cache()
+    slackbot.consumer = bms
+    slackbot.admission = Admission(user_burst=1)
+
+    replies = []
+    async def say(text, blocks=None, thread_ts=None):
+        replies.append((text, blocks))
+    ran = []
+    async def cmd_health(event, text, say):
+        assert not ran, 'should not run when rate limited'
+        ran.append(text)
+
+    event = {'user': 'U1', 'channel': 'C1'}
+    slackbot.cmd_health = cmd_health
+    await slackbot.dispatch('health', event, 'tenant1-prod', say)
+    await slackbot.dispatch('health', event, 'tenant1-prod', say)
+    assert replies[-1][0] == ':hourglass: bmspy is busy, showing cached data.'
+    assert len(replies[-1][1]) > 1
+
+    await slackbot.dispatch('health', event, 'unknown-ns', say)
+    assert replies[-1] == (':hourglass: bmspy is busy, try again in a minute.', None)
+
+@pytest.mark.asyncio
+async def test_local_commands_not_limited(slackbot):
+    slackbot.admission = Admission(user_burst=1)
+    replies = []
+    async def say(text, blocks=None, thread_ts=None):
+        replies.append(text)
+
+    event = {'user': 'U1', 'channel': 'C1'}
+    for _ in range(3):
+        await slackbot.dispatch('help', event, '', say)
+    assert not any('busy' in reply for reply in replies)
+    assert slackbot.admission.stats()['rate_limited'] == 0
+
+@pytest.mark.asyncio
+async def test_busy_reply_block_limit(slackbot, test_router, tenant1_prod_ns):
+    bms = BMSConsumer('ws://testing', slackbot, test_router)
+    namespaces = [HealthUpdate(dict(tenant1_prod_ns.to_dict(), name=f'ns-{i}')) for i in range(60)]
+    async def iter_namespaces(conditional=False):
+        for ns in namespaces:
+            yield ns
+    slackbot.iter_namespaces = iter_namespaces
+    await bms.populate_cache()
+    slackbot.consumer = bms
+
+    replies = []
+    async def say(text, blocks=None, thread_ts=None):
+        replies.append(blocks)
+    await slackbot.say_busy('health', {}, 'ns-*', say)
+    assert len(replies[0]) == 50
@@ -0,0 +1,135 @@
+import copy
+import gzip
+import json
+import pytest
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from bmspy import BMSConsumer, HealthAPI
+
+@pytest.fixture
+def consumer(slackbot, test_router):
+    return BMSConsumer('ws://testing', slackbot, test_router)
+
+async def client_for(consumer):
+    client = TestClient(TestServer(HealthAPI(consumer).app))
+    await client.start_server()
+    return client
+
+async def populate(slackbot, consumer, namespaces):
+    async def iter_namespaces(conditional=False):
+        for ns in namespaces:
+            yield ns
+    slackbot.iter_namespaces = iter_namespaces
+    await consumer.populate_cache()
+
+@pytest.mark.asyncio
+async def test_readyz(slackbot, consumer, tenant1_prod_ns):
+    client = await client_for(consumer)
+    try:
+        resp = await client.get('/readyz')
+        assert resp.status == 503
+        await populate(slackbot, consumer, [tenant1_prod_ns])
+        resp = await client.get('/readyz')
+        assert resp.status == 200
+    finally:
+        await client.close()
+
+@pytest.mark.asyncio
+async def test_namespaces(slackbot, consumer, tenant1_prod_ns, tenant1_stage_ns, tenant2_prod_ns):
+    await populate(slackbot, consumer, [tenant1_prod_ns, tenant1_stage_ns, tenant2_prod_ns])
+    client = await client_for(consumer)
+    try:
+        resp = await client.get('/ns/')
+        assert resp.status == 200
+        assert [ns['name'] for ns in await resp.json()] == ['tenant1-prod', 'tenant1-stage', 'tenant2-prod']
+
+        resp = await client.get('/ns/?tenant=tenant1')
+        assert [ns['name'] for ns in await resp.json()] == ['tenant1-prod', 'tenant1-stage']
+
+        resp = await client.get('/ns/?state=Unhealthy')
+        assert await resp.json() == []
+
+        resp = await client.get('/ns/?state=bogus')
+        assert resp.status == 400
+
+        resp = await client.get('/ns/tenant2-prod')
+        assert (await resp.json())['tenant'] == {'name': 'tenant2', 'env': 'prod'}
+
+        resp = await client.get('/ns/missing')
+        assert resp.status == 404
+    finally:
+        await client.close()
+
+@pytest.mark.asyncio
+async def test_etag_and_generations(slackbot, consumer, tenant1_prod_ns, unhealthy_hupdate_dict):
+    await populate(slackbot, consumer, [tenant1_prod_ns])
+    client = await client_for(consumer)
+    try:
+        resp = await client.get('/ns/', headers={'Accept-Encoding': 'identity'})
+        etag = resp.headers['ETag']
+        resp = await client.get('/ns/', headers={'Accept-Encoding': 'identity', 'If-None-Match': etag})
+        assert resp.status == 304
+
+        subj = copy.deepcopy(unhealthy_hupdate_dict)
+        subj['name'] = 'tenant1-prod'
+        await consumer.process_msg(json.dumps(subj))
+        resp = await client.get('/ns/', headers={'Accept-Encoding': 'identity', 'If-None-Match': etag})
+        assert resp.status == 200
+        assert resp.headers['ETag'] != etag
+
+        # Same state and errors, another tenant
+        etag = resp.headers['ETag']
+        subj['tenant'] = {'name': 'tenant9', 'env': 'prod'}
+        await consumer.process_msg(json.dumps(subj))
+        resp = await client.get('/ns/', headers={'Accept-Encoding': 'identity', 'If-None-Match': etag})
+        assert resp.status == 200
+        assert (await resp.json())[0]['tenant']['name'] == 'tenant9'
+    finally:
+        await client.close()
+
+@pytest.mark.asyncio
+async def test_gzip(slackbot, consumer, tenant1_prod_ns):
+    await populate(slackbot, consumer, [tenant1_prod_ns])
+    client = await client_for(consumer)
+    try:
+        resp = await client.get('/ns/', headers={'Accept-Encoding': 'gzip'}, auto_decompress=False)
+        assert resp.headers['Content-Encoding'] == 'gzip'
+        assert json.loads(gzip.decompress(await resp.read()))[0]['name'] == 'tenant1-prod'
+    finally:
+        await client.close()
+
+@pytest.mark.asyncio
+async def test_query(slackbot, consumer, tenant1_prod_ns, tenant1_stage_ns, tenant2_prod_ns):
+    await populate(slackbot, consumer, [tenant1_prod_ns, tenant1_stage_ns, tenant2_prod_ns])
+    client = await client_for(consumer)
+    try:
+        resp = await client.get('/query', params={'q': 'state=healthy by tenant'})
+        assert resp.status == 200
+        body = await resp.json()
+        assert body['count'] == 3
+        assert body['groups'] == {'tenant1': 2, 'tenant2': 1}
+
+        resp = await client.get('/query', params={'q': 'tenant=tenant1 env!=prod'})
+        assert (await resp.json())['namespaces'] == ['tenant1-stage']
+
+        resp = await client.get('/query', params={'q': 'bogus=1'})
+        assert resp.status == 400
+    finally:
+        await client.close()
+
+@pytest.mark.asyncio
+async def test_namespace_workloads(slackbot, consumer, tenant1_prod_ns, deployment_hupdate_dict):
+    await populate(slackbot, consumer, [tenant1_prod_ns])
+    client = await client_for(consumer)
+    try:
+        resp = await client.get('/ns/tenant1-prod')
+        assert 'workloads' not in await resp.json()
+
+        failed = copy.deepcopy(deployment_hupdate_dict)
+        failed['healthy'] = 'False'
+        await consumer.process_msg(json.dumps(failed))
+        resp = await client.get('/ns/tenant1-prod')
+        assert (await resp.json())['workloads'] == {'state': 'Unhealthy', 'counts': {'Unhealthy': 1}}
+    finally:
+        await client.close()
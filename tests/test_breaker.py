@@ -0,0 +1,84 @@
+import asyncio
+import pytest
+
+from bmspy import BMSConsumer, BreakerOpen, CircuitBreaker
+
+async def call(breaker, error=None, delay=0):
+    async with breaker.call():
+        await asyncio.sleep(delay)
+        if error != None:
+            raise error
+
+@pytest.mark.asyncio
+async def test_opens_on_failure_rate():
+    breaker = CircuitBreaker(failure_rate=0.5, window=4, min_calls=4, cooldown=60, is_failure=lambda e: not isinstance(e, KeyError))
+    await call(breaker)
+    # Not an upstream failure
+    with pytest.raises(KeyError):
+        await call(breaker, KeyError('unknown namespace'))
+    with pytest.raises(ValueError):
+        await call(breaker, ValueError())
+    assert breaker.state == CircuitBreaker.CLOSED
+    with pytest.raises(ValueError):
+        await call(breaker, ValueError())
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(BreakerOpen):
+        await call(breaker)
+    assert breaker.stats()['rejected'] == 1
+
+@pytest.mark.asyncio
+async def test_half_open_probe():
+    breaker = CircuitBreaker(window=2, min_calls=1, cooldown=0, slow_call=0.01)
+    # Slow calls count as failures
+    await call(breaker, delay=0.02)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    # One probe at a time
+    probe = asyncio.create_task(call(breaker, delay=0.001))
+    await asyncio.sleep(0)
+    with pytest.raises(BreakerOpen):
+        await call(breaker)
+    await probe
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    await call(breaker, delay=0.02)
+    assert breaker.opens == 2
+    with pytest.raises(ValueError):
+        await call(breaker, ValueError())
+    # The failed probe reopened it
+    assert breaker.opens == 3
+
+@pytest.mark.asyncio
+async def test_stale_reply(slackbot, test_router, tenant1_prod_ns):
+    bms = BMSConsumer('ws://testing', slackbot, test_router)
+    async def iter_namespaces(conditional=False):
+        yield tenant1_prod_ns
+    slackbot.iter_namespaces = iter_namespaces
+    await bms.populate_cache()
+    slackbot.consumer = bms
+    refreshed = []
+    slackbot.revalidate = lambda: refreshed.append(True)
+
+    async def fetch_namespace(namespace, priority=False):
+        raise BreakerOpen('bms-api circuit breaker is open')
+    slackbot.fetch_namespace = fetch_namespace
+
+    replies = []
+    async def say(text, blocks=None, thread_ts=None):
+        replies.append((text, blocks))
+    await slackbot.dispatch('health', {'user': 'U1', 'channel': 'C1'}, 'tenant1-prod', say)
+    assert replies[-1][0].startswith(':warning: bms-api has been unavailable for ')
+    assert replies[-1][0].endswith(', showing cached data.')
+    assert len(replies[-1][1]) > 1
+    await slackbot.dispatch('health', {'user': 'U1', 'channel': 'C1'}, 'unknown-ns', say)
+    assert replies[-1][0].endswith(', try again later.')
+    assert len(refreshed) == 2
+
+    # A warm cache is kept while the breaker is open
+    async def unavailable(conditional=False):
+        raise BreakerOpen('bms-api circuit breaker is open')
+        yield
+    slackbot.iter_namespaces = unavailable
+    await bms.populate_cache()
+    assert 'tenant1-prod' in bms.cache
+    assert len(refreshed) == 3
@@ -0,0 +1,75 @@
+import copy
+import pytest
+
+from bmspy import HealthUpdate, NamespaceCache
+
+def hupdate(base, name):
+    subj = copy.deepcopy(base)
+    subj['name'] = name
+    return HealthUpdate(subj)
+
+def test_max_size_evicts_least_recently_updated(healthy_hupdate_dict):
+    evicted = []
+    cache = NamespaceCache(max_size=2, on_evict=evicted.append)
+    cache['ns1'] = hupdate(healthy_hupdate_dict, 'ns1')
+    cache['ns2'] = hupdate(healthy_hupdate_dict, 'ns2')
+    cache['ns1'] = hupdate(healthy_hupdate_dict, 'ns1')
+    cache['ns3'] = hupdate(healthy_hupdate_dict, 'ns3')
+
+    assert list(cache.keys()) == ['ns1', 'ns3']
+    assert evicted == ['ns2']
+    assert cache.stats()['evictions'] == 1
+
+def test_ttl(healthy_hupdate_dict):
+    evicted = []
+    cache = NamespaceCache(ttl=60, on_evict=evicted.append)
+    cache['ns1'] = hupdate(healthy_hupdate_dict, 'ns1')
+    cache['ns2'] = hupdate(healthy_hupdate_dict, 'ns2')
+
+    assert cache.expire() == 0
+    assert cache.expire(now=10 ** 12) == 2
+    assert evicted == ['ns1', 'ns2']
+    assert len(cache) == 0
+    assert cache.stats()['expirations'] == 2
+
+def test_pop(healthy_hupdate_dict):
+    evicted = []
+    cache = NamespaceCache(on_evict=evicted.append)
+    cache['ns1'] = hupdate(healthy_hupdate_dict, 'ns1')
+    cache['ns2'] = hupdate(healthy_hupdate_dict, 'ns2')
+
+    assert cache.pop('ns1').name == 'ns1'
+    assert cache.pop('ns2', pruned=True).name == 'ns2'
+    assert cache.pop('missing') == None
+    assert evicted == ['ns1', 'ns2']
+    assert cache.stats()['deletions'] == 1
+    assert cache.stats()['prunes'] == 1
+
+def test_invalid():
+    with pytest.raises(ValueError):
+        NamespaceCache(max_size=-1)
+    with pytest.raises(ValueError):
+        NamespaceCache(ttl=-1)
+
+def test_tombstones(healthy_hupdate_dict):
+    forgotten = []
+    cache = NamespaceCache(max_size=1, on_forget=forgotten.append, tombstones=1)
+    cache['ns1'] = hupdate(healthy_hupdate_dict, 'ns1')
+    cache['ns2'] = hupdate(healthy_hupdate_dict, 'ns2')
+    assert cache.last_state('ns1') == healthy_hupdate_dict['healthy']
+    assert forgotten == []
+
+    # Re-admitted, ns2 is buried in turn
+    cache['ns1'] = hupdate(healthy_hupdate_dict, 'ns1')
+    assert cache.last_state('ns1') == None
+    assert cache.buried() == ['ns2']
+
+    # Past tombstones, the oldest is forgotten
+    cache['ns3'] = hupdate(healthy_hupdate_dict, 'ns3')
+    assert forgotten == ['ns2']
+    assert cache.buried() == ['ns1']
+
+    # A deleted namespace leaves no tombstone
+    cache.pop('ns1')
+    assert forgotten == ['ns2', 'ns1']
+    assert cache.buried() == []
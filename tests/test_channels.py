@@ -0,0 +1,53 @@
+import pytest
+
+from bmspy import ChannelDirectory
+
+class FakeClient:
+    """conversations.list over pages of two channels."""
+    def __init__(self, channels):
+        self.channels = channels
+        self.calls = 0
+
+    async def conversations_list(self, types, exclude_archived, limit, cursor=None):
+        self.calls += 1
+        start = int(cursor or 0)
+        next_cursor = str(start + 2) if start + 2 < len(self.channels) else ''
+        return {'ok': True, 'channels': self.channels[start:start + 2], 'response_metadata': {'next_cursor': next_cursor}}
+
+@pytest.fixture
+def directory():
+    return ChannelDirectory(FakeClient([
+        {'id': 'C00000001', 'name': 'ops', 'is_member': True},
+        {'id': 'C00000002', 'name': 'alerts', 'is_member': True},
+        {'id': 'G00000003', 'name': 'private', 'is_member': True},
+        {'id': 'C00000004', 'name': 'general', 'is_member': False},
+    ]))
+
+@pytest.mark.asyncio
+async def test_resolve(directory):
+    await directory.refresh()
+    assert directory._client.calls == 2
+    assert len(directory) == 4
+    assert directory.resolve('#ops') == 'C00000001'
+    assert directory.resolve('private') == 'G00000003'
+    assert directory.resolve('C00000009') == 'C00000009'
+    assert directory.resolve('#unknown') == '#unknown'
+
+@pytest.mark.asyncio
+async def test_check(directory):
+    await directory.refresh()
+    directory.check(['#ops', '#alerts', 'C00000001'])
+    with pytest.raises(ValueError) as e:
+        directory.check(['#ops', '#general', '#missing'])
+    assert str(e.value) == 'channels not found: #missing; bot is not a member of: #general (invite it with /invite)'
+
+@pytest.mark.asyncio
+async def test_rename_and_left(directory):
+    await directory.refresh()
+    directory.rename('C00000001', 'ops-renamed')
+    assert directory.resolve('#ops-renamed') == 'C00000001'
+    assert directory.resolve('#ops') == 'C00000001'
+    assert directory.name('C00000001') == '#ops-renamed'
+    directory.left('C00000001')
+    with pytest.raises(ValueError):
+        directory.check(['#ops'])
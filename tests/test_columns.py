@@ -0,0 +1,72 @@
+import random
+import pytest
+
+from bmspy import ColumnStore, HealthUpdate, parse_query
+
+def make_hupdate(i: int, rng: random.Random) -> HealthUpdate:
+    return HealthUpdate({
+        'kind': 'Namespace',
+        'name': f'ns-{i}',
+        'namespace': '',
+        'action': 'refresh',
+        'healthy': rng.choice(['True', 'False', 'Unknown', 'Warning']),
+        'errors': ['error'] * (70000 if i == 7 else rng.choice([0, 1, 3, 4, 300])),
+        'warnings': ['warning'] * rng.randint(0, 2),
+        'alerts': [],
+        'tenant': {'name': f'tenant{i % 7}', 'env': rng.choice(['prod', 'stage'])},
+    })
+
+def naive(hupdates, predicate):
+    return sorted(h.name for h in hupdates if predicate(h))
+
+@pytest.fixture(scope='module')
+def populated():
+    rng = random.Random(42)
+    store = ColumnStore()
+    hupdates = {}
+    for i in range(2000):
+        h = make_hupdate(i, rng)
+        store.update(h)
+        hupdates[h.name] = h
+    # Removed rows are reused and never match
+    for i in range(0, 2000, 3):
+        store.remove(f'ns-{i}')
+        del hupdates[f'ns-{i}']
+    for i in range(2000, 2300):
+        h = make_hupdate(i, rng)
+        store.update(h)
+        hupdates[h.name] = h
+    return (store, list(hupdates.values()))
+
+@pytest.mark.parametrize('query, predicate', [
+    ('tenant=tenant3 env=prod state=unhealthy errors>3', lambda h: h.tenant == 'tenant3' and h.env == 'prod' and h.healthy_str == 'Unhealthy' and len(h.errors) > 3),
+    ('state!=healthy,unknown', lambda h: h.healthy_str not in ['Healthy', 'Unknown']),
+    ('errors>=300', lambda h: len(h.errors) >= 300),
+    ('errors>65535', lambda h: False),
+    ('errors<4 warnings=2', lambda h: len(h.errors) < 4 and len(h.warnings) == 2),
+    ('errors<=1 tenant!=tenant1,tenant2', lambda h: len(h.errors) <= 1 and h.tenant not in ['tenant1', 'tenant2']),
+    ('errors!=0 errors>=0', lambda h: len(h.errors) != 0),
+    ('tenant=missing', lambda h: False),
+    ('', lambda h: True),
+])
+def test_query_matches_naive(populated, query, predicate):
+    (store, hupdates) = populated
+    expected = naive(hupdates, predicate)
+    result = store.query(query, limit=0)
+    assert result.count == len(expected)
+    assert store.query(query, limit=5000).namespaces == expected
+
+def test_group_by(populated):
+    (store, hupdates) = populated
+    result = store.query('errors>0 by tenant')
+    expected = {}
+    for h in hupdates:
+        if h.errors:
+            expected[h.tenant] = expected.get(h.tenant, 0) + 1
+    assert result.groups == expected
+    assert sum(store.query('by state').groups.values()) == len(hupdates)
+
+def test_parse_errors():
+    for query in ['bogus=1', 'errors>many', 'state=sleepy', 'tenant>blue', 'by nothing', 'errors']:
+        with pytest.raises(ValueError):
+            parse_query(query)
@@ -0,0 +1,241 @@
+import asyncio
+import copy
+import json
+import pytest
+
+from bmspy import BMSConsumer, NotModified, Route
+
+@pytest.fixture
+def consumer(slackbot, test_router):
+    test_router.add_route(Route('#all', namespaces=['testing']))
+    test_router.add_route(Route('#changes', namespaces=['testing'], content_changes=True))
+    return BMSConsumer('ws://testing', slackbot, test_router)
+
+@pytest.mark.asyncio
+async def test_transition(consumer, slackbot, healthy_hupdate_dict, unhealthy_hupdate_dict):
+    await consumer.process_msg(json.dumps(healthy_hupdate_dict))
+    await consumer.process_msg(json.dumps(healthy_hupdate_dict))
+    await consumer.process_msg(json.dumps(unhealthy_hupdate_dict))
+
+    assert len(slackbot.messages) == 4
+    assert slackbot.messages[-1]['text'].endswith('Healthy -> Unhealthy')
+
+@pytest.mark.asyncio
+async def test_content_change(consumer, slackbot, unhealthy_hupdate_dict):
+    await consumer.process_msg(json.dumps(unhealthy_hupdate_dict))
+    slackbot.reset_messages()
+
+    # Identical refresh
+    await consumer.process_msg(json.dumps(unhealthy_hupdate_dict))
+    assert len(slackbot.messages) == 0
+
+    # New error in the same state only goes to the opted-in route
+    subj = copy.deepcopy(unhealthy_hupdate_dict)
+    subj['errors'] = ['Error #2']
+    await consumer.process_msg(json.dumps(subj))
+    assert len(slackbot.messages) == 1
+    message = slackbot.messages[0]
+    assert message['channel'] == '#changes'
+    assert message['text'].endswith('changed while Unhealthy')
+    assert 'Error #2' in message['blocks'][1].text.text
+    assert '~Error #1~' in message['blocks'][2].text.text
+
+@pytest.mark.asyncio
+async def test_content_change_not_wanted(slackbot, test_router, unhealthy_hupdate_dict):
+    test_router.add_route(Route('#all', namespaces=['testing']))
+    consumer = BMSConsumer('ws://testing', slackbot, test_router)
+    await consumer.process_msg(json.dumps(unhealthy_hupdate_dict))
+    slackbot.reset_messages()
+
+    subj = copy.deepcopy(unhealthy_hupdate_dict)
+    subj['errors'] = ['Error #2']
+    await consumer.process_msg(json.dumps(subj))
+    assert len(slackbot.messages) == 0
+
+@pytest.mark.asyncio
+async def test_workloads(slackbot, test_router, tenant1_prod_ns, deployment_hupdate_dict):
+    test_router.add_route(Route('#namespaces', tenants=['tenant1']))
+    test_router.add_route(Route('#deployments', tenants=['tenant1'], kinds=['Deployment']))
+    consumer = BMSConsumer('ws://testing', slackbot, test_router)
+    await consumer.process_msg(json.dumps(tenant1_prod_ns.to_dict()))
+    slackbot.reset_messages()
+
+    await consumer.process_msg(json.dumps(deployment_hupdate_dict))
+    other = copy.deepcopy(deployment_hupdate_dict)
+    other['name'] = 'worker'
+    other['healthy'] = 'Warn'
+    await consumer.process_msg(json.dumps(other))
+    assert consumer.workload_state('tenant1-prod') == 'Warning'
+
+    failed = copy.deepcopy(deployment_hupdate_dict)
+    failed['healthy'] = 'False'
+    await consumer.process_msg(json.dumps(failed))
+    assert consumer.workload_state('tenant1-prod') == 'Unhealthy'
+    assert consumer.workload_state('tenant2-prod') == None
+
+    # Namespace state and cache untouched, workload routes notified with tenant inherited
+    assert consumer.cache['tenant1-prod'].healthy_str == 'Healthy'
+    assert len(consumer.cache) == 1
+    assert [m['channel'] for m in slackbot.messages] == ['#deployments'] * 3
+    assert slackbot.messages[-1]['text'].endswith('[Deployment] tenant1-prod/app transitioned state: Healthy -> Unhealthy')
+
+    hupdate = consumer.workload('deployment', 'tenant1-prod', 'app')
+    assert hupdate.healthy_str == 'Unhealthy'
+    assert hupdate.tenant == 'tenant1'
+    assert consumer.workload('statefulset', 'tenant1-prod', 'app') == None
+    assert consumer.workload_summary('tenant1-prod') == {'state': 'Unhealthy', 'counts': {'Warning': 1, 'Unhealthy': 1}}
+
+    # Shown with the namespace's health details
+    consumer._warm = True
+    slackbot.consumer = consumer
+    blocks = slackbot.cached_health('tenant1-prod')
+    text = blocks[-1].text.text
+    assert text.startswith('*Workloads*: :x: *Unhealthy*, warning(1), unhealthy(1)')
+    assert '[Deployment] app' in text and '[Deployment] worker' in text
+
+@pytest.mark.asyncio
+async def test_start_stops_listeners(slackbot, test_router):
+    consumer = BMSConsumer('ws://testing', slackbot, test_router, workload_urls=['ws://workloads'])
+    cancelled = []
+    async def listen(url, populate=False):
+        if populate:
+            await asyncio.sleep(0)
+            raise RuntimeError('listener died')
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            cancelled.append(url)
+            raise
+    consumer.listen = listen
+    with pytest.raises(RuntimeError):
+        await consumer.start()
+    assert cancelled == ['ws://workloads']
+
+@pytest.mark.asyncio
+async def test_conditional_populate(slackbot, test_router, tenant1_prod_ns):
+    consumer = BMSConsumer('ws://testing', slackbot, test_router)
+    namespaces = [tenant1_prod_ns]
+    calls = []
+    async def iter_namespaces(conditional=False):
+        calls.append(conditional)
+        if conditional:
+            raise NotModified()
+        for ns in namespaces:
+            yield ns
+    slackbot.iter_namespaces = iter_namespaces
+    await consumer.populate_cache()
+    # Unchanged since the fetch: a 304 keeps the cache
+    await consumer.process_msg(json.dumps(tenant1_prod_ns.to_dict()))
+    await consumer.populate_cache()
+    assert calls == [False, True]
+
+    # Went Unhealthy over the websocket, then reverted upstream while disconnected
+    await consumer.process_msg(json.dumps(dict(tenant1_prod_ns.to_dict(), healthy='False')))
+    await consumer.populate_cache()
+    assert calls == [False, True, False]
+    assert consumer.cache['tenant1-prod'].healthy_str == 'Healthy'
+    await consumer.populate_cache()
+    assert calls == [False, True, False, True]
+
+@pytest.mark.asyncio
+async def test_delete_and_prune(slackbot, test_router, tenant1_prod_ns, tenant1_stage_ns, tenant2_prod_ns):
+    consumer = BMSConsumer('ws://testing', slackbot, test_router)
+    namespaces = [tenant1_prod_ns, tenant1_stage_ns, tenant2_prod_ns]
+    async def iter_namespaces(conditional=False):
+        for ns in namespaces:
+            yield ns
+    slackbot.iter_namespaces = iter_namespaces
+    await consumer.populate_cache()
+    assert len(consumer.cache) == 3
+
+    deleted = tenant1_stage_ns.to_dict()
+    deleted['action'] = 'delete'
+    await consumer.process_msg(json.dumps(deleted))
+    assert 'tenant1-stage' not in consumer.cache
+    assert 'tenant1-stage' not in consumer.rollup
+    assert 'tenant1-stage' not in consumer.history
+    assert slackbot.messages == []
+
+    # tenant2-prod went away while disconnected
+    namespaces = [tenant1_prod_ns]
+    await consumer.populate_cache()
+    assert list(consumer.cache.keys()) == ['tenant1-prod']
+    assert consumer.rollup.counts()['Healthy'] == 1
+    stats = consumer.cache_stats()
+    assert stats['deletions'] == 1
+    assert stats['prunes'] == 1
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('options', [{'cache_max_size': 1}, {'cache_ttl': 60}])
+async def test_readmitted_after_eviction(slackbot, test_router, options, tenant1_prod_ns, tenant1_stage_ns):
+    test_router.add_route(Route('#all', namespaces=['*']))
+    consumer = BMSConsumer('ws://testing', slackbot, test_router, **options)
+    await consumer.process_msg(json.dumps(tenant1_prod_ns.to_dict()))
+    await consumer.process_msg(json.dumps(tenant1_stage_ns.to_dict()))
+    consumer.cache.expire(now=10 ** 12)
+    assert 'tenant1-prod' not in consumer.cache
+    slackbot.reset_messages()
+
+    # Still live and unchanged: no Unknown -> Healthy, history and rollup kept
+    await consumer.process_msg(json.dumps(tenant1_prod_ns.to_dict()))
+    assert slackbot.messages == []
+    assert len(consumer.history.entries('tenant1-prod')) == 1
+    assert consumer.rollup.state('tenant1-prod') == tenant1_prod_ns.healthy_str
+
+    # A real change is still a transition
+    await consumer.process_msg(json.dumps(dict(tenant1_prod_ns.to_dict(), healthy='False')))
+    assert slackbot.messages[-1]['text'].endswith(f'{tenant1_prod_ns.healthy_str} -> Unhealthy')
+
+@pytest.mark.asyncio
+async def test_overview_after_eviction(slackbot, test_router, tenant1_prod_ns, tenant1_stage_ns):
+    consumer = BMSConsumer('ws://testing', slackbot, test_router, cache_max_size=1)
+    consumer._warm = True
+    slackbot.consumer = consumer
+    for ns in [tenant1_prod_ns, tenant1_stage_ns]:
+        await consumer.process_msg(json.dumps(dict(ns.to_dict(), healthy='False')))
+    assert 'tenant1-prod' not in consumer.cache
+
+    # Counted, but only the cached namespace is listed
+    blocks = slackbot.cached_health('')
+    assert blocks[0].text.text.endswith('unhealthy(2)')
+    assert slackbot.cached_health('tenant=tenant1') != None
+
+@pytest.mark.asyncio
+async def test_process_batch(consumer, slackbot, healthy_hupdate_dict, unhealthy_hupdate_dict, deployment_hupdate_dict):
+    await consumer.process_msg(json.dumps(healthy_hupdate_dict))
+    slackbot.reset_messages()
+
+    # Only the last frame of 'testing' counts, the workload is handled too
+    frames = [json.dumps(unhealthy_hupdate_dict), json.dumps(healthy_hupdate_dict), json.dumps(unhealthy_hupdate_dict), 'not json', json.dumps(deployment_hupdate_dict)]
+    await consumer.process_batch(frames)
+    assert consumer.cache['testing'].healthy_str == 'Unhealthy'
+    assert [m['channel'] for m in slackbot.messages] == ['#all', '#changes']
+    assert consumer.coalesced == 2
+    assert consumer.batch_stats()['frames'] == 5
+
+class FakeWebSocket:
+    def __init__(self, frames, error=None):
+        self._frames = frames
+        self._error = error
+
+    async def __aiter__(self):
+        for frame in self._frames:
+            yield frame
+        if self._error != None:
+            raise self._error
+
+@pytest.mark.asyncio
+async def test_consume_batches(slackbot, test_router, tenant1_prod_ns, tenant1_stage_ns):
+    test_router.add_route(Route('#all', namespaces=['*']))
+    consumer = BMSConsumer('ws://testing', slackbot, test_router, batch_size=64)
+    frames = [json.dumps(ns.to_dict()) for ns in [tenant1_prod_ns, tenant1_stage_ns, tenant1_prod_ns]]
+    await consumer.consumer(FakeWebSocket(frames))
+    assert sorted(consumer.cache.keys()) == ['tenant1-prod', 'tenant1-stage']
+    assert consumer.batched_frames == 3
+
+    with pytest.raises(ConnectionError):
+        await consumer.consumer(FakeWebSocket(frames, error=ConnectionResetError()))
+
+    # Any other reader failure ends the stream too instead of hanging
+    with pytest.raises(ValueError):
+        await asyncio.wait_for(consumer.consumer(FakeWebSocket(frames, error=ValueError('bad frame'))), 5)
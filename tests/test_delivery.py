@@ -0,0 +1,91 @@
+import asyncio
+import pytest
+
+from bmspy import DeliveryQueue, HealthUpdate, Route, Router, priority
+
+def hupdate(name, healthy, errors=[]):
+    return HealthUpdate({'kind': 'Namespace', 'name': name, 'healthy': healthy, 'errors': errors})
+
+def test_priority():
+    assert priority(hupdate('a', 'False', ['down'])) == 0
+    assert priority(hupdate('a', 'Warn', ['oops'])) == 1
+    assert priority(hupdate('a', 'Warn')) == 2
+    assert priority(hupdate('a', 'True')) == 4
+    assert priority(hupdate('a', 'True'), weight=2) == 2
+    assert priority(hupdate('a', 'False'), weight=-9) == 4
+
+@pytest.mark.asyncio
+async def test_order_and_aging(monkeypatch):
+    sent = []
+    release = asyncio.Event()
+    async def send(channel, text, blocks):
+        await release.wait()
+        sent.append(text)
+
+    queue = DeliveryQueue(send, concurrency=1, aging=10)
+    now = [1000.0]
+    monkeypatch.setattr('bmspy.delivery.time.monotonic', lambda: now[0])
+    # The first one occupies the only sender
+    await queue.put('#c', 'first', [], 4)
+    await asyncio.sleep(0)
+    await queue.put('#c', 'recovery', [], 4)
+    now[0] += 35
+    await queue.put('#c', 'warning', [], 2)
+    # Due at 1035, 5s before the recovery queued 35s ago
+    await queue.put('#c', 'critical', [], 0)
+    now[0] += 10
+    release.set()
+    assert await queue.drain(1) == 0
+    # Aged past the warning queued after it
+    assert sent == ['first', 'critical', 'recovery', 'warning']
+    stats = queue.stats()
+    assert stats['classes']['critical'] == {'sent': 1, 'mean_wait': 10.0, 'max_wait': 10.0}
+    assert stats['classes']['recovery']['sent'] == 2
+    await queue.close()
+
+@pytest.mark.asyncio
+async def test_router_delivery(slackbot):
+    router = Router(slackbot, delivery=DeliveryQueue(slackbot.send_message, concurrency=1))
+    router.add_routes([
+        Route('#ops', namespaces=['*']),
+        Route('#vip', namespaces=['*'], weight=4),
+    ])
+    await router.process_batch([hupdate('ok', 'True'), hupdate('broken', 'False', ['down'])])
+    assert await router.drain(1) == 0
+    # The recovery is critical for #vip only
+    assert [(m['channel'], m['text'].split()[2]) for m in slackbot.messages] == [
+        ('#vip', 'ok'), ('#ops', 'broken'), ('#vip', 'broken'), ('#ops', 'ok'),
+    ]
+    await router.delivery.close()
+
+@pytest.mark.asyncio
+async def test_per_key_order():
+    sent = []
+    release = asyncio.Event()
+    async def send(channel, text, blocks):
+        await release.wait()
+        sent.append(text)
+
+    queue = DeliveryQueue(send, concurrency=1, aging=10)
+    await queue.put('#c', 'other', [], 4)
+    await asyncio.sleep(0)
+    await queue.put('#c', 'ns down', [], 0, key=('#c', 'ns'))
+    await queue.put('#c', 'ns up', [], 4, key=('#c', 'ns'))
+    await queue.put('#c', 'ns down again', [], 0, key=('#c', 'ns'))
+    await queue.put('#c', 'warning', [], 2)
+    release.set()
+    assert await queue.drain(1) == 0
+    # ns keeps its order, ranked by its most urgent message
+    assert sent == ['other', 'ns down', 'ns up', 'ns down again', 'warning']
+    await queue.close()
+
+@pytest.mark.asyncio
+async def test_router_delivery_order(slackbot):
+    router = Router(slackbot, routes=[{'channel': 'ops', 'namespaces': ['*']}], delivery=DeliveryQueue(slackbot.send_message, concurrency=1))
+    for healthy in ['False', 'True', 'False']:
+        await router.process_msg(hupdate('ns', healthy, ['down'] if healthy == 'False' else []))
+    assert await router.drain(1) == 0
+    # The channel ends with ns Unhealthy, as it is
+    assert 'Unhealthy' in slackbot.messages[-1]['text'].split('->')[-1]
+    assert len(slackbot.messages) == 3
+    await router.delivery.close()
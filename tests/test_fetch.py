@@ -0,0 +1,63 @@
+import json
+import pytest
+
+from bmspy import NamespaceFetcher, NotModified, iter_json_array
+
+# External deps
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+async def chunked(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+async def collect(chunks):
+    return [item async for item in iter_json_array(chunks)]
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('size', [1, 2, 7, 4096])
+async def test_iter_json_array(size):
+    items = [{'name': 'ünïcode', 'errors': ['a, b', ']']}, 12345, 'x', None, [1, [2]]]
+    data = json.dumps(items, indent=2).encode('utf-8')
+    assert await collect(chunked(data, size)) == items
+    assert await collect(chunked(b' [ ] ', size)) == []
+
+@pytest.mark.asyncio
+async def test_iter_json_array_errors():
+    with pytest.raises(ValueError):
+        await collect(chunked(b'{"a": 1}', 3))
+    with pytest.raises(ValueError):
+        await collect(chunked(b'[{"a": 1}, {"b"', 3))
+
+@pytest.mark.asyncio
+async def test_fetch_conditional_gzip(healthy_hupdate_dict, unhealthy_hupdate_dict):
+    seen_headers = []
+    async def handle_list(request):
+        seen_headers.append(request.headers)
+        if request.headers.get('If-None-Match', None) == '"v1"':
+            return web.Response(status=304)
+        resp = web.json_response([healthy_hupdate_dict, unhealthy_hupdate_dict], headers={'ETag': '"v1"'})
+        resp.enable_compression()
+        return resp
+
+    app = web.Application()
+    app.router.add_get('/ns/', handle_list)
+    server = TestServer(app)
+    await server.start_server()
+    fetcher = NamespaceFetcher(str(server.make_url('/')))
+    try:
+        names = [ns.healthy_str async for ns in fetcher.namespaces(conditional=True)]
+        assert names == ['Healthy', 'Unhealthy']
+        assert 'gzip' in seen_headers[0]['Accept-Encoding']
+        assert 'If-None-Match' not in seen_headers[0]
+
+        with pytest.raises(NotModified):
+            async for ns in fetcher.namespaces(conditional=True):
+                pass
+        assert fetcher.not_modified == 1
+
+        # Unconditional fetches always get the list
+        assert len([ns async for ns in fetcher.namespaces()]) == 2
+    finally:
+        await fetcher.close()
+        await server.close()
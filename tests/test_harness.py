@@ -0,0 +1,39 @@
+import pytest
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from harness.fake_slack import FakeSlack
+from harness.fleet import Fleet
+
+def test_fleet_deterministic():
+    a = Fleet(namespaces=100, tenants=5, flap_rate=0.1, seed=1)
+    b = Fleet(namespaces=100, tenants=5, flap_rate=0.1, seed=1)
+    assert len(a) == 100
+    assert a.tick(1.0) == b.tick(1.0)
+
+def test_fleet_storm():
+    fleet = Fleet(namespaces=100, tenants=2, flap_rate=0, refresh_rate=0, storm_every=1.0, storm_size=1.0, storm_duration=0.5)
+    frames = fleet.tick(1.0)
+    assert len(frames) > 1
+    assert all(frame['healthy'] == 'False' for frame in frames)
+    assert len(set(frame['errors'][0] for frame in frames)) == 1
+    recovered = fleet.tick(0.5)
+    assert [frame['name'] for frame in recovered] == [frame['name'] for frame in frames]
+    assert all(frame['healthy'] == 'True' for frame in recovered)
+
+@pytest.mark.asyncio
+async def test_fake_slack_rate_limit():
+    slack = FakeSlack(channel_rate=0.001, channel_burst=2)
+    client = TestClient(TestServer(slack.app))
+    await client.start_server()
+    try:
+        statuses = []
+        for _ in range(3):
+            resp = await client.post('/api/chat.postMessage', json={'channel': 'loadtest', 'text': '[Namespace] ns transitioned state: Healthy -> Unhealthy'})
+            statuses.append(resp.status)
+        assert statuses == [200, 200, 429]
+        assert resp.headers['Retry-After'] == '1'
+        assert slack.rate_limited == 1
+        assert [(name, state) for (name, state, _) in slack.transitions] == [('ns', 'Unhealthy')] * 2
+    finally:
+        await client.close()
@@ -31,3 +31,18 @@ def test_init_validation(healthy_hupdate_dict, field):
     del(obj[field])
     with pytest.raises(KeyError) as e_info:
         HealthUpdate(obj)
+
+def test_digest(unhealthy_hupdate_dict):
+    subj = copy.deepcopy(unhealthy_hupdate_dict)
+    subj['errors'] = ['Error #1', 'Error #2']
+    reordered = copy.deepcopy(subj)
+    reordered['errors'] = ['Error #2', 'Error #1']
+    changed = copy.deepcopy(subj)
+    changed['errors'] = ['Error #1', 'Error #3']
+    moved = copy.deepcopy(subj)
+    moved['errors'] = ['Error #1']
+    moved['warnings'] = ['Error #2']
+
+    assert HealthUpdate(subj).digest == HealthUpdate(reordered).digest
+    assert HealthUpdate(subj).digest != HealthUpdate(changed).digest
+    assert HealthUpdate(subj).digest != HealthUpdate(moved).digest
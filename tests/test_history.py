@@ -0,0 +1,62 @@
+from bmspy import HealthUpdate, TransitionHistory
+
+HEALTHY = HealthUpdate.STATES.index('Healthy')
+UNHEALTHY = HealthUpdate.STATES.index('Unhealthy')
+WARNING = HealthUpdate.STATES.index('Warning')
+
+def test_record_only_transitions():
+    history = TransitionHistory(capacity=4)
+    assert history.record('testing', HEALTHY, ts=0) == True
+    assert history.record('testing', HEALTHY, ts=1) == False
+    assert history.record('testing', UNHEALTHY, ts=2) == True
+    assert history.entries('testing') == [(0, 'Healthy'), (2, 'Unhealthy')]
+
+def test_ring_wraps():
+    history = TransitionHistory(capacity=3)
+    for ts in range(10):
+        history.record('testing', HEALTHY if ts % 2 else UNHEALTHY, ts=ts)
+    entries = history.entries('testing')
+    assert [ts for (ts, state) in entries] == [7, 8, 9]
+
+def test_global_cap_drops_least_recent():
+    history = TransitionHistory(capacity=2, max_entries=4)
+    history.record('ns1', HEALTHY, ts=0)
+    history.record('ns2', HEALTHY, ts=1)
+    history.record('ns1', UNHEALTHY, ts=2)
+    history.record('ns3', HEALTHY, ts=3)
+
+    assert len(history) == 2
+    assert 'ns1' in history
+    assert 'ns2' not in history
+    assert 'ns3' in history
+
+def test_stats():
+    history = TransitionHistory()
+    history.record('testing', HEALTHY, ts=0)
+    history.record('testing', UNHEALTHY, ts=100)
+    history.record('testing', WARNING, ts=130)
+    history.record('testing', HEALTHY, ts=160)
+    history.record('testing', UNHEALTHY, ts=200)
+    history.record('testing', HEALTHY, ts=220)
+
+    stats = history.stats('testing', window=300, now=300)
+    assert stats.flaps == 5
+    assert stats.recoveries == [60, 20]
+    assert stats.mttr == 40
+    assert stats.time_in_state == {'Healthy': 220, 'Unhealthy': 50, 'Warning': 30}
+
+    # Only the tail of the window
+    stats = history.stats('testing', window=110, now=300)
+    assert stats.flaps == 2
+    assert stats.time_in_state == {'Healthy': 90, 'Unhealthy': 20}
+
+def test_fleet_stats():
+    history = TransitionHistory()
+    history.record('ns1', UNHEALTHY, ts=0)
+    history.record('ns1', HEALTHY, ts=10)
+    history.record('ns2', UNHEALTHY, ts=0)
+    history.record('ns2', HEALTHY, ts=30)
+
+    stats = history.fleet_stats(window=100, now=100)
+    assert stats.mttr == 20
+    assert history.top_flappers(window=100, now=100) == [('ns1', 1), ('ns2', 1)]
@@ -0,0 +1,100 @@
+import time
+import pytest
+
+from bmspy import Correlator, HealthUpdate, Router, error_key
+
+def hupdate(name, healthy='False', tenant=None, env='prod', errors=None):
+    return HealthUpdate({
+        'kind': 'Namespace',
+        'name': name,
+        'healthy': healthy,
+        'tenant': {'name': tenant, 'env': env} if tenant else None,
+        'errors': errors if errors != None else ([f'{name}: Deployment api has 0/2 ready replicas'] if healthy == 'False' else []),
+        'warnings': [],
+        'alerts': [],
+    })
+
+def test_error_key():
+    assert error_key('ns-3: Deployment api has 0/2 ready replicas', 'ns-3') == '*: Deployment api has #/# ready replicas'
+
+def test_clusters(slackbot):
+    correlator = Correlator(slackbot, window=60, min_size=3)
+    # Shared tenant/env
+    assert not correlator.observe(hupdate('a-1', tenant='a'), ['#ops'], now=0)
+    assert not correlator.observe(hupdate('a-2', tenant='a'), ['#ops'], now=1)
+    # Unrelated error, no tenant
+    assert not correlator.observe(hupdate('lone', errors=['disk full']), ['#ops'], now=2)
+    # Shares the error string with a-1/a-2 but not the tenant
+    assert correlator.observe(hupdate('b-1', tenant='b'), ['#ops'], now=3)
+    assert len(correlator) == 1
+    assert correlator.incidents == 1
+    # Outside the window a shared key no longer joins
+    assert not correlator.observe(hupdate('c-1', tenant='c', errors=['disk full']), ['#ops'], now=100)
+
+def test_merges_clusters(slackbot):
+    correlator = Correlator(slackbot, window=60, min_size=4)
+    correlator.observe(hupdate('a-1', tenant='a', errors=['x']), ['#ops'], now=0)
+    correlator.observe(hupdate('a-2', tenant='a', errors=['y']), ['#ops'], now=0)
+    correlator.observe(hupdate('b-1', tenant='b', errors=['z']), ['#ops'], now=0)
+    # Joins both clusters through the error keys
+    assert correlator.observe(hupdate('c-1', tenant='c', errors=['y', 'z']), ['#ops'], now=0) == {'#ops'}
+    assert len(correlator) == 1
+
+@pytest.mark.asyncio
+async def test_router_incident(slackbot):
+    router = Router(slackbot, routes=[{'channel': 'ops', 'tenants': ['*']}], correlator=Correlator(slackbot, min_size=3))
+    for i in range(5):
+        await router.process_msg(hupdate(f'a-{i}', tenant='a'))
+    # Two transitions, then one incident message updated in place
+    assert len(slackbot.messages) == 3
+    assert slackbot.messages[2]['text'].startswith(':rotating_light: Incident: 5 of 5')
+
+    for i in range(5):
+        await router.process_msg(hupdate(f'a-{i}', healthy='True', tenant='a'))
+    assert len(slackbot.messages) == 3
+    assert slackbot.messages[2]['updated']
+    assert slackbot.messages[2]['text'].startswith(':white_check_mark: Resolved: 5 namespaces')
+    assert len(router.correlator) == 0
+
+@pytest.mark.asyncio
+async def test_incident_per_channel(slackbot):
+    routes = [{'channel': 'tenant-a', 'tenants': ['a']}, {'channel': 'tenant-b', 'tenants': ['b']}]
+    router = Router(slackbot, routes=routes, correlator=Correlator(slackbot, min_size=2))
+    # One shared error joins all four into a cluster across tenants
+    for name in ['a-1', 'b-1', 'a-2', 'b-2']:
+        await router.process_msg(hupdate(name, tenant=name[0], errors=['etcd timeout']))
+    incidents = [message for message in slackbot.messages if message['text'].startswith(':rotating_light:')]
+    assert sorted(message['channel'] for message in incidents) == ['#tenant-a', '#tenant-b']
+    for message in incidents:
+        listed = str(message['blocks'][1].text.text)
+        tenant = message['channel'][-1]
+        assert message['text'].startswith(':rotating_light: Incident: 2 of 2')
+        assert f'{tenant}-1' in listed and f'{tenant}-2' in listed
+        other = 'b' if tenant == 'a' else 'a'
+        assert f'{other}-1' not in listed and f'{other}-2' not in listed
+
+    # Tenant a recovering resolves only its own incident
+    for name in ['a-1', 'a-2']:
+        await router.process_msg(hupdate(name, healthy='True', tenant='a', errors=[]))
+    by_channel = {message['channel']: message for message in slackbot.messages if message.get('updated')}
+    assert by_channel['#tenant-a']['text'].startswith(':white_check_mark: Resolved: 2 namespaces')
+    assert '#tenant-b' not in by_channel
+    assert len(router.correlator) == 1
+
+def test_storm_is_linear(slackbot):
+    def letters(i):
+        # error_key masks digits
+        return ''.join(chr(97 + int(digit)) for digit in str(i))
+
+    def storm(n):
+        correlator = Correlator(slackbot, window=3600)
+        started = time.perf_counter()
+        for i in range(n):
+            # Unrelated: its own tenant and error, so every one is a new cluster
+            correlator.observe(hupdate(f'ns-{i}', tenant=letters(i), errors=[f'error {letters(i)}']), ['#ops'], now=i / 10)
+        assert len(correlator._clusters) == n
+        return time.perf_counter() - started
+
+    storm(500)
+    # 4x the transitions: ~4x the time when linear, 16x when every one scans every cluster
+    assert storm(16000) < 10 * storm(4000)
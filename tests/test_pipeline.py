@@ -0,0 +1,102 @@
+import asyncio
+import json
+import pytest
+import threading
+
+from bmspy import BMSConsumer, DecodePool, HealthUpdate, Route, decode_frames, decode_update, encode_update, unpack_batch
+from bmspy.pipeline import _pack_frames
+
+class FakeWebSocket:
+    def __init__(self, frames):
+        self._frames = frames
+
+    async def __aiter__(self):
+        for frame in self._frames:
+            yield frame
+
+def test_roundtrip(tenant1_prod_ns):
+    tenant1_prod_ns.previous_healthy_raw = 'True'
+    tenant1_prod_ns.errors.append('ünïcode error')
+    (hupdate, offset) = decode_update(encode_update(tenant1_prod_ns))
+    assert hupdate.to_dict() == tenant1_prod_ns.to_dict()
+    assert hupdate.previous_healthy_raw == 'True'
+    assert hupdate.digest == tenant1_prod_ns.digest
+
+    # No tenant, several records back to back
+    bare = HealthUpdate({'kind': 'Deployment', 'name': 'api', 'namespace': 'ns', 'healthy': 'Warn', 'warnings': ['slow']})
+    data = encode_update(bare) + encode_update(tenant1_prod_ns)
+    (first, offset) = decode_update(data)
+    (second, end) = decode_update(data, offset)
+    assert (first.tenant, first.warnings, first.path) == (None, ['slow'], 'ns/api')
+    assert second.name == 'tenant1-prod'
+    assert end == len(data)
+
+def test_decode_frames(tenant1_prod_ns, tenant1_stage_ns):
+    frames = [json.dumps(ns.to_dict()) for ns in [tenant1_prod_ns, tenant1_stage_ns]]
+    changed = dict(tenant1_prod_ns.to_dict(), healthy='False')
+    frames.extend(['{not json', json.dumps(changed)])
+    (hupdates, coalesced) = unpack_batch(decode_frames(_pack_frames(frames)))
+    assert [(h.name, h.healthy_raw) for h in hupdates] == [('tenant1-prod', 'False'), ('tenant1-stage', tenant1_stage_ns.healthy_raw)]
+    # One bad frame and one older tenant1-prod frame
+    assert coalesced == 2
+
+@pytest.mark.asyncio
+async def test_consume_pipelined(slackbot, test_router, tenant1_prod_ns, tenant1_stage_ns):
+    test_router.add_route(Route('#all', namespaces=['*']))
+    pool = DecodePool(workers=2)
+    pool.start()
+    try:
+        consumer = BMSConsumer('ws://testing', slackbot, test_router, batch_size=1, decode_pool=pool)
+        frames = [json.dumps(ns.to_dict()) for ns in [tenant1_prod_ns, tenant1_stage_ns]]
+        frames.append(json.dumps(dict(tenant1_prod_ns.to_dict(), healthy='False', errors=['down'])))
+        await consumer.consumer(FakeWebSocket(frames))
+        assert sorted(consumer.cache.keys()) == ['tenant1-prod', 'tenant1-stage']
+        # Applied in order across workers
+        assert consumer.cache['tenant1-prod'].healthy_str == 'Unhealthy'
+        assert pool.stats()['frames'] == 3
+        assert consumer.batch_stats()['decode_pool']['workers'] == 2
+    finally:
+        assert await pool.close() == 0
+
+@pytest.mark.asyncio
+async def test_shared_pool(slackbot, test_router):
+    def frames(prefix, count):
+        return [json.dumps({'kind': 'Namespace', 'name': f'{prefix}-{i}', 'healthy': 'True', 'errors': ['x' * 1000]}) for i in range(count)]
+
+    pool = DecodePool(workers=1)
+    pool.start()
+    try:
+        # Large batches, so that concurrent writes to the one worker overlap
+        for _ in range(5):
+            (fa, fb) = await asyncio.gather(pool.submit(frames('a', 200)), pool.submit(frames('b', 200)))
+            ((a, _), (b, _)) = await asyncio.wait_for(asyncio.gather(fa, fb), 30)
+            assert {h.name[0] for h in a} == {'a'} and {h.name[0] for h in b} == {'b'}
+
+        # Two consumers, as with a namespace and a --workloads listener
+        consumers = [BMSConsumer('ws://testing', slackbot, test_router, batch_size=50, decode_pool=pool) for _ in range(2)]
+        await asyncio.wait_for(asyncio.gather(consumers[0].consumer(FakeWebSocket(frames('a', 300))), consumers[1].consumer(FakeWebSocket(frames('b', 300)))), 30)
+        assert sorted(consumers[0].cache.keys()) == sorted(f'a-{i}' for i in range(300))
+        assert sorted(consumers[1].cache.keys()) == sorted(f'b-{i}' for i in range(300))
+    finally:
+        assert await pool.close() == 0
+
+@pytest.mark.asyncio
+async def test_results_read_off_the_loop():
+    pool = DecodePool(workers=1)
+    pool.start()
+    try:
+        conn = pool._conns[0]
+        threads = []
+        recv_bytes = conn.recv_bytes
+        def recording_recv_bytes(*args):
+            threads.append(threading.current_thread())
+            return recv_bytes(*args)
+        conn.recv_bytes = recording_recv_bytes
+
+        # A result well past the pipe buffer
+        frames = [json.dumps({'kind': 'Namespace', 'name': f'ns-{i}', 'healthy': 'False', 'errors': ['x' * 4000]}) for i in range(1000)]
+        (hupdates, _) = await asyncio.wait_for(await pool.submit(frames), 30)
+        assert len(hupdates) == 1000
+        assert threads and threading.main_thread() not in threads
+    finally:
+        assert await pool.close() == 0
@@ -0,0 +1,44 @@
+import asyncio
+import logging
+import os
+import pytest
+import time
+
+from bmspy import LoopMonitor, Profiler
+
+@pytest.mark.asyncio
+async def test_profile_writes_report(tmp_path):
+    profiler = Profiler(str(tmp_path), top=5)
+    path = await profiler.profile(0.05)
+    assert os.path.exists(path)
+    assert os.path.exists(path[:-len('.txt')] + '.prof')
+    with open(path) as f:
+        report = f.read()
+    assert 'allocation sites' in report
+    assert not profiler.running
+
+@pytest.mark.asyncio
+async def test_one_profile_at_a_time(tmp_path):
+    profiler = Profiler(str(tmp_path))
+    task = asyncio.create_task(profiler.profile(0.05))
+    await asyncio.sleep(0)
+    with pytest.raises(RuntimeError):
+        await profiler.profile(0.05)
+    await task
+
+async def _blocking():
+    time.sleep(0.3)
+
+@pytest.mark.asyncio
+async def test_loop_monitor_logs_blocking_coroutine(caplog):
+    monitor = LoopMonitor(threshold=0.1, interval=0.02)
+    task = asyncio.create_task(monitor.run())
+    await asyncio.sleep(0.05)
+    with caplog.at_level(logging.WARNING):
+        await asyncio.create_task(_blocking())
+        await asyncio.sleep(0.05)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    assert monitor.stalls == 1
+    assert monitor.max_lag >= 0.2
+    assert '_blocking' in caplog.text
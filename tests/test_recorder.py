@@ -0,0 +1,49 @@
+import gzip
+import json
+import pytest
+
+from bmspy import BMSConsumer, Replayer, Route, Router, SinkSlackBot, read_capture
+
+def write_capture(path, payloads, start=1000.0):
+    with gzip.open(path, 'ab') as capture:
+        for (i, payload) in enumerate(payloads):
+            entry = {'ts': start + i * 0.01, 'frame': json.dumps(payload)}
+            capture.write(json.dumps(entry).encode('utf-8') + b'\n')
+
+def test_read_capture_multiple_members(tmp_path, healthy_hupdate_dict, unhealthy_hupdate_dict):
+    path = str(tmp_path / 'capture.jsonl.gz')
+    write_capture(path, [healthy_hupdate_dict])
+    write_capture(path, [unhealthy_hupdate_dict], start=2000.0)
+
+    entries = list(read_capture(path))
+    assert len(entries) == 2
+    assert entries[0][0] == 1000.0
+    assert json.loads(entries[1][1])['healthy'] == 'False'
+
+def test_read_capture_truncated(tmp_path, healthy_hupdate_dict):
+    path = str(tmp_path / 'capture.jsonl.gz')
+    write_capture(path, [healthy_hupdate_dict] * 50)
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data[:-10])
+
+    entries = list(read_capture(path))
+    assert len(entries) < 50
+
+@pytest.mark.asyncio
+async def test_replay(tmp_path, healthy_hupdate_dict, unhealthy_hupdate_dict):
+    path = str(tmp_path / 'capture.jsonl.gz')
+    write_capture(path, [healthy_hupdate_dict, healthy_hupdate_dict, unhealthy_hupdate_dict, healthy_hupdate_dict])
+
+    slackbot = SinkSlackBot(keep=True)
+    router = Router(slackbot)
+    router.add_route(Route('#testing', namespaces=['testing']))
+    replayer = Replayer(path, BMSConsumer('ws://replay', slackbot, router), speed=0)
+    await replayer.run()
+
+    assert replayer.frames == 4
+    assert replayer.throughput > 0
+    # Unknown -> Healthy, Healthy -> Unhealthy, Unhealthy -> Healthy
+    assert slackbot.sent == 3
+    assert slackbot.messages[1]['text'].endswith('Healthy -> Unhealthy')
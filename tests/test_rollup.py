@@ -0,0 +1,68 @@
+import copy
+import json
+import pytest
+
+from bmspy import BMSConsumer, HealthRollup, HealthUpdate
+
+def test_update_moves_between_sets(tenant1_prod_ns, tenant1_stage_ns, tenant2_prod_ns, unhealthy_hupdate_dict):
+    rollup = HealthRollup()
+    for ns in [tenant1_prod_ns, tenant1_stage_ns, tenant2_prod_ns]:
+        rollup.update(ns)
+
+    assert len(rollup) == 3
+    assert rollup.counts()['Healthy'] == 3
+    assert rollup.counts(tenant='tenant1')['Healthy'] == 2
+    assert rollup.counts(tenant='tenant1', env='prod')['Healthy'] == 1
+
+    subj = copy.deepcopy(unhealthy_hupdate_dict)
+    subj['name'] = 'tenant1-prod'
+    subj['tenant'] = {'name': 'tenant1', 'env': 'prod'}
+    rollup.update(HealthUpdate(subj))
+
+    assert len(rollup) == 3
+    assert rollup.counts()['Healthy'] == 2
+    assert rollup.counts()['Unhealthy'] == 1
+    assert rollup.members('Unhealthy', tenant='tenant1') == {'tenant1-prod'}
+    assert rollup.members('Unhealthy', tenant='tenant2') == set()
+    assert rollup.state('tenant1-prod') == 'Unhealthy'
+
+def test_remove(tenant1_prod_ns):
+    rollup = HealthRollup()
+    rollup.update(tenant1_prod_ns)
+    rollup.remove('tenant1-prod')
+    rollup.remove('not-there')
+
+    assert 'tenant1-prod' not in rollup
+    assert rollup.counts()['Healthy'] == 0
+
+def test_empty_sets_dropped(tenant1_prod_ns):
+    rollup = HealthRollup()
+    for i in range(100):
+        rollup.update(HealthUpdate(dict(tenant1_prod_ns.to_dict(), name=f'ns-{i}', tenant={'name': f'tenant-{i}', 'env': 'prod'})))
+        rollup.remove(f'ns-{i}')
+    assert (rollup._by_state, rollup._by_tenant, rollup._by_env) == ({}, {}, {})
+    assert rollup.counts(tenant='tenant-1')['Healthy'] == 0
+
+@pytest.mark.asyncio
+async def test_overview_from_consumer(slackbot, test_router, tenant1_prod_ns, tenant2_prod_ns, unhealthy_hupdate_dict):
+    bms = BMSConsumer('ws://testing', slackbot, test_router)
+    slackbot.consumer = bms
+
+    async def iter_namespaces(conditional=False):
+        for ns in [tenant1_prod_ns, tenant2_prod_ns]:
+            yield ns
+    slackbot.iter_namespaces = iter_namespaces
+    await bms.populate_cache()
+
+    subj = copy.deepcopy(unhealthy_hupdate_dict)
+    subj['name'] = 'tenant2-prod'
+    subj['tenant'] = {'name': 'tenant2', 'env': 'prod'}
+    await bms.process_msg(json.dumps(subj))
+
+    # Served from the rollup rather than another fetch
+    slackbot.iter_namespaces = None
+    blocks = await slackbot.health_overview()
+    assert blocks[0].text.text == ':medical_symbol: Overall health: healthy(1), unhealthy(1)'
+    blocks = await slackbot.health_overview(tenant='tenant1')
+    assert blocks[0].text.text == ':medical_symbol: Health of tenant tenant1: healthy(1)'
+    assert len(blocks) == 1
@@ -1,6 +1,4 @@
-import pytest
-
-from bmspy import Route
+from bmspy import HealthUpdate, Route
 
 def test_init():
     # Init object
@@ -67,3 +65,19 @@ def test_check():
     assert Route.check('/tenant-(prod|stage)/', 'tenant-prod') == True
     assert Route.check('/tenant-(prod|stage)/', 'tenant-stage') == True
     assert Route.check('tenant-(prod|stage)/', 'tenant-dev') == False
+
+def test_matches_kinds(tenant1_prod_ns, deployment_hupdate_dict):
+    deployment = HealthUpdate(deployment_hupdate_dict)
+    deployment.inherit_tenant(tenant1_prod_ns)
+
+    # Namespace-only by default
+    route = Route(channel='#tenant1', namespaces=['tenant1-*'])
+    assert route.matches(tenant1_prod_ns) == True
+    assert route.matches(deployment) == False
+
+    # Workloads match on the namespace they live in
+    route = Route(channel='#tenant1', namespaces=['tenant1-prod'], kinds=['deployment'])
+    assert route.matches(tenant1_prod_ns) == False
+    assert route.matches(deployment) == True
+    route = Route(channel='#tenant1', tenants=['tenant1'], kinds=['Deployment'])
+    assert route.matches(deployment) == True
@@ -0,0 +1,80 @@
+import pytest
+
+from bmspy import Route, Silence, SilenceIndex, Silences, parse_time
+
+DAY = 86400
+
+def test_silence_matches(tenant1_prod_ns, tenant1_stage_ns, tenant2_prod_ns):
+    silence = Silence(0, 60, namespaces=['tenant1-*'], envs=['prod'])
+    assert silence.matches(tenant1_prod_ns)
+    assert not silence.matches(tenant1_stage_ns)
+    assert not silence.matches(tenant2_prod_ns)
+
+def test_silence_needs_criteria():
+    with pytest.raises(ValueError):
+        Silence(0, 60)
+    with pytest.raises(ValueError):
+        Silence(60, 0, tenants=['tenant1'])
+
+def test_recurring_occurrences():
+    silence = Silence(0, 3600, tenants=['tenant1'], every='daily', until=3 * DAY)
+    assert silence.occurrences(DAY + 1800, 10 * DAY) == [(DAY, DAY + 3600), (2 * DAY, 2 * DAY + 3600)]
+    assert silence.finished(3 * DAY + 3600)
+
+def test_from_dict():
+    silence = Silence.from_dict({'tenants': ['tenant1'], 'start': '2024-01-06T02:00:00Z', 'duration': '2h', 'every': 'weekly'})
+    assert silence.start == parse_time('2024-01-06T02:00:00+00:00')
+    assert silence.end - silence.start == 7200
+    assert silence.every == 7 * DAY
+
+def test_index_active():
+    silences = [Silence(i * 100, i * 100 + 150, tenants=[f'tenant{i}']) for i in range(1000)]
+    index = SilenceIndex(silences, 0, 200000)
+    assert [s.tenants for (s, _, _) in index.active(240)] == [{'tenant1'}, {'tenant2'}]
+    assert [s.tenants for (s, _, _) in index.active(250)] == [{'tenant2'}]
+    assert index.active(-1) == ()
+    assert index.active(150000) == ()
+
+def test_index_incremental():
+    silences = [Silence(i * 100, i * 100 + 150, tenants=[f'tenant{i}']) for i in range(100)]
+    freeze = Silence(0, 30 * 86400, tenants=['frozen'])
+    index = SilenceIndex(silences[:50], 0, 200000)
+    for silence in silences[50:] + [freeze]:
+        index.add(silence)
+    index.remove(silences[2].id)
+    assert len(index) == 100
+    # The same as a sweep over every occurrence
+    for ts in range(-50, 10200, 25):
+        expected = [s.tenants for s in [freeze] + silences if s is not silences[2] and s.start <= ts < s.end]
+        assert sorted(map(sorted, (s.tenants for (s, _, _) in index.active(ts)))) == sorted(map(sorted, expected))
+
+def test_silences_update_index(slackbot):
+    silences = Silences(slackbot)
+    silences.add(Silence(0, 100, tenants=['tenant1']))
+    index = silences._index_at(50)
+    silence = silences.add(Silence(0, 100, tenants=['tenant2']))
+    assert silences._index_at(50) is index
+    assert len(index.active(50)) == 2
+    silences.remove(silence.id)
+    assert len(index.active(50)) == 1
+
+@pytest.mark.asyncio
+async def test_router_suppresses_and_summarises(test_router, tenant1_prod_ns, tenant2_prod_ns):
+    silences = Silences(test_router.slackbot)
+    silence = silences.add(Silence(0, 4102444800, tenants=['tenant1']))
+    test_router.silences = silences
+    test_router.add_route(Route(channel='#all', namespaces=['*']))
+    await test_router.process_msg(tenant1_prod_ns)
+    await test_router.process_msg(tenant1_prod_ns)
+    await test_router.process_msg(tenant2_prod_ns)
+    messages = test_router.slackbot.messages
+    assert len(messages) == 1
+    assert silences.suppressed_total == 2
+
+    # Nothing is summarised before the window ends
+    assert await silences.flush(now=100) == 0
+    assert await silences.flush(now=silence.end) == 1
+    assert len(messages) == 2
+    assert messages[1]['channel'] == '#all'
+    assert '2 transitions were suppressed in 1 namespaces' in messages[1]['text']
+    assert len(silences) == 0
@@ -0,0 +1,62 @@
+import asyncio
+import pytest
+
+from bmspy import Route, Supervisor
+
+@pytest.mark.asyncio
+async def test_restarts_crashed_component():
+    supervisor = Supervisor(wait=0, max_wait=0)
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise RuntimeError('boom')
+        supervisor.stop()
+        await asyncio.sleep(10)
+
+    supervisor.add('flaky', flaky)
+    await asyncio.wait_for(supervisor.run(), timeout=5)
+    assert supervisor.restarts['flaky'] == 2
+
+def test_add_twice():
+    supervisor = Supervisor()
+    supervisor.add('component', asyncio.sleep)
+    with pytest.raises(ValueError):
+        supervisor.add('component', asyncio.sleep)
+
+@pytest.mark.asyncio
+async def test_drains_pending_sends(test_router, slackbot, healthy_hupdate):
+    sent = []
+    async def slow_send(channel, text, blocks=[]):
+        await asyncio.sleep(0.05)
+        sent.append(channel)
+    slackbot.send_message = slow_send
+    test_router.add_route(Route('#testing', namespaces=['testing']))
+
+    supervisor = Supervisor(drain_timeout=5)
+    async def consumer():
+        await asyncio.sleep(0)
+        supervisor.stop()
+        await test_router.process_msg(healthy_hupdate)
+    supervisor.add('consumer', consumer)
+    supervisor.add_drain(test_router.drain)
+    await asyncio.wait_for(supervisor.run(), timeout=5)
+
+    # The consumer was cancelled mid-send but the message still went out
+    assert sent == ['#testing']
+
+@pytest.mark.asyncio
+async def test_drain_deadline(test_router, slackbot, healthy_hupdate):
+    release = asyncio.Event()
+    async def stuck_send(channel, text, blocks=[]):
+        await release.wait()
+    slackbot.send_message = stuck_send
+    test_router.add_route(Route('#testing', namespaces=['testing']))
+
+    task = asyncio.create_task(test_router.process_msg(healthy_hupdate))
+    await asyncio.sleep(0)
+    assert await test_router.drain(0.01) == 1
+    release.set()
+    await task
+    assert await test_router.drain(0.01) == 0
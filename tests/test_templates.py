@@ -0,0 +1,66 @@
+import pytest
+
+from bmspy import Builder, Route, Router, Template, compile_templates
+
+# External deps
+from slack_sdk.models.blocks import Block
+
+COMPACT = {
+    'text': '{icon} {path}: {previous_state} -> {state}',
+    'blocks': [
+        {'type': 'header', 'text': '{icon} {path} is {state}'},
+        {'type': 'divider', 'when': 'errors'},
+        {'type': 'section', 'text': '{error_count} errors:\n{errors}', 'when': 'errors'},
+        {'type': 'context', 'text': 'tenant {tenant}, env {env}'},
+    ],
+}
+
+def test_render(unhealthy_hupdate):
+    (text, blocks) = Template('compact', COMPACT).render(unhealthy_hupdate)
+    assert text == ':x: testing: Unknown -> Unhealthy'
+    assert [block['type'] for block in blocks] == ['header', 'divider', 'section', 'context']
+    assert blocks[0]['text']['text'] == ':x: testing is Unhealthy'
+    for block in blocks:
+        Block.parse(block).validate_json()
+
+def test_render_skips_empty(healthy_hupdate):
+    (text, blocks) = Template('compact', COMPACT).render(healthy_hupdate)
+    assert [block['type'] for block in blocks] == ['header', 'context']
+
+def test_render_truncates(unhealthy_hupdate):
+    unhealthy_hupdate.errors.extend(['x' * 1000] * 10)
+    (_, blocks) = Template('t', {'text': '{path}', 'blocks': [{'type': 'header', 'text': '{errors}'}, {'type': 'section', 'text': '{errors}'}]}).render(unhealthy_hupdate)
+    assert len(blocks[0]['text']['text']) == 150
+    assert len(blocks[1]['text']['text']) == 3000
+
+@pytest.mark.parametrize('spec', [
+    {'blocks': []},
+    {'text': '{bogus}'},
+    {'text': '{state!r}'},
+    {'text': '{state:>10}'},
+    {'text': '{state'},
+    {'text': 'x', 'blocks': [{'type': 'image', 'text': 'x'}]},
+    {'text': 'x', 'blocks': [{'type': 'header', 'text': 'x' * 151}]},
+    {'text': 'x', 'blocks': [{'type': 'section'}]},
+    {'text': 'x', 'blocks': [{'type': 'section', 'text': 'x', 'when': 'bogus'}]},
+    {'text': 'x', 'blocks': [{'type': 'divider'}] * 51},
+    {'text': 'x', 'color': 'red'},
+])
+def test_invalid_templates(spec):
+    with pytest.raises(ValueError):
+        compile_templates({'broken': spec})
+
+@pytest.mark.asyncio
+async def test_router_templates(slackbot, unhealthy_hupdate):
+    router = Router(slackbot, templates=compile_templates({'compact': COMPACT}))
+    router.add_routes([
+        {'channel': 'plain', 'namespaces': ['testing']},
+        {'channel': 'compact', 'namespaces': ['testing'], 'template': 'compact'},
+    ])
+    await router.process_msg(unhealthy_hupdate)
+    messages = {message['channel']: message for message in slackbot.messages}
+    assert messages['#plain']['text'] == Builder.transition_msg(unhealthy_hupdate)[0].text.text
+    assert messages['#compact']['text'] == ':x: testing: Unknown -> Unhealthy'
+
+    with pytest.raises(KeyError):
+        router.add_route(Route('#other', namespaces=['testing'], template='missing'))
@@ -0,0 +1,61 @@
+import json
+import pytest
+import websockets
+
+from bmspy import WireStats, connect_options
+
+def test_connect_options():
+    assert connect_options(False) == {'compression': None}
+    options = connect_options(window_bits=10, mem_level=4)
+    assert options['compression'] == None
+    assert options['extensions'][0].server_max_window_bits == 10
+    with pytest.raises(ValueError):
+        connect_options(window_bits=16)
+    with pytest.raises(ValueError):
+        connect_options(mem_level=0)
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('compression', [True, False])
+async def test_wire_stats(compression, unhealthy_hupdate_dict):
+    frame = json.dumps(unhealthy_hupdate_dict)
+
+    async def handler(websocket, path=None):
+        for _ in range(50):
+            await websocket.send(frame)
+
+    async with websockets.serve(handler, '127.0.0.1', 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        stats = WireStats()
+        received = 0
+        async with websockets.connect(f'ws://127.0.0.1:{port}', create_protocol=stats.protocol_factory(), **connect_options(compression)) as websocket:
+            async for message in websocket:
+                received += 1
+
+    assert received == 50
+    assert stats.frames == 50
+    assert stats.payload_bytes == 50 * len(frame)
+    snapshot = stats.snapshot()
+    assert snapshot['frames'] == 50
+    if compression:
+        # Repeated frames compress well with context takeover
+        assert stats.ratio > 2
+    else:
+        assert stats.wire_bytes > stats.payload_bytes
+
+def test_rates_shared_between_readers(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('bmspy.wire.time.monotonic', lambda: now[0])
+    stats = WireStats(window=60)
+    for second in range(120):
+        now[0] = 1000.0 + second
+        stats.add_message('x' * 10)
+        stats.add_wire(5)
+        stats.snapshot()
+    now[0] = 1120.0
+    first = stats.snapshot()
+    # Another reader polling right after sees the same rates over the same window
+    second = stats.snapshot(now=1120.0)
+    assert first == second
+    assert first['rate_window'] == 60
+    assert round(first['frames_per_second'], 1) == 1.0
+    assert round(first['payload_bytes_per_second']) == 10